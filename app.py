@@ -1,10 +1,127 @@
-from flask import Flask, render_template, session, redirect, url_for, request
+from flask import Flask, render_template, stream_template, session, redirect, url_for, request, make_response, Response
 from modules.letter_logic import initialize_letter_session, save_letter_data, get_letter_data, has_submitted_letter
-from modules.santa_reply_generator import generate_santa_reply
+from modules.compression import CompressionMiddleware
+from modules.streaming import flush_head_first
+from modules import minify, fragment_cache, critical_css, metrics, timing, profiler, event_log, memory, watchdog, vitals, frames, letter_archive, letter_search, letter_rollups, letter_export, bulk_letters, letter_dedup, content_scanner, letter_maintenance
+from modules.content_scanner import scan_letter
+from modules.event_log import log_event
+from modules.letter_archive import archive_letter
+from modules.letter_dedup import reply_for
+from modules.session_interface import InstrumentedSessionInterface
+from modules.timing import timed
 import os
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'santa-secret-key-change-in-production')  # Use environment variable in production
+app.session_interface = InstrumentedSessionInterface()
+
+# Warn when the session cookie nears the browser limit; optionally trim it
+app.config['SESSION_SIZE_WARN'] = int(os.environ.get('SESSION_SIZE_WARN', 3584))
+app.config['SESSION_SIZE_LIMIT'] = int(os.environ.get('SESSION_SIZE_LIMIT', 4000))
+app.config['SESSION_TRIM'] = os.environ.get('SESSION_TRIM', '0') == '1'
+
+# Admin routes (profiling, diagnostics) are disabled unless a token is set
+app.config['ADMIN_TOKEN'] = os.environ.get('ADMIN_TOKEN')
+
+# Compress text responses (gzip, or zstd when installed) unless disabled
+if os.environ.get('COMPRESS_RESPONSES', '1') != '0':
+    app.wsgi_app = CompressionMiddleware(
+        app.wsgi_app,
+        min_size=int(os.environ.get('COMPRESS_MIN_SIZE', 500))
+    )
+
+# Minify template sources once per process as Jinja loads them
+app.config['MINIFY_HTML'] = os.environ.get('MINIFY_HTML', '1') != '0'
+minify.init_app(app)
+
+# Enable {% cache %} for shared components such as the progress bar
+fragment_cache.init_app(app)
+
+# Inline above-the-fold CSS once `flask critical-css` has built the manifest
+app.config['CRITICAL_CSS'] = os.environ.get('CRITICAL_CSS', '1') != '0'
+critical_css.init_app(app)
+
+# Per-endpoint latency, status and byte counters, served at /metrics
+if os.environ.get('METRICS_ENABLED', '1') != '0':
+    app.config['METRICS_DIR'] = os.environ.get('METRICS_DIR')
+    metrics.init_app(app)
+
+# Slow-request watchdog threshold in milliseconds (0 disables)
+slow_request_ms = float(os.environ.get('SLOW_REQUEST_MS', 2000))
+
+# Server-Timing header with session, guard, letter, reply and render phases;
+# phases are also recorded, without the header, for the slow-request watchdog
+server_timing = os.environ.get('SERVER_TIMING', '0') == '1'
+if server_timing or slow_request_ms > 0:
+    timing.init_app(app, header=server_timing,
+                    log=server_timing and os.environ.get('SERVER_TIMING_LOG', '0') == '1')
+
+# On-demand sampling profiler: POST /admin/profile or PROFILER_SIGNAL
+app.config['PROFILE_DIR'] = os.environ.get('PROFILE_DIR')
+app.config['PROFILER_SIGNAL'] = os.environ.get('PROFILER_SIGNAL')
+profiler.init_app(app)
+
+# tracemalloc snapshots and diffs under /admin/memory
+memory.init_app(
+    app,
+    trace_at_startup=os.environ.get('TRACEMALLOC', '0') == '1',
+    frames=int(os.environ.get('TRACEMALLOC_FRAMES', 1))
+)
+
+# Structured JSON event log written by a background thread
+if os.environ.get('EVENT_LOG', '1') != '0':
+    app.config['EVENT_LOG_DIR'] = os.environ.get('EVENT_LOG_DIR')
+    event_log.init_app(app, access_log=os.environ.get('EVENT_LOG_ACCESS', '1') != '0')
+
+# Capture the stack of requests slower than SLOW_REQUEST_MS, see /admin/slow-requests
+if slow_request_ms > 0:
+    watchdog.init_app(app, threshold_ms=slow_request_ms,
+                      history=int(os.environ.get('SLOW_REQUEST_HISTORY', 50)))
+
+# Real-user Web Vitals beacons, aggregated with `flask vitals-report`
+if os.environ.get('VITALS_ENABLED', '1') != '0':
+    app.config['VITALS_DIR'] = os.environ.get('VITALS_DIR')
+    vitals.init_app(app, sample_rate=float(os.environ.get('VITALS_SAMPLE_RATE', 1.0)))
+
+# Frame-time histograms from the elf and reindeer games, see `flask frames-report`
+if os.environ.get('FRAME_TELEMETRY', '1') != '0':
+    app.config['FRAMES_DIR'] = os.environ.get('FRAMES_DIR')
+    frames.init_app(app)
+
+# Redact personal details in letters and flag worrying phrases before they
+# are stored or quoted (SAFETY_LEXICON: file of `category: phrase` lines)
+if os.environ.get('CONTENT_SCANNER', '1') != '0':
+    content_scanner.init_app(app, lexicon_path=os.environ.get('SAFETY_LEXICON'))
+
+# Archive submitted letters in SQLite (LETTER_ARCHIVE_PATH, default instance/letters.db)
+if os.environ.get('LETTER_ARCHIVE', '1') != '0':
+    app.config['LETTER_ARCHIVE_PATH'] = os.environ.get('LETTER_ARCHIVE_PATH')
+    letter_archive.init_app(app, queue_size=int(os.environ.get('LETTER_ARCHIVE_QUEUE', 1000)))
+    # Full-text search over archived letters at /admin/letters/search
+    letter_search.init_app(app)
+    # Emotion/country/age counters at /admin/letters/dashboard, flask rebuild-rollups
+    letter_rollups.init_app(app)
+    # Streaming NDJSON/CSV export at /admin/letters/export, flask export-letters
+    letter_export.init_app(app)
+    # Retention and cold storage: drop letter text after LETTER_TEXT_DAYS, move
+    # letters older than LETTER_HOT_DAYS to monthly segments, then VACUUM; run
+    # by flask maintain-archive, or every LETTER_MAINTENANCE_HOURS in the workers
+    letter_maintenance.init_app(app, text_days=int(os.environ.get('LETTER_TEXT_DAYS', 0)),
+                                hot_days=int(os.environ.get('LETTER_HOT_DAYS', 0)),
+                                interval_hours=float(os.environ.get('LETTER_MAINTENANCE_HOURS', 0)))
+
+# Reuse replies of letters sent again (REPLY_CACHE_SIZE per worker); with the
+# archive also /admin/letters/duplicates and flask dedup-letters
+letter_dedup.init_app(app, cache_size=int(os.environ.get('REPLY_CACHE_SIZE', 512)))
+
+# Bulk letter intake for schools at /admin/letters/bulk and flask bulk-letters;
+# replies are written by BULK_WORKERS spawned processes
+if os.environ.get('BULK_LETTERS', '1') != '0':
+    bulk_letters.init_app(app, workers=int(os.environ.get('BULK_WORKERS', min(os.cpu_count() or 1, 4))),
+                          max_bytes=int(os.environ.get('BULK_MAX_BYTES', 20 * 1024 * 1024)))
+
+# Opt-in streaming render for the large game pages (see render_page)
+app.config['STREAM_TEMPLATES'] = os.environ.get('STREAM_TEMPLATES', '0') == '1'
 
 # Module name mapping: short names to full module names
 MODULE_MAPPING = {
@@ -51,6 +168,7 @@ def mark_complete(module_name):
     if module_name in session['modules_completed']:
         session['modules_completed'][module_name] = True
         session.modified = True
+        log_event('module.completed', module=module_name, progress=get_progress())
         return True
     return False
 
@@ -69,6 +187,7 @@ def get_progress():
     
     return progress
 
+@timed('guard')
 def all_modules_complete():
     """
     Check if all modules are completed.
@@ -79,6 +198,7 @@ def all_modules_complete():
     initialize_modules()
     return all(session['modules_completed'].values())
 
+@timed('guard')
 def is_module_accessible(module_name):
     """
     Check if a module is accessible based on sequential unlocking.
@@ -112,14 +232,52 @@ def is_module_accessible(module_name):
     
     return False
 
+def render_static_page(template_name):
+    """
+    Render a page that does not depend on the session.
+    
+    The page gets a strong ETag so browsers can revalidate it with a 304 and
+    the compression middleware can reuse its compressed body.
+    
+    Args:
+        template_name: Name of the template to render
+    
+    Returns:
+        Response: Conditional response carrying an ETag
+    """
+    response = make_response(render_template(template_name))
+    response.add_etag()
+    return response.make_conditional(request)
+
+def render_page(template_name, **context):
+    """
+    Render one of the large game pages, streaming it when enabled.
+    
+    With STREAM_TEMPLATES on, the <head> is flushed as soon as it has been
+    rendered so the browser can discover the CSS and fonts while the rest
+    of the page is still being generated. Session changes must be made
+    before calling this, since the cookie is sent with the first chunk.
+    
+    Args:
+        template_name: Name of the template to render
+        **context: Template variables
+    
+    Returns:
+        Response or str: Streaming response, or the fully rendered page
+    """
+    if not app.config['STREAM_TEMPLATES']:
+        return render_template(template_name, **context)
+    return Response(flush_head_first(stream_template(template_name, **context)),
+                    mimetype='text/html')
+
 @app.route('/')
 def index():
-    return render_template('index.html')
+    return render_static_page('index.html')
 
 @app.route('/instructions')
 def instructions():
     """Instructions page for the game."""
-    return render_template('instructions.html')
+    return render_static_page('instructions.html')
 
 @app.route('/map')
 def map():
@@ -137,10 +295,10 @@ def map():
         'emotion': is_module_accessible('emotion')
     }
     
-    return render_template('map.html', 
-                         progress=progress, 
-                         modules_completed=modules_completed,
-                         modules_accessible=modules_accessible)
+    return render_page('map.html', 
+                       progress=progress, 
+                       modules_completed=modules_completed,
+                       modules_accessible=modules_accessible)
 
 @app.route('/module/<module_name>')
 def module(module_name):
@@ -173,7 +331,7 @@ def elf_module():
     
     is_completed = session['modules_completed'].get('elf', False)
     progress = get_progress()
-    return render_template('elf_module.html', is_completed=is_completed, progress=progress)
+    return render_page('elf_module.html', is_completed=is_completed, progress=progress)
 
 @app.route('/complete_elf', methods=['POST'])
 def complete_elf():
@@ -199,7 +357,7 @@ def reindeer_module():
     
     is_completed = session['modules_completed'].get('reindeer', False)
     progress = get_progress()
-    return render_template('reindeer_module.html', is_completed=is_completed, progress=progress)
+    return render_page('reindeer_module.html', is_completed=is_completed, progress=progress)
 
 @app.route('/complete_reindeer', methods=['POST'])
 def complete_reindeer():
@@ -225,7 +383,7 @@ def ethics_module():
     
     is_completed = session['modules_completed'].get('ethics', False)
     progress = get_progress()
-    return render_template('ethics_module.html', is_completed=is_completed, progress=progress)
+    return render_page('ethics_module.html', is_completed=is_completed, progress=progress)
 
 @app.route('/complete_ethics', methods=['POST'])
 def complete_ethics():
@@ -252,7 +410,7 @@ def emotion_module():
     
     is_completed = session['modules_completed'].get('emotion', False)
     progress = get_progress()
-    return render_template('emotion_module.html', is_completed=is_completed, progress=progress)
+    return render_page('emotion_module.html', is_completed=is_completed, progress=progress)
 
 @app.route('/complete_emotion', methods=['POST'])
 def complete_emotion():
@@ -355,14 +513,27 @@ def submit_letter():
         # Redirect back to form if required fields are missing
         return redirect(url_for('letter_form'))
     
+    # Redact personal details and flag worrying phrases before anything is stored
+    form_data, redacted = scan_letter(form_data)
     save_letter_data(session, form_data)
-    
-    # Generate Santa's reply and store in session
+    log_event('letter.submitted',
+              country=form_data['country'].strip() or None,
+              age=form_data['age'].strip() or None,
+              feeling_length=len(form_data['feeling']),
+              wish_length=len(form_data['wish']),
+              memory_length=len(form_data['memory']),
+              redacted=dict(redacted) or None,
+              flags=form_data.get('flags'))
+    
+    # Generate Santa's reply (reused if this letter was just sent) and store in session
     letter_data = get_letter_data(session)
-    santa_reply = generate_santa_reply(letter_data)
+    emotion, santa_reply = reply_for(letter_data)
     session['santa_reply'] = santa_reply
     session.modified = True
     
+    # Keep the letter beyond the session; written by a background thread
+    archive_letter(letter_data, emotion=emotion, reply=santa_reply)
+    
     return redirect(url_for('santa_reply'))
 
 @app.route('/letter-to-santa/reply')
@@ -383,9 +554,9 @@ def santa_reply():
     letter_data = get_letter_data(session)
     santa_reply = session.get('santa_reply', '')
     
-    # If reply doesn't exist, generate it
+    # If reply doesn't exist (e.g. trimmed from the cookie), generate or reuse it
     if not santa_reply:
-        santa_reply = generate_santa_reply(letter_data)
+        _, santa_reply = reply_for(letter_data)
         session['santa_reply'] = santa_reply
         session.modified = True
     
@@ -413,9 +584,9 @@ def christmas_card():
     letter_data = get_letter_data(session)
     santa_reply = session.get('santa_reply', '')
     
-    # If reply doesn't exist, generate it
+    # If reply doesn't exist (e.g. trimmed from the cookie), generate or reuse it
     if not santa_reply:
-        santa_reply = generate_santa_reply(letter_data)
+        _, santa_reply = reply_for(letter_data)
         session['santa_reply'] = santa_reply
         session.modified = True
     
@@ -0,0 +1,23 @@
+"""
+Benchmarks for the Santa-ful X-mas app.
+Each benchmark is a runnable module, e.g. ``python -m benchmarks.ttfb``.
+"""
+
+MODULES = ('elf', 'reindeer', 'ethics', 'emotion')
+
+
+def player_client(app, completed=MODULES):
+    """
+    Create a test client whose session has the given modules completed.
+
+    Args:
+        app: Flask application
+        completed: Short names of the modules to mark complete
+
+    Returns:
+        FlaskClient: Client with a prepared session cookie
+    """
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['modules_completed'] = {name: name in completed for name in MODULES}
+    return client
@@ -0,0 +1,146 @@
+"""
+Archive compaction benchmark.
+Fills an archive with a year of synthetic letters (200,000 by default),
+then measures its size on disk and typical admin query latencies before
+and after maintenance: text removed after --text-days, letters older
+than --hot-days moved to monthly segments, FTS optimize and VACUUM.
+
+Queries: newest-first search (the hot tier, and both tiers), the
+dashboard for the last week and all time, and exports of the last month
+and of every letter. The filled archive is kept with --db and copied
+before maintenance, so it can be reused.
+
+First checks that a letter archived after every letter has been old
+enough to compact still gets a new id, not one already in a segment.
+
+Usage:
+    python -m benchmarks.archive_compaction [--letters 200000] [--days 365]
+                                             [--hot-days 90] [--text-days 180]
+                                             [--db PATH] [--json out.json]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from benchmarks.harness import environment, measure
+from benchmarks.letter_search import fill
+from modules import letter_archive, letter_maintenance, letter_segments
+from modules.letter_export import iter_letters
+from modules.letter_rollups import dashboard
+from modules.letter_search import search, search_cold
+
+SIZES = (('database', 'database_bytes'), ('free pages', 'free_bytes'), ('WAL', 'wal_bytes'),
+         ('segments', 'segment_bytes'))
+
+
+def check_new_ids(directory):
+    """Compact an archive of old letters, then archive one more; its id must be new."""
+    connection = letter_archive.connect(os.path.join(directory, 'ids.db'))
+    writer = letter_archive.LetterArchive(':memory:')
+    letter = {'name': 'Sam', 'feeling': 'happy', 'wish': 'a bike', 'memory': 'snow'}
+    old = time.time() - 400 * 86400
+    writer._write(connection, [letter_archive.letter_row(dict(letter, wish=f'a bike {number}'),
+                                                         'happy', 'Ho ho ho!', old + number)
+                               for number in range(3)])
+    letter_segments.compact(connection, time.time())
+    writer._write(connection, [letter_archive.letter_row(letter, 'happy', 'Ho ho ho!')])
+    newest = connection.execute('SELECT max(id) FROM letters').fetchone()[0]
+    cold_through = letter_segments.cold_through(connection)
+    connection.close()
+    assert newest > cold_through, f'new letter got id {newest}, cold tier holds up to {cold_through}'
+
+
+def search_all(connection, text):
+    """A newest-first page from the hot tier and, once there is one, the cold tier."""
+    hot = search(connection, text, sort='newest')
+    if letter_segments.cold_through(connection):
+        return hot, search_cold(connection, text)
+    return hot, None
+
+
+def queries(now):
+    return (
+        ('search newest, hot', lambda connection: search(connection, 'bike', sort='newest')),
+        ('search common, all tiers', lambda connection: search_all(connection, 'bike')),
+        ('search rare, all tiers', lambda connection: search_all(connection, 'kaleidoscope')),
+        ('dashboard, last 7 days', lambda connection: dashboard(connection, since=now - 7 * 86400)),
+        ('dashboard, all time', lambda connection: dashboard(connection)),
+        ('export last 30 days', lambda connection: sum(
+            1 for _ in iter_letters(connection, since=now - 30 * 86400))),
+        ('export everything', lambda connection: sum(1 for _ in iter_letters(connection))),
+    )
+
+
+def latencies(connection, now, repeat, min_time):
+    """Median milliseconds per query."""
+    return {label: measure(lambda query=query: query(connection), repeat, min_time)['median_us'] / 1000
+            for label, query in queries(now)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--letters', type=int, default=200000)
+    parser.add_argument('--days', type=float, default=365, help='time the letters span')
+    parser.add_argument('--hot-days', type=int, default=90)
+    parser.add_argument('--text-days', type=int, default=180)
+    parser.add_argument('--db', help='filled archive to reuse or create (default: a temporary file)')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--min-time', type=float, default=0.1)
+    parser.add_argument('--json', metavar='PATH', help='also write the results as JSON')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='santa-compaction-') as scratch:
+        check_new_ids(scratch)
+        filled = args.db or os.path.join(scratch, 'filled.db')
+        connection = letter_archive.connect(filled)
+        existing = connection.execute('SELECT count(*) FROM letters').fetchone()[0]
+        if existing < args.letters:
+            fill(connection, args.letters - existing, seed=existing,
+                 spacing=args.days * 86400 / args.letters)
+        connection.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        connection.close()
+
+        # Maintenance changes the archive in place, so work on a copy
+        path = os.path.join(scratch, 'letters.db')
+        shutil.copyfile(filled, path)
+        connection = letter_archive.connect(path)
+        now = time.time()
+        before = letter_maintenance.storage(connection)
+        timings_before = latencies(connection, now, args.repeat, args.min_time)
+        result = letter_maintenance.maintain(connection, text_days=args.text_days,
+                                             hot_days=args.hot_days)
+        after = result['after']
+        timings_after = latencies(connection, now, args.repeat, args.min_time)
+        connection.close()
+
+    print(f"{before['hot']['letters']:,} letters; maintenance took {result['seconds']:.1f}s: "
+          f"text removed from {result.get('text_removed', 0) + result.get('cold_text_removed', 0):,}, "
+          f"{result.get('compacted', 0):,} moved to {len(after['cold']['months'])} monthly segments\n")
+    print(f"{'size':<26}{'before MiB':>12}{'after MiB':>12}")
+    for label, key in SIZES:
+        print(f'{label:<26}{before[key] / 2 ** 20:>12.1f}{after[key] / 2 ** 20:>12.1f}')
+    total_before = sum(before[key] for _, key in SIZES if key != 'free_bytes')
+    total_after = sum(after[key] for _, key in SIZES if key != 'free_bytes')
+    print(f"{'total':<26}{total_before / 2 ** 20:>12.1f}{total_after / 2 ** 20:>12.1f}\n")
+
+    print(f"{'query':<26}{'before ms':>12}{'after ms':>12}")
+    for label in timings_before:
+        print(f'{label:<26}{timings_before[label]:>12.2f}{timings_after[label]:>12.2f}')
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as output:
+            json.dump({'environment': environment(), 'letters': args.letters, 'days': args.days,
+                       'hot_days': args.hot_days, 'text_days': args.text_days,
+                       'maintenance_s': result['seconds'],
+                       'bytes': {'before': {key: before[key] for _, key in SIZES},
+                                 'after': {key: after[key] for _, key in SIZES}},
+                       'ms': {'before': timings_before, 'after': timings_after}},
+                      output, indent=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Content scanner benchmark.
+Times scanning a letter (redaction and lexicon flags over wish, feeling
+and memory) at the reply pipeline's letter sizes, with and without
+personal details, and checks the medium letter (~1,200 characters)
+against a per-letter budget. Exits with status 1 when over budget.
+
+Before timing, checks that curly apostrophes flag like straight ones.
+
+Also compares the word-level Aho-Corasick lexicon with checking every
+phrase in turn, for the default lexicon and a 2,000-phrase one, to show
+that the scanner's cost doesn't grow with the lexicon.
+
+Usage:
+    python -m benchmarks.content_scanner [--budget-us 400] [--quick]
+"""
+
+import argparse
+import random
+import re
+import sys
+
+from benchmarks.harness import measure
+from benchmarks.reply_pipeline import FILLER, make_letter
+from modules.content_scanner import (DEFAULT_LEXICON, SCANNED_FIELDS, ContentScanner, Lexicon,
+                                     words)
+
+# Phrases typed with each apostrophe phone keyboards produce must flag alike
+APOSTROPHE_CHECKS = ("I don't want to be alive", 'I don\u2019t want to be alive',
+                     'I don\u2018t want to be alive')
+
+PERSONAL = ('You can email me at sam.k@example.com or ring 07700 900123. '
+            'I live at 42 Holly Tree Road, Leeds LS1 4AP.')
+
+
+def with_personal_details(letter):
+    letter = dict(letter)
+    letter['memory'] = PERSONAL + ' ' + letter['memory']
+    return letter
+
+
+def large_lexicon(size, seed=0):
+    """DEFAULT_LEXICON plus `size` made-up two and three word phrases."""
+    rng = random.Random(seed)
+    vocabulary = [f'{word}{number}' for word in FILLER for number in range(40)]
+    entries = [(category, phrase) for category, phrases in DEFAULT_LEXICON.items()
+               for phrase in phrases]
+    entries += [(f'extra{number % 10}', ' '.join(rng.sample(vocabulary, rng.randint(2, 3))))
+                for number in range(size)]
+    return entries
+
+
+def naive_flags(entries):
+    """The obvious alternative: a word-boundary regex per phrase, each run over the text."""
+    patterns = [(category, re.compile(r'\b' + r'\W+'.join(map(re.escape, words(phrase))) + r'\b'))
+                for category, phrase in entries]
+
+    def flags(letter):
+        found = set()
+        for field in SCANNED_FIELDS:
+            text = (letter.get(field) or '').lower()
+            found.update(category for category, pattern in patterns if pattern.search(text))
+        return found
+    return flags
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--budget-us', type=float, default=400.0,
+                        help='most microseconds to scan the medium letter')
+    parser.add_argument('--quick', action='store_true', help='shorter timings')
+    args = parser.parse_args()
+    timing = {'repeat': 3, 'min_time': 0.05} if args.quick else {}
+
+    scanner = ContentScanner()
+    for text in APOSTROPHE_CHECKS:
+        assert scanner.scan(text)[2] == {'self_harm'}, f'not flagged: {text!r}'
+
+    medium = None
+    print('scan_letter, default lexicon')
+    for size in ('small', 'medium', 'large'):
+        letter = make_letter(size)
+        for label, sample in (('plain', letter), ('personal', with_personal_details(letter))):
+            result = measure(lambda sample=sample: scanner.scan_letter(sample), **timing)
+            characters = sum(len(sample[field]) for field in SCANNED_FIELDS)
+            print(f'  {size:>6} {label:<8} {characters:>5} chars  {result["best_us"]:>8.1f} us')
+            if size == 'medium' and label == 'plain':
+                medium = result['best_us']
+
+    print('lexicon flags: Aho-Corasick vs a regex per phrase (medium letter)')
+    letter = make_letter('medium')
+    letter['feeling'] += ' sometimes everyone hates me'
+    for size in (0, 2000):
+        entries = large_lexicon(size)
+        automaton = ContentScanner(Lexicon(entries))
+        naive = naive_flags(entries)
+        assert automaton.scan_letter(letter)[0]['flags'] == sorted(naive(letter))
+        fast = measure(lambda: automaton.scan_letter(letter), **timing)['best_us']
+        slow = measure(lambda: naive(letter), **timing)['best_us']
+        print(f'  {len(entries):>5} phrases  automaton {fast:>8.1f} us   per phrase {slow:>9.1f} us')
+
+    failed = medium > args.budget_us
+    print(f'medium letter: {medium:.1f} us (budget {args.budget_us:.0f})')
+    print('FAIL' if failed else 'OK')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,109 @@
+"""
+Letter export memory check.
+Streams the whole archive (one million synthetic letters by default)
+through GET /admin/letters/export with the test client, in NDJSON and CSV,
+and checks that RSS and tracemalloc's peak stay within a bound however many
+letters have gone out. Exits with status 1 when a bound is exceeded.
+
+The archive is built with the letter search benchmark's generator; keep it
+between runs with --db.
+
+Usage:
+    python -m benchmarks.export_memory [--letters 1000000] [--db PATH]
+                                       [--max-rss-growth 16] [--max-traced-peak 8]
+"""
+
+import argparse
+import gc
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.letter_search import fill
+from modules import letter_archive
+from modules.memory import current_rss
+
+TOKEN = 'export-memory'
+
+
+def stream(client, output_format, checkpoints):
+    """
+    Download one export, reading RSS every `checkpoints` letters.
+
+    Returns:
+        tuple: (letters, bytes, RSS samples)
+    """
+    response = client.get(f'/admin/letters/export?format={output_format}', buffered=False,
+                          headers={'X-Admin-Token': TOKEN})
+    assert response.status_code == 200, response.status_code
+    letters = size = 0
+    samples = []
+    next_sample = checkpoints
+    for chunk in response.response:
+        size += len(chunk)
+        letters += chunk.count(b'\n')
+        if letters >= next_sample:
+            samples.append((letters, current_rss()))
+            next_sample += checkpoints
+    response.close()
+    if output_format == 'csv':
+        letters -= 1  # header; letters without newlines in their text
+    return letters, size, samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--letters', type=int, default=1000000)
+    parser.add_argument('--db', help='archive to reuse or create (default: a temporary file)')
+    parser.add_argument('--max-rss-growth', type=float, default=16.0,
+                        help='MiB between the first and the highest checkpoint')
+    parser.add_argument('--max-traced-peak', type=float, default=8.0,
+                        help='MiB allocated at once while streaming')
+    parser.add_argument('--no-trace', action='store_true',
+                        help='check RSS only; tracemalloc slows the run ~2x')
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix='santa-export-')
+    path = args.db or os.path.join(scratch, 'letters.db')
+    connection = letter_archive.connect(path)
+    existing = connection.execute('SELECT count(*) FROM letters').fetchone()[0]
+    if existing < args.letters:
+        fill(connection, args.letters - existing, seed=existing)
+    connection.close()
+
+    os.environ.update(ADMIN_TOKEN=TOKEN, LETTER_ARCHIVE_PATH=path)
+    os.environ.setdefault('EVENT_LOG_DIR', os.path.join(scratch, 'events'))
+    os.environ.setdefault('METRICS_DIR', os.path.join(scratch, 'metrics'))
+    from app import app
+    client = app.test_client()
+
+    failed = False
+    for output_format in ('ndjson', 'csv'):
+        gc.collect()
+        if not args.no_trace:
+            tracemalloc.start()
+        start = time.perf_counter()
+        letters, size, samples = stream(client, output_format, max(args.letters // 10, 1))
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] / 2 ** 20 if not args.no_trace else None
+        tracemalloc.stop()
+
+        print(f'{output_format}: {letters:,} letters, {size / 2 ** 20:,.0f} MiB in {elapsed:.1f}s '
+              f'({letters / elapsed:,.0f} letters/s)')
+        for count, rss in samples:
+            print(f'  {count:>9,} letters  rss {(rss - samples[0][1]) / 2 ** 20:+8.2f} MiB')
+        growth = (max(rss for _, rss in samples) - samples[0][1]) / 2 ** 20 if samples else 0.0
+        print(f'  RSS growth:   {growth:+.2f} MiB (limit {args.max_rss_growth})')
+        failed |= growth > args.max_rss_growth
+        if peak is not None:
+            print(f'  traced peak:  {peak:.2f} MiB (limit {args.max_traced_peak})')
+            failed |= peak > args.max_traced_peak
+
+    print('FAIL' if failed else 'OK')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,181 @@
+"""
+Micro-benchmark harness shared by the benchmark suites.
+Times callables with auto-calibrated loop counts, stores results as JSON
+baselines and compares a run against a baseline with a percentage
+threshold. Only the standard library is used, so suites run offline.
+"""
+
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines')
+
+
+def measure(func, repeat=7, min_time=0.2):
+    """
+    Time a zero-argument callable.
+
+    The loop count is doubled until one repetition takes at least
+    ``min_time`` seconds; the best repetition is the figure to compare,
+    since noise only ever adds time.
+
+    Args:
+        func: Callable to time
+        repeat: Number of timed repetitions
+        min_time: Minimum seconds per repetition
+
+    Returns:
+        dict: best_us and median_us per call, and loops per repetition
+    """
+    loops = 1
+    while True:
+        elapsed = _time_loops(func, loops)
+        if elapsed >= min_time:
+            break
+        loops *= 2 if elapsed <= 0 else max(2, min(int(min_time / elapsed) + 1, 10))
+    timings = [elapsed] + [_time_loops(func, loops) for _ in range(repeat - 1)]
+    per_call = sorted(t / loops * 1e6 for t in timings)
+    return {
+        'best_us': round(per_call[0], 4),
+        'median_us': round(statistics.median(per_call), 4),
+        'loops': loops,
+    }
+
+
+def _time_loops(func, loops):
+    start = time.perf_counter()
+    for _ in range(loops):
+        func()
+    return time.perf_counter() - start
+
+
+def run_cases(cases, name_filter=None, repeat=7, min_time=0.2, echo=print):
+    """
+    Measure every (name, callable) case whose name contains name_filter.
+
+    Returns:
+        dict: Case name to measure() result
+    """
+    results = {}
+    for name, func in cases:
+        if name_filter and name_filter not in name:
+            continue
+        results[name] = measure(func, repeat, min_time)
+        echo(f"{name:<48}{results[name]['best_us']:>12.2f} us"
+             f"{results[name]['median_us']:>12.2f} us (median)")
+    return results
+
+
+def environment():
+    """Describe the machine, so baselines from different boxes are not mixed up."""
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpus': os.cpu_count(),
+        'recorded_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    }
+
+
+def baseline_path(suite):
+    return os.path.join(BASELINE_DIR, f'{suite}.json')
+
+
+def save_baseline(path, results):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as baseline_file:
+        json.dump({'environment': environment(), 'results': results}, baseline_file,
+                  indent=1, sort_keys=True)
+        baseline_file.write('\n')
+
+
+def load_baseline(path):
+    with open(path, encoding='utf-8') as baseline_file:
+        return json.load(baseline_file)
+
+
+def compare(results, baseline, threshold):
+    """
+    Compare best-of timings against a baseline.
+
+    Args:
+        results: Current measure() results by case name
+        baseline: Loaded baseline document
+        threshold: Allowed slowdown in percent
+
+    Returns:
+        list: (name, baseline_us, current_us, change_percent, status) rows,
+              where status is 'REGRESSION', 'faster', 'ok' or 'new'
+    """
+    rows = []
+    previous = baseline.get('results', {})
+    for name, result in results.items():
+        if name not in previous:
+            rows.append((name, None, result['best_us'], None, 'new'))
+            continue
+        before = previous[name]['best_us']
+        change = (result['best_us'] - before) / before * 100 if before else 0.0
+        if change > threshold:
+            status = 'REGRESSION'
+        elif change < -threshold:
+            status = 'faster'
+        else:
+            status = 'ok'
+        rows.append((name, before, result['best_us'], change, status))
+    return rows
+
+
+def print_comparison(rows, baseline, threshold, echo=print):
+    env = baseline.get('environment', {})
+    echo(f"\nBaseline: Python {env.get('python')} on {env.get('platform')}, "
+         f"recorded {env.get('recorded_at')}; threshold {threshold:g}%")
+    if env.get('python') != platform.python_version() or env.get('machine') != platform.machine():
+        echo('Warning: baseline was recorded on a different Python or machine')
+    echo(f"{'case':<48}{'baseline':>12}{'current':>12}{'change':>9}  status")
+    for name, before, current, change, status in rows:
+        before_cell = f'{before:.2f}' if before is not None else '-'
+        change_cell = f'{change:+.1f}%' if change is not None else '-'
+        echo(f'{name:<48}{before_cell:>12}{current:>12.2f}{change_cell:>9}  {status}')
+
+
+def main_for_suite(suite, cases, description, argv=None):
+    """
+    Command line shared by the suites: run, --save a baseline, or --compare.
+
+    Returns:
+        int: Exit status, 1 when --compare found a regression
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--filter', help='only run cases whose name contains this')
+    parser.add_argument('--repeat', type=int, default=7)
+    parser.add_argument('--min-time', type=float, default=0.2,
+                        help='seconds per timed repetition')
+    parser.add_argument('--save', nargs='?', const=baseline_path(suite), metavar='PATH',
+                        help=f'write a baseline (default {os.path.relpath(baseline_path(suite))})')
+    parser.add_argument('--compare', nargs='?', const=baseline_path(suite), metavar='PATH',
+                        help='compare against a baseline and exit 1 on regressions')
+    parser.add_argument('--threshold', type=float, default=10.0,
+                        help='allowed slowdown in percent for --compare')
+    args = parser.parse_args(argv)
+
+    results = run_cases(cases(), args.filter, args.repeat, args.min_time)
+    if args.save:
+        save_baseline(args.save, results)
+        print(f'\nSaved baseline to {args.save}')
+    if args.compare:
+        baseline = load_baseline(args.compare)
+        rows = compare(results, baseline, args.threshold)
+        print_comparison(rows, baseline, args.threshold)
+        regressions = [row for row in rows if row[4] == 'REGRESSION']
+        if regressions:
+            print(f'\n{len(regressions)} regression(s) beyond {args.threshold:g}%', file=sys.stderr)
+            return 1
+    return 0
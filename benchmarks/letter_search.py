@@ -0,0 +1,162 @@
+"""
+Letter search benchmark.
+Fills an archive with synthetic letters (one million by default) through
+the normal insert path, so the FTS5 triggers do their incremental work,
+then times typical moderator queries: common and rare words, prefixes,
+phrases, OR and NOT, ranked and newest-first, first and deep pages. A
+LIKE scan over the same letters is timed for comparison.
+
+The database is kept between runs with --db, since filling it takes a
+while.
+
+Usage:
+    python -m benchmarks.letter_search [--letters 1000000] [--db PATH]
+                                        [--repeat 5] [--json out.json]
+"""
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+from benchmarks.harness import environment, measure
+from modules import letter_archive
+from modules.letter_search import search
+
+# Zipf-like vocabulary: early words are far more common than late ones
+VOCABULARY = (
+    'i', 'a', 'and', 'the', 'my', 'want', 'for', 'christmas', 'to', 'with', 'family', 'love',
+    'snow', 'toys', 'presents', 'happy', 'grandma', 'cookies', 'tree', 'lights', 'puppy',
+    'bike', 'books', 'games', 'dog', 'cat', 'sister', 'brother', 'school', 'friends',
+    'winter', 'sledding', 'hot', 'chocolate', 'carols', 'stars', 'kitten', 'helmet', 'lego',
+    'doll', 'train', 'skates', 'scooter', 'guitar', 'drawing', 'paints', 'telescope',
+    'dinosaur', 'rocket', 'robot', 'unicorn', 'bicycle', 'mittens', 'reindeer', 'sleigh',
+    'gingerbread', 'ornaments', 'fireplace', 'stocking', 'snowman', 'penguin', 'volcano',
+    'microscope', 'trampoline', 'harmonica', 'xylophone', 'aquarium',
+)
+WEIGHTS = [1 / (rank + 1) ** 1.2 for rank in range(len(VOCABULARY))]
+# Words that appear in about one wish in RARE_ODDS
+RARE = ('kaleidoscope', 'theremin', 'narwhal')
+RARE_ODDS = 5000
+COUNTRIES = ('Canada', 'India', 'Brazil', 'Norway', 'Kenya', 'Japan', 'Mexico', 'France')
+EMOTIONS = ('happy', 'sad', 'excited', 'worried', 'hopeful', 'grateful', 'lonely', 'neutral')
+
+QUERIES = (
+    ('common word', 'christmas', 'rank'),
+    ('mid word', 'bike', 'rank'),
+    ('rare word', 'kaleidoscope', 'rank'),
+    ('prefix', 'bi*', 'rank'),
+    ('phrase', '"hot chocolate"', 'rank'),
+    ('two words', 'puppy helmet', 'rank'),
+    ('or', 'puppy OR kitten', 'rank'),
+    ('not', 'bike -scooter', 'rank'),
+    ('common word, newest', 'christmas', 'newest'),
+    ('mid word, newest', 'bike', 'newest'),
+    ('rare word, newest', 'kaleidoscope', 'newest'),
+)
+DEEP_PAGES = 50
+
+
+def text(rng, low, high):
+    return ' '.join(rng.choices(VOCABULARY, WEIGHTS, k=rng.randint(low, high)))
+
+
+def fill(connection, letters, seed=0, batch_size=10000, spacing=7.5):
+    """
+    Insert synthetic letters in batched transactions, like the archive writer.
+    Letters are `spacing` seconds apart, from 90 days ago (or earlier, so
+    the last one is not in the future).
+
+    Returns:
+        float: Letters inserted per second
+    """
+    rng = random.Random(seed)
+    start_time = time.time() - max(90 * 86400, letters * spacing)
+    archive = letter_archive.LetterArchive(':memory:')
+    begin = time.perf_counter()
+    for start in range(0, letters, batch_size):
+        batch = []
+        for number in range(start, min(start + batch_size, letters)):
+            letter = {
+                'name': f'Player {number}', 'age': rng.randint(4, 90),
+                'gender': rng.choice(('girl', 'boy', 'other')), 'country': rng.choice(COUNTRIES),
+                'feeling': text(rng, 4, 40), 'wish': text(rng, 3, 25), 'memory': text(rng, 3, 30),
+            }
+            if rng.randrange(RARE_ODDS) == 0:
+                letter['wish'] += ' ' + rng.choice(RARE)
+            batch.append(letter_archive.letter_row(letter, rng.choice(EMOTIONS), 'Ho ho ho!',
+                                                   start_time + number * spacing))
+        if not archive._write(connection, batch):
+            raise RuntimeError('insert failed')
+        print(f'\rfilled {min(start + batch_size, letters):>9,} letters', end='', flush=True)
+    elapsed = time.perf_counter() - begin
+    print()
+    return letters / elapsed
+
+
+def deep_cursor(connection, query, sort):
+    """Follow `next` for DEEP_PAGES pages and return the cursor of the page after."""
+    after = None
+    for _ in range(DEEP_PAGES):
+        after = search(connection, query, sort=sort, after=after)['next']
+        if after is None:
+            break
+    return after
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--letters', type=int, default=1000000)
+    parser.add_argument('--db', help='archive to reuse or create (default: a temporary file)')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--min-time', type=float, default=0.2)
+    parser.add_argument('--json', metavar='PATH', help='also write the results as JSON')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='santa-search-') as scratch:
+        path = args.db or os.path.join(scratch, 'letters.db')
+        connection = letter_archive.connect(path)
+        existing = connection.execute('SELECT count(*) FROM letters').fetchone()[0]
+        insert_rate = None
+        if existing < args.letters:
+            insert_rate = fill(connection, args.letters - existing, seed=existing)
+            print(f'inserted {insert_rate:,.0f} letters/s (including FTS triggers)')
+        total = connection.execute('SELECT count(*) FROM letters').fetchone()[0]
+        size = os.path.getsize(path)
+        print(f'{total:,} letters, {size / 2 ** 20:,.0f} MiB on disk\n')
+
+        results = {}
+        print(f"{'query':<34}{'hits':>9}{'page 1 ms':>11}{'deep ms':>10}")
+        for label, query, sort in QUERIES:
+            hits = connection.execute(
+                'SELECT count(*) FROM letters_fts WHERE letters_fts MATCH ?',
+                (search(connection, query, limit=1)['match'],)).fetchone()[0]
+            first = measure(lambda: search(connection, query, sort=sort), args.repeat, args.min_time)
+            after = deep_cursor(connection, query, sort)
+            deep = measure(lambda: search(connection, query, sort=sort, after=after),
+                           args.repeat, args.min_time) if after else None
+            results[label] = {'query': query, 'sort': sort, 'hits': hits,
+                              'first_page_ms': first['median_us'] / 1000,
+                              'deep_page_ms': deep['median_us'] / 1000 if deep else None}
+            deep_text = f"{deep['median_us'] / 1000:>10.2f}" if deep else f"{'-':>10}"
+            print(f"{label:<34}{hits:>9,}{first['median_us'] / 1000:>11.2f}{deep_text}")
+
+        # What the index saves: a substring scan of every letter
+        like = measure(lambda: connection.execute(
+            "SELECT id FROM letters WHERE wish LIKE ? OR feeling LIKE ? OR memory LIKE ?",
+            ('%kaleidoscope%',) * 3).fetchall(), 3, 0)
+        results['like scan, rare word'] = {'first_page_ms': like['median_us'] / 1000}
+        print(f"{'LIKE scan, rare word':<34}{'':>9}{like['median_us'] / 1000:>11.2f}")
+        connection.close()
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as output:
+            json.dump({'environment': environment(), 'letters': total, 'db_bytes': size,
+                       'insert_per_s': insert_rate, 'deep_page': DEEP_PAGES + 1,
+                       'results': results}, output, indent=1)
+
+
+if __name__ == '__main__':
+    main()
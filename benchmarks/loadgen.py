@@ -0,0 +1,377 @@
+"""
+End-to-end funnel load generator.
+Virtual players walk the whole funnel against a real server: /,
+/instructions, /map, each module page and its complete_* POST (following
+the redirect back to the map, as a browser would), the letter form, submit
+(following the redirect to the reply) and the card. Each journey is a new
+player with its own cookie jar, and players pause between steps with
+log-normal think times.
+
+The HTTP/1.1 client is a minimal asyncio one over plain sockets, so the
+tool needs nothing beyond the standard library. By default it starts
+gunicorn on a free local port; pass --url to load an existing server.
+
+Usage:
+    python -m benchmarks.loadgen [--users 50] [--duration 60] [--ramp 10]
+                                 [--think-scale 1.0] [--workers 2]
+                                 [--url http://127.0.0.1:8000] [--json out.json]
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from urllib.parse import urlencode, urlsplit
+
+from benchmarks import MODULES
+from benchmarks.server import free_port, start_gunicorn, stop_gunicorn, wait_for_port
+
+# Median think time in seconds before each step; a game takes a while to play
+THINK_MEDIANS = {
+    'index': 1.0, 'instructions': 2.0, 'map': 8.0, 'module': 3.0, 'complete': 25.0,
+    'letter_form': 3.0, 'submit': 60.0, 'card': 15.0,
+}
+THINK_SIGMA = 0.6
+
+WORDS = ('snow', 'sleigh', 'cocoa', 'puppy', 'grandma', 'cookies', 'lights', 'happy',
+         'family', 'presents', 'bicycle', 'books', 'hugs', 'carols', 'hopeful', 'tree')
+
+
+class HttpError(Exception):
+    pass
+
+
+class HttpConnection:
+    """One keep-alive HTTP/1.1 connection that reconnects when the server closes it."""
+
+    def __init__(self, host, port, timeout):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.reader = None
+        self.writer = None
+
+    async def request(self, method, path, headers, body=b''):
+        """
+        Send a request and read the whole response.
+
+        Returns:
+            tuple: (status, list of (name, value) headers, body bytes)
+        """
+        reused = self.writer is not None
+        try:
+            return await asyncio.wait_for(self._exchange(method, path, headers, body),
+                                          self.timeout)
+        except (ConnectionError, asyncio.IncompleteReadError, HttpError):
+            self.close()
+            if not reused:
+                raise
+        # A reused keep-alive connection may have been closed by the server
+        return await asyncio.wait_for(self._exchange(method, path, headers, body), self.timeout)
+
+    async def _exchange(self, method, path, headers, body):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        lines = [f'{method} {path} HTTP/1.1', f'Host: {self.host}:{self.port}']
+        lines += [f'{name}: {value}' for name, value in headers]
+        if body or method == 'POST':
+            lines.append(f'Content-Length: {len(body)}')
+        self.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise HttpError('connection closed before the response')
+        version, status, _ = status_line.decode('latin-1').split(' ', 2)
+        response_headers = []
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            response_headers.append((name.strip().lower(), value.strip()))
+        fields = dict(response_headers)
+
+        if method == 'HEAD' or status in ('204', '304'):
+            data = b''
+        elif 'chunked' in fields.get('transfer-encoding', ''):
+            data = await self._read_chunked()
+        elif 'content-length' in fields:
+            data = await self.reader.readexactly(int(fields['content-length']))
+        else:
+            data = await self.reader.read()
+            fields['connection'] = 'close'
+
+        if fields.get('connection', '').lower() == 'close' or version == 'HTTP/1.0':
+            self.close()
+        return int(status), response_headers, data
+
+    async def _read_chunked(self):
+        parts = []
+        while True:
+            size = int((await self.reader.readline()).split(b';')[0], 16)
+            if size == 0:
+                while (await self.reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass  # trailers
+                return b''.join(parts)
+            parts.append(await self.reader.readexactly(size + 2))
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+class Player:
+    """A browser-like client: cookie jar, redirects, gzip accepted."""
+
+    def __init__(self, connection, stats):
+        self.connection = connection
+        self.stats = stats
+        self.cookies = {}
+
+    async def visit(self, step, method, path, form=None, expect=200, follow=False):
+        """Request a page and record its latency under `step`."""
+        body = urlencode(form).encode() if form else b''
+        headers = [('Accept', 'text/html'), ('Accept-Encoding', 'gzip'),
+                   ('User-Agent', 'santa-loadgen')]
+        if form is not None:
+            headers.append(('Content-Type', 'application/x-www-form-urlencoded'))
+        if self.cookies:
+            headers.append(('Cookie', '; '.join(f'{k}={v}' for k, v in self.cookies.items())))
+
+        start = time.perf_counter()
+        try:
+            status, response_headers, data = await self.connection.request(
+                method, path, headers, body)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError,
+                HttpError, ValueError) as exc:
+            self.connection.close()
+            self.stats.record(step, time.perf_counter() - start, 0, error=type(exc).__name__)
+            return False
+        elapsed = time.perf_counter() - start
+
+        location = None
+        for name, value in response_headers:
+            if name == 'set-cookie':
+                self._store_cookie(value)
+            elif name == 'location':
+                location = value
+        ok = status == expect
+        self.stats.record(step, elapsed, len(data),
+                          error=None if ok else f'HTTP {status}')
+        if ok and follow and location:
+            target = urlsplit(location)
+            target_path = target.path + (f'?{target.query}' if target.query else '')
+            return await self.visit(target.path.rstrip('/').split('/')[-1] or 'index',
+                                    'GET', target_path)
+        return ok
+
+    def _store_cookie(self, header):
+        pair, *attributes = header.split(';')
+        name, _, value = pair.strip().partition('=')
+        expired = any(a.strip().lower().startswith(('max-age=0', 'expires=thu, 01 jan 1970'))
+                      for a in attributes)
+        if expired or not value:
+            self.cookies.pop(name, None)
+        else:
+            self.cookies[name] = value
+
+
+class Stats:
+    """Latencies, bytes and errors per funnel step."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(lambda: defaultdict(int))
+        self.bytes = defaultdict(int)
+        self.journeys = 0
+        self.failed_journeys = 0
+
+    def record(self, step, seconds, size, error=None):
+        self.latencies[step].append(seconds)
+        self.bytes[step] += size
+        if error:
+            self.errors[step][error] += 1
+
+
+def letter_form(rng):
+    def text(words):
+        return ' '.join(rng.choice(WORDS) for _ in range(words))
+    return {
+        'name': f'Player {rng.randrange(10 ** 6)}',
+        'age': str(rng.randint(4, 90)),
+        'gender': rng.choice(('girl', 'boy', 'other')),
+        'country': rng.choice(('Canada', 'India', 'Brazil', 'Norway', 'Kenya', 'Japan')),
+        'feeling': text(rng.randint(5, 80)),
+        'wish': text(rng.randint(3, 40)),
+        'memory': text(rng.randint(3, 40)),
+    }
+
+
+async def think(rng, kind, scale):
+    if scale > 0:
+        median = THINK_MEDIANS[kind] * scale
+        await asyncio.sleep(rng.lognormvariate(math.log(median), THINK_SIGMA))
+
+
+async def journey(player, rng, think_scale):
+    """Walk the funnel once; stop at the first failed step, like a real player would."""
+    steps = [('index', 'index', 'GET', '/', {}),
+             ('instructions', 'instructions', 'GET', '/instructions', {}),
+             ('map', 'map', 'GET', '/map', {})]
+    for name in MODULES:
+        steps.append(('module', name, 'GET', f'/{name}', {}))
+        steps.append(('complete', f'complete_{name}', 'POST', f'/complete_{name}',
+                      {'form': {'choice': 'share'}, 'expect': 302, 'follow': True}))
+    steps += [('letter_form', 'letter_form', 'GET', '/letter-to-santa/form', {}),
+              ('submit', 'submit', 'POST', '/letter-to-santa/submit',
+               {'form': letter_form(rng), 'expect': 302, 'follow': True}),
+              ('card', 'card', 'GET', '/letter-to-santa/card', {})]
+
+    for kind, step, method, path, options in steps:
+        await think(rng, kind, think_scale)
+        if not await player.visit(step, method, path, **options):
+            return False
+    return True
+
+
+async def virtual_user(index, host, port, args, stats, deadline):
+    rng = random.Random(index)
+    # Spread the start of the users over the ramp-up period
+    await asyncio.sleep(args.ramp * index / max(args.users, 1))
+    connection = HttpConnection(host, port, args.timeout)
+    try:
+        while time.monotonic() < deadline:
+            player = Player(connection, stats)
+            if await journey(player, rng, args.think_scale):
+                stats.journeys += 1
+            else:
+                stats.failed_journeys += 1
+    finally:
+        connection.close()
+
+
+async def run_load(host, port, args):
+    stats = Stats()
+    deadline = time.monotonic() + args.duration
+    users = [asyncio.create_task(virtual_user(i, host, port, args, stats, deadline))
+             for i in range(args.users)]
+    start = time.perf_counter()
+    # Journeys in flight at the deadline get one request timeout to finish
+    await asyncio.wait(users, timeout=args.duration + args.timeout)
+    for task in users:
+        task.cancel()
+    await asyncio.gather(*users, return_exceptions=True)
+    return stats, time.perf_counter() - start
+
+
+def percentile(sorted_values, pct):
+    rank = max(math.ceil(pct / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+def summarise(stats, elapsed):
+    rows = {}
+    for step, samples in stats.latencies.items():
+        samples = sorted(samples)
+        errors = sum(stats.errors[step].values())
+        rows[step] = {
+            'requests': len(samples),
+            'rps': len(samples) / elapsed,
+            'errors': errors,
+            'error_rate': errors / len(samples),
+            'error_kinds': dict(stats.errors[step]),
+            'p50_ms': percentile(samples, 50) * 1000,
+            'p90_ms': percentile(samples, 90) * 1000,
+            'p99_ms': percentile(samples, 99) * 1000,
+            'max_ms': samples[-1] * 1000,
+            'kb_per_request': stats.bytes[step] / len(samples) / 1024,
+        }
+    return rows
+
+
+def print_report(rows, stats, elapsed, args):
+    total = sum(row['requests'] for row in rows.values())
+    errors = sum(row['errors'] for row in rows.values())
+    print(f'\n{args.users} players for {elapsed:.1f}s (think scale {args.think_scale:g}): '
+          f'{total} requests, {total / elapsed:.1f} req/s, '
+          f'{errors} errors ({100 * errors / max(total, 1):.2f}%), '
+          f'{stats.journeys} journeys completed, {stats.failed_journeys} failed')
+    print(f"{'step':<18}{'requests':>9}{'req/s':>8}{'errors':>8}{'p50 ms':>9}{'p90 ms':>9}"
+          f"{'p99 ms':>9}{'max ms':>9}{'KB':>7}")
+    for step, row in rows.items():
+        print(f"{step:<18}{row['requests']:>9}{row['rps']:>8.1f}"
+              f"{100 * row['error_rate']:>7.1f}%{row['p50_ms']:>9.1f}{row['p90_ms']:>9.1f}"
+              f"{row['p99_ms']:>9.1f}{row['max_ms']:>9.1f}{row['kb_per_request']:>7.1f}")
+    for step, row in rows.items():
+        if row['error_kinds']:
+            print(f"  {step}: {', '.join(f'{k} x{n}' for k, n in row['error_kinds'].items())}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=50, help='concurrent virtual players')
+    parser.add_argument('--duration', type=float, default=60.0, help='seconds of load')
+    parser.add_argument('--ramp', type=float, default=10.0, help='seconds to start all players')
+    parser.add_argument('--think-scale', type=float, default=1.0,
+                        help='multiplier for think times; 0 sends requests back to back')
+    parser.add_argument('--timeout', type=float, default=10.0, help='per-request timeout')
+    parser.add_argument('--url', help='target an already running server instead')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers to start')
+    parser.add_argument('--worker-class', default='sync')
+    parser.add_argument('--threads', type=int, default=1)
+    parser.add_argument('--json', metavar='PATH', help='also write the results as JSON')
+    parser.add_argument('--max-error-rate', type=float, default=1.0,
+                        help='exit 1 when more than this percentage of requests fail')
+    args = parser.parse_args()
+
+    server = scratch = None
+    if args.url:
+        target = urlsplit(args.url)
+        host, port = target.hostname, target.port or 80
+    else:
+        host, port = '127.0.0.1', free_port()
+        # Keep the run's telemetry and letters out of the instance folder (gunicorn
+        # also clears METRICS_DIR on start); the archive still takes every letter,
+        # so its cost is part of the run
+        scratch = tempfile.mkdtemp(prefix='santa-loadgen-')
+        env = {name: os.path.join(scratch, folder) for name, folder in (
+            ('EVENT_LOG_DIR', 'events'), ('VITALS_DIR', 'vitals'), ('FRAMES_DIR', 'frames'),
+            ('METRICS_DIR', 'metrics'), ('PROFILE_DIR', 'profiles'),
+            ('LETTER_ARCHIVE_PATH', 'letters.db'))}
+        env.update(EVENT_LOG='0', VITALS_ENABLED='0')
+        server = start_gunicorn(port, host, args.workers, args.worker_class, args.threads, env=env)
+        wait_for_port(port, host, process=server)
+        print(f'Started gunicorn on {host}:{port} with {args.workers} '
+              f'{args.worker_class} worker(s)')
+
+    try:
+        stats, elapsed = asyncio.run(run_load(host, port, args))
+    finally:
+        if server is not None:
+            stop_gunicorn(server)
+        if scratch is not None:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    rows = summarise(stats, elapsed)
+    print_report(rows, stats, elapsed, args)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as output:
+            json.dump({'users': args.users, 'duration_s': elapsed, 'think_scale': args.think_scale,
+                       'journeys': stats.journeys, 'failed_journeys': stats.failed_journeys,
+                       'steps': rows}, output, indent=1)
+    total = sum(row['requests'] for row in rows.values())
+    errors = sum(row['errors'] for row in rows.values())
+    return 1 if not total or 100 * errors / total > args.max_error_rate else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
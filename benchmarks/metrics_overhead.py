@@ -0,0 +1,78 @@
+"""
+Per-request overhead of the /metrics instrumentation.
+Times RequestMetrics.observe() on its own and compares full requests to a
+small page through the test client with and without the request hooks.
+
+Both apps are warmed up first, then timed in alternating rounds of
+repeated measurements, so drift on a busy machine hits both alike. The
+overhead is the median over the rounds, with its range.
+
+Usage:
+    python -m benchmarks.metrics_overhead [--warmup 2000] [--rounds 5]
+                                          [--repeat 7] [--min-time 0.2]
+"""
+
+import argparse
+import statistics
+import tempfile
+
+from flask import Flask
+
+from benchmarks.harness import measure
+from modules import metrics
+
+
+def make_app(instrumented, directory):
+    app = Flask(__name__)
+
+    @app.route('/ping')
+    def ping():
+        return 'pong'
+
+    if instrumented:
+        app.config['METRICS_DIR'] = directory
+        metrics.init_app(app)
+    return app
+
+
+def request_ping(app, warmup):
+    """A callable that requests /ping, after `warmup` untimed requests."""
+    client = app.test_client()
+    for _ in range(warmup):
+        client.get('/ping')
+    return lambda: client.get('/ping')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--warmup', type=int, default=2000, help='untimed requests per app')
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=7)
+    parser.add_argument('--min-time', type=float, default=0.2)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        recorder = metrics.RequestMetrics(make_app(False, directory), directory)
+        recorder.observe('ping', 200, 0.01, 4)  # map the file outside the timing
+        observe = measure(lambda: recorder.observe('ping', 200, 0.01, 4),
+                          args.repeat, args.min_time)['best_us']
+        plain_ping = request_ping(make_app(False, directory), args.warmup)
+        instrumented_ping = request_ping(make_app(True, directory), args.warmup)
+        plain, instrumented = [], []
+        for _ in range(args.rounds):
+            plain.append(measure(plain_ping, args.repeat, args.min_time)['best_us'])
+            instrumented.append(measure(instrumented_ping, args.repeat, args.min_time)['best_us'])
+
+    overheads = sorted(100 * (with_metrics - without) / without
+                       for without, with_metrics in zip(plain, instrumented))
+    print(f'observe():              {observe:8.2f} us/call')
+    print(f'request, no metrics:    {statistics.median(plain):8.2f} us')
+    print(f'request, with metrics:  {statistics.median(instrumented):8.2f} us')
+    print(f'overhead per request:   '
+          f'{statistics.median(instrumented) - statistics.median(plain):8.2f} us '
+          f'({statistics.median(overheads):.1f}%, {overheads[0]:.1f}% to {overheads[-1]:.1f}% '
+          f'over {args.rounds} rounds)')
+
+
+if __name__ == '__main__':
+    main()
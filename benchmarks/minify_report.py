@@ -0,0 +1,77 @@
+"""
+Report the bytes saved by HTML minification on every page.
+Walks the full player journey (all modules complete, letter submitted) and
+renders each page with MINIFY_HTML off and on.
+
+Usage:
+    python -m benchmarks.minify_report
+"""
+
+import gzip
+import os
+
+# The sample letters are not worth archiving; set before the app reads it
+os.environ['LETTER_ARCHIVE'] = '0'
+
+from app import app
+from benchmarks import player_client
+
+ROUTES = (
+    '/',
+    '/instructions',
+    '/map',
+    '/elf',
+    '/reindeer',
+    '/ethics',
+    '/emotion',
+    '/finale',
+    '/letter-to-santa',
+    '/letter-to-santa/form',
+    '/letter-to-santa/reply',
+    '/letter-to-santa/card',
+)
+
+LETTER = {
+    'name': 'Sam',
+    'age': '9',
+    'country': 'Finland',
+    'feeling': 'I feel happy and a little nervous about the holidays.',
+    'wish': 'A red bike and snow on Christmas morning.',
+    'memory': 'Baking cookies with my grandma last winter.',
+}
+
+
+def render_routes(minified):
+    """Render every route and return the body size in bytes per route."""
+    app.config['MINIFY_HTML'] = minified
+    app.jinja_env.cache.clear()
+    app.jinja_env.fragment_cache.clear()
+    client = player_client(app)
+    sizes = {}
+    for route in ROUTES:
+        if route == '/letter-to-santa/reply':
+            client.post('/letter-to-santa/submit', data=LETTER)
+        body = client.get(route).data
+        sizes[route] = (len(body), len(gzip.compress(body)))
+    return sizes
+
+
+def main():
+    original = render_routes(False)
+    minified = render_routes(True)
+
+    print(f"{'route':<24}{'original':>10}{'minified':>10}{'saved':>8}{'gzip saved':>12}")
+    total_original = total_minified = 0
+    for route in ROUTES:
+        raw_before, gz_before = original[route]
+        raw_after, gz_after = minified[route]
+        total_original += raw_before
+        total_minified += raw_after
+        saved = 100 * (raw_before - raw_after) / raw_before
+        print(f"{route:<24}{raw_before:>10}{raw_after:>10}{saved:>7.1f}%{gz_before - gz_after:>12}")
+    saved = 100 * (total_original - total_minified) / total_original
+    print(f"{'total':<24}{total_original:>10}{total_minified:>10}{saved:>7.1f}%")
+
+
+if __name__ == '__main__':
+    main()
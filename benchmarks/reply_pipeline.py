@@ -0,0 +1,123 @@
+"""
+Reply pipeline benchmarks.
+Covers emotion detection, reply generation across letter sizes and field
+combinations, the save/get letter round trip and signing/verifying the
+session cookie that carries the letter and reply.
+
+Usage:
+    python -m benchmarks.reply_pipeline                # run
+    python -m benchmarks.reply_pipeline --save         # write the baseline
+    python -m benchmarks.reply_pipeline --compare      # exit 1 on >10% slowdowns
+    python -m benchmarks.reply_pipeline --compare --threshold 25 --filter reply
+"""
+
+import random
+import sys
+
+from flask import Flask
+from flask.sessions import SecureCookieSession, SecureCookieSessionInterface
+
+from benchmarks.harness import main_for_suite
+from modules.letter_logic import get_letter_data, save_letter_data
+from modules.santa_reply_generator import detect_emotion_from_text, generate_santa_reply
+
+SUITE = 'reply_pipeline'
+
+FILLER = ('snow', 'family', 'cookies', 'lights', 'winter', 'presents', 'music', 'stars',
+          'school', 'friends', 'garden', 'travel', 'books', 'dinner', 'morning', 'candles')
+
+# Approximate characters per free-text field
+SIZES = {'small': 40, 'medium': 400, 'large': 2000}
+
+
+def filler_text(rng, length, keyword=None):
+    """Deterministic prose of about `length` characters, optionally ending in a keyword."""
+    words = []
+    while sum(len(word) + 1 for word in words) < length:
+        words.append(rng.choice(FILLER))
+    if keyword:
+        words[-1] = keyword
+    return ' '.join(words)
+
+
+def make_letter(size, fields=('feeling', 'wish', 'memory'), keyword='hopeful'):
+    rng = random.Random(f'{size}-{fields}')
+    letter = {'name': 'Alex', 'age': '9', 'gender': 'other', 'country': 'Norway'}
+    for field in ('feeling', 'wish', 'memory'):
+        if field in fields:
+            letter[field] = filler_text(rng, SIZES[size], keyword if field == 'feeling' else None)
+        else:
+            letter[field] = ''
+    return letter
+
+
+def seeded(func, *args):
+    """Reseed the reply templates' random choices so every call does the same work."""
+    def call():
+        random.seed(0)
+        return func(*args)
+    return call
+
+
+def cases():
+    rng = random.Random(0)
+    result = []
+
+    # Emotion detection: early keyword hit, late hit and no hit at all
+    for size, length in SIZES.items():
+        result.append((f'detect_emotion/{size}/first_emotion',
+                       _bind(detect_emotion_from_text, filler_text(rng, length, 'happy'))))
+        result.append((f'detect_emotion/{size}/last_emotion',
+                       _bind(detect_emotion_from_text, filler_text(rng, length, 'content'))))
+        result.append((f'detect_emotion/{size}/no_match',
+                       _bind(detect_emotion_from_text, filler_text(rng, length))))
+
+    # Reply generation across sizes and field combinations
+    combinations = {
+        'all_fields': ('feeling', 'wish', 'memory'),
+        'feeling_only': ('feeling',),
+        'wish_only': ('wish',),
+        'no_text': (),
+    }
+    for size in SIZES:
+        for label, fields in combinations.items():
+            if not fields and size != 'small':
+                continue  # identical work at every size
+            letter = make_letter(size, fields)
+            result.append((f'generate_reply/{size}/{label}', seeded(generate_santa_reply, letter)))
+
+    # save_letter_data + get_letter_data on a fresh session, as in submit_letter
+    for size in SIZES:
+        form = make_letter(size)
+
+        def round_trip(form=form):
+            session = SecureCookieSession()
+            save_letter_data(session, form)
+            return get_letter_data(session)
+        result.append((f'letter_round_trip/{size}', round_trip))
+
+    # Signing and verifying the session cookie
+    app = Flask(__name__)
+    app.secret_key = 'benchmark-secret'
+    serializer = SecureCookieSessionInterface().get_signing_serializer(app)
+    progress = {'modules_completed': {'elf': True, 'reindeer': True, 'ethics': True,
+                                      'emotion': True}}
+    for size in ('empty', *SIZES):
+        session = dict(progress)
+        if size != 'empty':
+            letter = make_letter(size)
+            letter['submitted'] = True
+            random.seed(0)
+            session.update(letter_data=letter, santa_reply=generate_santa_reply(letter))
+        cookie = serializer.dumps(session)
+        result.append((f'session/{size}/serialize', _bind(serializer.dumps, session)))
+        result.append((f'session/{size}/verify', _bind(serializer.loads, cookie)))
+    return result
+
+
+def _bind(func, *args):
+    return lambda: func(*args)
+
+
+if __name__ == '__main__':
+    sys.exit(main_for_suite(SUITE, cases, __doc__.strip().splitlines()[0]))
@@ -0,0 +1,81 @@
+"""
+Helpers for benchmarks that run the app under a real gunicorn.
+"""
+
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port(host='127.0.0.1'):
+    """Ask the OS for a TCP port nobody is listening on."""
+    with socket.socket() as probe:
+        probe.bind((host, 0))
+        return probe.getsockname()[1]
+
+
+def start_gunicorn(port, host='127.0.0.1', workers=2, worker_class='sync', threads=1,
+                   env=None, extra_args=(), python_args=(), stderr=None):
+    """
+    Launch ``gunicorn app:app`` from the project root.
+
+    Args:
+        port: Port to bind
+        host: Interface to bind
+        workers: Number of worker processes
+        worker_class: Gunicorn worker class, e.g. 'sync' or 'gthread'
+        threads: Threads per worker (gthread)
+        env: Extra environment variables
+        extra_args: Additional gunicorn command line arguments
+        python_args: Interpreter options, e.g. ('-X', 'importtime')
+        stderr: Where gunicorn's log goes (default: discarded)
+
+    Returns:
+        subprocess.Popen: The gunicorn master process
+    """
+    command = [sys.executable, *python_args, '-m', 'gunicorn', 'app:app',
+               '--bind', f'{host}:{port}', '--workers', str(workers),
+               '--worker-class', worker_class, '--threads', str(threads), *extra_args]
+    return subprocess.Popen(
+        command, cwd=PROJECT_ROOT, env=dict(os.environ, **(env or {})),
+        stdout=subprocess.DEVNULL, stderr=stderr if stderr is not None else subprocess.DEVNULL,
+    )
+
+
+def wait_for_port(port, host='127.0.0.1', timeout=30.0, process=None):
+    """
+    Poll until something accepts connections on the port.
+
+    Returns:
+        float: Seconds waited
+
+    Raises:
+        RuntimeError: If the process exits or the timeout passes first
+    """
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f'gunicorn exited with status {process.returncode}')
+        try:
+            with socket.create_connection((host, port), timeout=0.5):
+                return time.perf_counter() - start
+        except OSError:
+            time.sleep(0.005)
+    raise RuntimeError(f'nothing listening on {host}:{port} after {timeout}s')
+
+
+def stop_gunicorn(process, timeout=10.0):
+    """Stop gunicorn gracefully (SIGTERM), killing it if it hangs."""
+    if process.poll() is not None:
+        return
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
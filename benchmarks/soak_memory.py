@@ -0,0 +1,135 @@
+"""
+Memory soak test.
+Drives players through the whole funnel (pages, the four modules, letter,
+reply, card, reset) with the test client, then checks that RSS and
+tracemalloc-traced memory grew by less than a bound after warm-up. Exits
+with status 1 and prints the top allocation sites when a bound is exceeded.
+
+Usage:
+    python -m benchmarks.soak_memory [--requests 50000] [--max-rss-growth 16]
+                                     [--max-traced-growth 2]
+"""
+
+import argparse
+import gc
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from modules.memory import current_rss
+
+WORDS = ('snow', 'sleigh', 'cocoa', 'puppy', 'grandma', 'cookies', 'lights', 'star',
+         'family', 'presents', 'bicycle', 'books', 'hugs', 'carols', 'mittens', 'tree')
+COUNTRIES = ('Canada', 'India', 'Brazil', 'Norway', 'Kenya', 'Japan', 'Mexico')
+
+
+def sentence(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize() + '.'
+
+
+def play_funnel(client, rng):
+    """
+    Play once from the start page to the Christmas card and reset.
+
+    Returns:
+        int: Number of requests made
+    """
+    paths = ['/', '/instructions', '/map']
+    for name in ('elf', 'reindeer', 'ethics', 'emotion'):
+        paths.append(f'/{name}')
+        paths.append(('POST', f'/complete_{name}'))
+    paths += ['/map', '/finale', '/letter-to-santa', '/letter-to-santa/form']
+
+    for path in paths:
+        if isinstance(path, tuple):
+            response = client.post(path[1], data={'choice': 'share'})
+        else:
+            response = client.get(path)
+        response.close()
+
+    letter = {
+        'name': f'Player {rng.randrange(10 ** 6)}',
+        'age': str(rng.randint(4, 90)),
+        'gender': rng.choice(('girl', 'boy', 'other')),
+        'country': rng.choice(COUNTRIES),
+        'feeling': sentence(rng, rng.randint(5, 120)),
+        'wish': sentence(rng, rng.randint(3, 60)),
+        'memory': sentence(rng, rng.randint(3, 60)),
+    }
+    client.post('/letter-to-santa/submit', data=letter).close()
+    for path in ('/letter-to-santa/reply', '/letter-to-santa/card', '/reset'):
+        client.get(path).close()
+    return len(paths) + 4
+
+
+def soak(app, requests, seed=0):
+    """Play fresh players (new cookie jars) until `requests` have been made."""
+    rng = random.Random(seed)
+    done = 0
+    while done < requests:
+        done += play_funnel(app.test_client(), rng)
+    return done
+
+
+def measure():
+    gc.collect()
+    traced = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+    return current_rss(), traced
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=50000)
+    parser.add_argument('--warmup', type=int, default=2000,
+                        help='requests before the baseline is taken (fills caches)')
+    parser.add_argument('--max-rss-growth', type=float, default=16.0, help='MiB')
+    parser.add_argument('--max-traced-growth', type=float, default=2.0, help='MiB')
+    parser.add_argument('--no-trace', action='store_true',
+                        help='check RSS only; tracemalloc slows the run ~2x')
+    args = parser.parse_args()
+
+    # Keep the soak's event log, metrics files and letters out of the real ones
+    scratch = tempfile.mkdtemp(prefix='santa-soak-')
+    os.environ.setdefault('EVENT_LOG_DIR', os.path.join(scratch, 'events'))
+    os.environ.setdefault('METRICS_DIR', os.path.join(scratch, 'metrics'))
+    os.environ['LETTER_ARCHIVE_PATH'] = os.path.join(scratch, 'letters.db')
+    from app import app
+
+    soak(app, args.warmup, seed=1)
+    if not args.no_trace:
+        tracemalloc.start()
+    baseline_rss, baseline_traced = measure()
+    baseline_snapshot = None if args.no_trace else tracemalloc.take_snapshot()
+
+    start = time.perf_counter()
+    done = 0
+    step = max(args.requests // 10, 1)
+    while done < args.requests:
+        done += soak(app, min(step, args.requests - done), seed=done)
+        rss, traced = measure()
+        print(f'{done:>8} requests  rss {(rss - baseline_rss) / 2 ** 20:+8.2f} MiB  '
+              f'traced {(traced - baseline_traced) / 2 ** 20:+8.2f} MiB')
+    elapsed = time.perf_counter() - start
+
+    rss_growth = (rss - baseline_rss) / 2 ** 20
+    traced_growth = (traced - baseline_traced) / 2 ** 20
+    print(f'{done} requests in {elapsed:.1f}s ({done / elapsed:.0f} req/s)')
+    print(f'RSS growth:    {rss_growth:+.2f} MiB (limit {args.max_rss_growth})')
+    if not args.no_trace:
+        print(f'traced growth: {traced_growth:+.2f} MiB (limit {args.max_traced_growth})')
+
+    failed = rss_growth > args.max_rss_growth or (
+        not args.no_trace and traced_growth > args.max_traced_growth)
+    if failed and baseline_snapshot is not None:
+        print('\nTop allocation growth since the baseline:')
+        for stat in tracemalloc.take_snapshot().compare_to(baseline_snapshot, 'lineno')[:15]:
+            print(f'  {stat}')
+    print('FAIL' if failed else 'OK')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,234 @@
+"""
+Cold-start benchmark.
+Launches ``gunicorn app:app`` in a fresh process N times and measures, from
+the moment the process is spawned:
+
+- time until the socket accepts connections (bind)
+- time until the first / response, and that request's own latency
+- time until the first /map response, and that request's own latency
+- RSS of the master and each worker after warming every page up
+
+One extra run under ``python -X importtime`` records the import cost of
+every module, split into the master (before bind) and the worker (the
+app). Results are written as JSON so cold start can be tracked over time.
+
+Usage:
+    python -m benchmarks.startup [--runs 10] [--workers 1] [--output PATH]
+"""
+
+import argparse
+import http.client
+import json
+import os
+import re
+import statistics
+import tempfile
+import time
+
+from benchmarks import MODULES
+from benchmarks.harness import environment
+from benchmarks.server import free_port, start_gunicorn, stop_gunicorn, wait_for_port
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+IMPORT_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+WARMUP_PATHS = ('/', '/instructions', '/map', *(f'/{name}' for name in MODULES),
+                '/letter-to-santa/form')
+
+
+def get(port, path, cookie=None):
+    """
+    Fetch a page and read the whole body.
+
+    Returns:
+        tuple: (status, Set-Cookie header or None, seconds taken)
+    """
+    start = time.perf_counter()
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+    try:
+        connection.request('GET', path, headers={'Cookie': cookie} if cookie else {})
+        response = connection.getresponse()
+        response.read()
+        return response.status, response.getheader('Set-Cookie'), time.perf_counter() - start
+    finally:
+        connection.close()
+
+
+def process_rss(pid):
+    """Resident set size of a process in bytes, from /proc."""
+    try:
+        with open(f'/proc/{pid}/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def child_pids(pid):
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as children:
+            return [int(child) for child in children.read().split()]
+    except OSError:
+        pass
+    # Kernels without /proc/<pid>/task/<pid>/children: scan every process
+    pids = []
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open(f'/proc/{entry}/stat') as stat:
+                    if int(stat.read().rsplit(')', 1)[1].split()[1]) == pid:
+                        pids.append(int(entry))
+            except (OSError, IndexError, ValueError):
+                continue
+    return pids
+
+
+def one_run(workers, env, warmup_rounds):
+    port = free_port()
+    start = time.perf_counter()
+    server = start_gunicorn(port, workers=workers, env=env)
+    try:
+        wait_for_port(port, process=server, timeout=60)
+        bind = time.perf_counter() - start
+
+        status, cookie, index_latency = get(port, '/')
+        first_index = time.perf_counter() - start
+        if status != 200:
+            raise RuntimeError(f'/ answered {status}')
+        cookie = cookie.split(';', 1)[0] if cookie else None
+        status, _, map_latency = get(port, '/map', cookie)
+        first_map = time.perf_counter() - start
+        if status != 200:
+            raise RuntimeError(f'/map answered {status}')
+
+        # Visit every page a few times so each worker has rendered it
+        for _ in range(warmup_rounds * workers):
+            for path in WARMUP_PATHS:
+                get(port, path, cookie)
+        workers_rss = [process_rss(pid) for pid in child_pids(server.pid)]
+        return {
+            'bind_s': bind,
+            'first_index_s': first_index,
+            'first_index_latency_s': index_latency,
+            'first_map_s': first_map,
+            'first_map_latency_s': map_latency,
+            'master_rss_bytes': process_rss(server.pid),
+            'worker_rss_bytes': [rss for rss in workers_rss if rss is not None],
+        }
+    finally:
+        stop_gunicorn(server)
+
+
+def import_costs(env, log_path):
+    """
+    Start gunicorn under -X importtime, serve one request and parse the log.
+
+    Returns:
+        dict: 'master' (imports before the socket is bound, including
+              gunicorn.conf.py) and 'worker' (the app, imported after the
+              fork) lists of {'module', 'self_us', 'cumulative_us', 'depth'}
+              sorted by cumulative cost
+    """
+    port = free_port()
+    with open(log_path, 'w') as log_file:
+        server = start_gunicorn(port, workers=1, env=env, python_args=('-X', 'importtime'),
+                                stderr=log_file)
+        try:
+            wait_for_port(port, process=server, timeout=60)
+            get(port, '/')
+        finally:
+            stop_gunicorn(server)
+
+    phases = {'master': [], 'worker': []}
+    current = phases['master']
+    with open(log_path) as log_file:
+        for line in log_file:
+            if 'Booting worker' in line:
+                current = phases['worker']
+                continue
+            match = IMPORT_LINE.match(line)
+            if match:
+                current.append({
+                    'module': match.group(4),
+                    'self_us': int(match.group(1)),
+                    'cumulative_us': int(match.group(2)),
+                    'depth': len(match.group(3)) // 2,
+                })
+    for entries in phases.values():
+        entries.sort(key=lambda entry: entry['cumulative_us'], reverse=True)
+    return phases
+
+
+def summarise(runs):
+    summary = {}
+    for key in ('bind_s', 'first_index_s', 'first_index_latency_s', 'first_map_s',
+                'first_map_latency_s', 'master_rss_bytes'):
+        values = [run[key] for run in runs if run[key] is not None]
+        if values:
+            summary[key] = {'median': statistics.median(values), 'min': min(values),
+                            'max': max(values)}
+    worker_rss = [rss for run in runs for rss in run['worker_rss_bytes']]
+    if worker_rss:
+        summary['worker_rss_bytes'] = {'median': statistics.median(worker_rss),
+                                       'min': min(worker_rss), 'max': max(worker_rss)}
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--warmup-rounds', type=int, default=3,
+                        help='times each page is requested per worker before RSS is read')
+    parser.add_argument('--top-imports', type=int, default=30,
+                        help='imports listed in the report (the JSON keeps all)')
+    parser.add_argument('--no-importtime', action='store_true')
+    parser.add_argument('--output', help='JSON file (default: benchmarks/results/startup-<time>.json)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='santa-startup-') as scratch:
+        # Same features as production, but telemetry files and letters go to a scratch folder
+        env = {name: os.path.join(scratch, folder) for name, folder in (
+            ('EVENT_LOG_DIR', 'events'), ('VITALS_DIR', 'vitals'), ('FRAMES_DIR', 'frames'),
+            ('METRICS_DIR', 'metrics'), ('PROFILE_DIR', 'profiles'),
+            ('LETTER_ARCHIVE_PATH', 'letters.db'))}
+
+        runs = []
+        for number in range(1, args.runs + 1):
+            run = one_run(args.workers, env, args.warmup_rounds)
+            runs.append(run)
+            print(f"run {number:>3}: bind {run['bind_s'] * 1000:7.1f} ms  "
+                  f"first / {run['first_index_s'] * 1000:7.1f} ms  "
+                  f"first /map {run['first_map_s'] * 1000:7.1f} ms  "
+                  f"worker RSS {max(run['worker_rss_bytes'] or [0]) / 2 ** 20:6.1f} MiB")
+        imports = {} if args.no_importtime else import_costs(
+            env, os.path.join(scratch, 'importtime.log'))
+
+    summary = summarise(runs)
+    print(f"\n{'median over ' + str(len(runs)) + ' runs':<28}{'median':>10}{'min':>10}{'max':>10}")
+    for key, values in summary.items():
+        scale, unit = (2 ** 20, 'MiB') if key.endswith('bytes') else (1e-3, 'ms')
+        label = f"{key.rsplit('_', 1)[0]} ({unit})"
+        print(f"{label:<28}{values['median'] / scale:>10.1f}{values['min'] / scale:>10.1f}"
+              f"{values['max'] / scale:>10.1f}")
+    for phase, entries in imports.items():
+        total = sum(entry['self_us'] for entry in entries) / 1000
+        print(f"\n{phase + ' imports (' + format(total, '.0f') + ' ms in total)':<52}"
+              f"{'self ms':>9}{'cumul ms':>10}")
+        for entry in entries[:args.top_imports]:
+            name = '  ' * entry['depth'] + entry['module']
+            print(f"{name[:52]:<52}{entry['self_us'] / 1000:>9.1f}"
+                  f"{entry['cumulative_us'] / 1000:>10.1f}")
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"startup-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as output_file:
+        json.dump({'environment': environment(), 'workers': args.workers, 'runs': runs,
+                   'summary': summary, 'imports': imports}, output_file, indent=1)
+    print(f'\nWrote {output}')
+
+
+if __name__ == '__main__':
+    main()
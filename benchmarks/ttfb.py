@@ -0,0 +1,65 @@
+"""
+Time-to-first-byte benchmark for the four module pages.
+Compares the buffered render against the streaming render (STREAM_TEMPLATES).
+
+Usage:
+    python -m benchmarks.ttfb [--runs 200]
+"""
+
+import argparse
+import statistics
+import time
+
+from app import app
+from benchmarks import player_client
+
+PAGES = ('/elf', '/reindeer', '/ethics', '/emotion')
+
+
+def measure(client, path):
+    """
+    Request a page without buffering and time the first and last byte.
+
+    Returns:
+        tuple: (seconds to first body chunk, seconds to complete body)
+    """
+    start = time.perf_counter()
+    response = client.get(path, buffered=False)
+    first_byte = None
+    for chunk in response.response:
+        if chunk and first_byte is None:
+            first_byte = time.perf_counter() - start
+    total = time.perf_counter() - start
+    response.close()
+    return first_byte, total
+
+
+def run(runs):
+    results = {}
+    client = player_client(app)
+    for streaming in (False, True):
+        app.config['STREAM_TEMPLATES'] = streaming
+        for path in PAGES:
+            measure(client, path)  # warm the template cache
+            samples = [measure(client, path) for _ in range(runs)]
+            results[(path, streaming)] = (
+                statistics.median(s[0] for s in samples),
+                statistics.median(s[1] for s in samples),
+            )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=200, help='requests per page and mode')
+    args = parser.parse_args()
+
+    results = run(args.runs)
+    print(f"{'page':<12}{'mode':<11}{'ttfb ms':>10}{'total ms':>10}")
+    for (path, streaming), (ttfb, total) in results.items():
+        mode = 'streaming' if streaming else 'buffered'
+        print(f"{path:<12}{mode:<11}{ttfb * 1000:>10.3f}{total * 1000:>10.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,19 @@
+"""
+Gunicorn configuration.
+Loaded automatically by `gunicorn app:app` from the project root.
+"""
+
+import os
+
+from modules import letter_archive, metrics, reply_pool
+
+
+def on_starting(server):
+    """Drop metric files left over from a previous run before workers start."""
+    metrics.clear_directory(os.environ.get('METRICS_DIR') or metrics.default_metrics_dir())
+
+
+def worker_exit(server, worker):
+    """Stop bulk reply processes and write the letters still queued in the worker."""
+    reply_pool.shutdown()
+    letter_archive.shutdown()
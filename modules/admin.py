@@ -0,0 +1,41 @@
+"""
+Admin access module.
+Admin routes are only available when ADMIN_TOKEN is configured, and every
+request must present it in an ``X-Admin-Token`` or ``Authorization: Bearer``
+header.
+"""
+
+import hmac
+from functools import wraps
+
+from flask import abort, current_app, request
+
+
+def supplied_token():
+    """Get the admin token sent with the current request, if any."""
+    token = request.headers.get('X-Admin-Token')
+    if token:
+        return token
+    scheme, _, credentials = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() == 'bearer':
+        return credentials.strip()
+    return None
+
+
+def admin_required(view):
+    """
+    Decorator for admin-only views.
+
+    Responds 404 while no ADMIN_TOKEN is configured, so admin routes are
+    invisible by default, and 403 when the token is missing or wrong.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        expected = current_app.config.get('ADMIN_TOKEN')
+        if not expected:
+            abort(404)
+        token = supplied_token()
+        if not token or not hmac.compare_digest(token.encode(), expected.encode()):
+            abort(403)
+        return view(*args, **kwargs)
+    return wrapper
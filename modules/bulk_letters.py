@@ -0,0 +1,336 @@
+"""
+Bulk letter intake module.
+Lets a teacher send a whole class's letters at once, as CSV or NDJSON, and
+get Santa's replies back as NDJSON or as a ZIP of printable text files.
+
+The upload is parsed row by row, replies are generated in chunks by the
+process pool in modules.reply_pool, and results are streamed back in the
+order of the file while later chunks are still being written. Only a few
+chunks are held at any time, so memory stays bounded for files of tens of
+thousands of letters. Accepted letters are archived like letters sent
+through the form.
+"""
+
+import csv
+import io
+import json
+import re
+import sys
+import tempfile
+import time
+import zipfile
+
+import click
+from flask import Response, jsonify, request, stream_with_context
+
+from modules.admin import admin_required
+from modules.content_scanner import scan_letter
+from modules.letter_archive import LETTER_FIELDS, archive_letter
+from modules.letter_dedup import cached_reply, remember_reply
+from modules.reply_pool import map_chunks
+
+INPUT_FORMATS = ('csv', 'ndjson')
+OUTPUTS = {'ndjson': 'application/x-ndjson', 'zip': 'application/zip'}
+REQUIRED_FIELDS = ('name', 'feeling', 'wish', 'memory')
+MAX_FIELD_LENGTH = 10000
+CHUNK_SIZE = 50
+MAX_LISTED_ERRORS = 1000
+# Chunked uploads are spooled before parsing; larger ones go to a temporary file
+SPOOL_MEMORY = 1024 * 1024
+COPY_SIZE = 64 * 1024
+
+
+def input_format(filename, mimetype=None):
+    """Guess csv or ndjson from a file name or content type; None if unclear."""
+    name = (filename or '').lower()
+    if name.endswith('.csv') or (mimetype or '').endswith('csv'):
+        return 'csv'
+    if name.endswith(('.ndjson', '.jsonl', '.json')) or 'json' in (mimetype or ''):
+        return 'ndjson'
+    return None
+
+
+def read_rows(stream, file_format):
+    """
+    Parse an uploaded file one row at a time.
+
+    Args:
+        stream: Binary file object (UTF-8, optionally with a BOM)
+        file_format: 'csv' (header row naming the fields) or 'ndjson'
+
+    Yields:
+        tuple: (line number, row dict or None, error message or None)
+    """
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', errors='replace', newline='')
+    if file_format == 'csv':
+        reader = csv.DictReader(text)
+        try:
+            if reader.fieldnames:
+                reader.fieldnames = [field.strip().lower() for field in reader.fieldnames]
+            for row in reader:
+                yield reader.line_num, row, None
+        except csv.Error as error:
+            yield reader.line_num, None, f'unreadable CSV: {error}'
+        return
+    for number, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield number, None, 'not valid JSON'
+            continue
+        if not isinstance(row, dict):
+            yield number, None, 'expected a JSON object'
+            continue
+        yield number, {str(key).strip().lower(): value for key, value in row.items()}, None
+
+
+def spool(stream, max_bytes):
+    """
+    Copy a body of unknown length (a chunked upload) to a temporary file.
+
+    Returns:
+        file: The body, rewound, or None once it is larger than max_bytes
+    """
+    body = tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY)
+    copied = 0
+    while True:
+        chunk = stream.read(COPY_SIZE)
+        if not chunk:
+            break
+        copied += len(chunk)
+        if copied > max_bytes:
+            body.close()
+            return None
+        body.write(chunk)
+    body.seek(0)
+    return body
+
+
+def clean_letter(row):
+    """
+    Turn a parsed row into letter data, as save_letter_data would, with
+    personal details redacted and worrying phrases flagged.
+
+    Returns:
+        tuple: (letter dict, None) or (None, error message)
+    """
+    letter = {}
+    for field in LETTER_FIELDS:
+        value = row.get(field)
+        value = '' if value is None else str(value).strip()
+        if len(value) > MAX_FIELD_LENGTH:
+            return None, f'{field} is longer than {MAX_FIELD_LENGTH} characters'
+        letter[field] = value
+    missing = [field for field in REQUIRED_FIELDS if not letter[field]]
+    if missing:
+        return None, f'missing {", ".join(missing)}'
+    for field in ('age', 'gender', 'country'):
+        letter[field] = letter[field] or None
+    return scan_letter(letter)[0], None
+
+
+def _chunks(rows, size):
+    chunk = []
+    for line, row, error in rows:
+        letter = cached = None
+        if error is None:
+            letter, error = clean_letter(row)
+        if letter is not None:
+            cached = cached_reply(letter)
+        chunk.append((line, letter, error, cached))
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def process(rows, workers, chunk_size=CHUNK_SIZE, archive=True):
+    """
+    Write a reply to every valid letter, in the pool, keeping the file's order.
+
+    Args:
+        rows: read_rows output
+        workers: Pool processes (0: in this process)
+        chunk_size: Letters sent to a pool process at a time
+        archive: Also add accepted letters to the letter archive
+
+    Yields:
+        dict: {'line', 'name', 'emotion', 'reply', 'flags'} or {'line', 'error'}
+    """
+    # The same chunks feed the pool and the merge, so errors keep their place
+    pending = []
+
+    def letters_only(chunks):
+        for chunk in chunks:
+            pending.append(chunk)
+            # Letters answered recently (e.g. the same row twice) skip the pool
+            yield [letter for _, letter, _, cached in chunk if letter is not None and cached is None]
+
+    for replies in map_chunks(letters_only(_chunks(rows, chunk_size)), workers):
+        replies = iter(replies)
+        for line, letter, error, cached in pending.pop(0):
+            if letter is None:
+                yield {'line': line, 'error': error}
+                continue
+            if cached is None:
+                emotion, reply = next(replies)
+                remember_reply(letter, emotion, reply)
+            else:
+                emotion, reply = cached
+            if archive:
+                archive_letter(letter, emotion=emotion, reply=reply)
+            yield {'line': line, 'name': letter['name'], 'emotion': emotion, 'reply': reply,
+                   'flags': letter.get('flags')}
+
+
+def ndjson_output(results):
+    for result in results:
+        yield json.dumps(result, ensure_ascii=False) + '\n'
+
+
+class _ZipStream:
+    """Write-only file that hands back what zipfile wrote since the last take()."""
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def write(self, data):
+        self._buffer += data
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+def zip_output(results):
+    """
+    One text file per reply (`00012-Name.txt`, numbered by line) and an
+    errors.txt listing rejected lines, streamed as the ZIP is written.
+
+    Yields:
+        bytes: ZIP data
+    """
+    sink = _ZipStream()
+    errors = []
+    unlisted = 0
+    # The ZIP index keeps an entry per file until the end; one shared
+    # timestamp keeps each entry small
+    written_at = time.localtime()[:6]
+    # zipfile streams to unseekable files by writing sizes after each entry
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for result in results:
+            if 'error' in result:
+                if len(errors) < MAX_LISTED_ERRORS:
+                    errors.append(f"line {result['line']}: {result['error']}\n")
+                else:
+                    unlisted += 1
+                continue
+            safe_name = re.sub(r'[^\w-]+', '_', result['name']).strip('_')[:40] or 'letter'
+            entry = zipfile.ZipInfo(f"{result['line']:05d}-{safe_name}.txt", written_at)
+            entry.compress_type = zipfile.ZIP_DEFLATED
+            archive.writestr(entry, result['reply'] + '\n')
+            data = sink.take()
+            if data:
+                yield data
+        if unlisted:
+            errors.append(f'... and {unlisted} more\n')
+        if errors:
+            archive.writestr('errors.txt', ''.join(errors))
+    yield sink.take()
+
+
+def init_app(app, workers=2, max_bytes=20 * 1024 * 1024):
+    """
+    Add POST /admin/letters/bulk and the ``flask bulk-letters`` command.
+
+    The upload is a multipart file field named `letters`, or the raw body
+    with a CSV or NDJSON content type. Query parameters: format (csv or
+    ndjson, when the file name or content type doesn't say), output
+    (ndjson or zip) and archive (0 to skip the letter archive).
+
+    Args:
+        app: Flask application
+        workers: Pool processes generating replies (0: in the request thread)
+        max_bytes: Largest upload accepted
+    """
+    @app.route('/admin/letters/bulk', methods=['POST'])
+    @admin_required
+    def bulk_letters():
+        """Reply to a file of letters, streaming the replies back."""
+        if request.content_length is None:
+            # No Content-Length to check, so count the bytes before parsing
+            # anything; the multipart parser reads the spooled copy too
+            body = spool(request.stream, max_bytes)
+            if body is None:
+                return jsonify(error=f'upload is larger than {max_bytes} bytes'), 413
+            request.stream = body
+        elif request.content_length > max_bytes:
+            return jsonify(error=f'upload is larger than {max_bytes} bytes'), 413
+        output = request.args.get('output', 'ndjson')
+        if output not in OUTPUTS:
+            return jsonify(error=f'output must be one of {", ".join(OUTPUTS)}'), 400
+        upload = request.files.get('letters')
+        if upload is not None:
+            stream, guessed = upload.stream, input_format(upload.filename, upload.mimetype)
+        else:
+            stream, guessed = request.stream, input_format(None, request.mimetype)
+        file_format = request.args.get('format') or guessed
+        if file_format not in INPUT_FORMATS:
+            return jsonify(error='say format=csv or format=ndjson'), 400
+
+        results = process(read_rows(stream, file_format), workers,
+                          archive=request.args.get('archive', '1') != '0')
+        body = ndjson_output(results) if output == 'ndjson' else zip_output(results)
+        headers = {}
+        if output == 'zip':
+            headers['Content-Disposition'] = (
+                f"attachment; filename=santa-replies-{time.strftime('%Y%m%d-%H%M%S')}.zip")
+        return Response(stream_with_context(body), mimetype=OUTPUTS[output], headers=headers)
+
+    @app.cli.command('bulk-letters')
+    @click.argument('input_file', type=click.File('rb'))
+    @click.option('--format', 'file_format', type=click.Choice(INPUT_FORMATS),
+                  help='Default: from the file name')
+    @click.option('--output', type=click.Path(dir_okay=False),
+                  help='.zip for text files, anything else for NDJSON (default: NDJSON on stdout)')
+    @click.option('--workers', 'pool_workers', type=int,
+                  help='Pool processes (default: BULK_WORKERS)')
+    @click.option('--no-archive', is_flag=True, help='Do not add the letters to the archive')
+    def bulk_letters_command(input_file, file_format, output, pool_workers, no_archive):
+        """Write Santa's replies to a CSV or NDJSON file of letters."""
+        file_format = file_format or input_format(input_file.name)
+        if file_format is None:
+            raise click.BadParameter('cannot tell the format from the name; use --format')
+        counts = {'replies': 0, 'errors': 0}
+
+        def counted(results):
+            for result in results:
+                counts['errors' if 'error' in result else 'replies'] += 1
+                yield result
+
+        start = time.perf_counter()
+        results = counted(process(read_rows(input_file, file_format),
+                                  workers if pool_workers is None else pool_workers,
+                                  archive=not no_archive))
+        if output and output.lower().endswith('.zip'):
+            with open(output, 'wb') as target:
+                for data in zip_output(results):
+                    target.write(data)
+        else:
+            target = open(output, 'w', encoding='utf-8') if output else sys.stdout
+            try:
+                for line in ndjson_output(results):
+                    target.write(line)
+            finally:
+                if output:
+                    target.close()
+        click.echo(f"{counts['replies']} replies, {counts['errors']} rejected lines "
+                   f'in {time.perf_counter() - start:.1f}s', err=True)
@@ -0,0 +1,301 @@
+"""
+Response compression middleware.
+Compresses text responses with gzip (or zstd when the optional ``zstandard``
+package is installed) according to the client's Accept-Encoding header.
+
+Responses that carry a strong ETag are deterministic for a given deploy, so
+their compressed bodies are cached and reused instead of being compressed
+again on every request.
+"""
+
+import threading
+import zlib
+from collections import OrderedDict
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional, gzip is always available
+    zstandard = None
+
+# Content types worth compressing (images and audio are already compressed)
+COMPRESSIBLE_TYPES = (
+    'text/',
+    'application/json',
+    'application/javascript',
+    'application/xml',
+    'image/svg+xml',
+)
+
+# Status codes that never carry a body we should touch
+UNCOMPRESSIBLE_STATUSES = (204, 206, 304)
+
+
+def parse_accept_encoding(header):
+    """
+    Parse an Accept-Encoding header into a mapping of coding to q-value.
+
+    Args:
+        header: Raw Accept-Encoding header value
+
+    Returns:
+        dict: Lower-cased coding names mapped to their quality (0.0 - 1.0)
+    """
+    codings = {}
+    for part in header.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        name, _, params = part.partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        codings[name.strip().lower()] = quality
+    return codings
+
+
+def choose_encoding(header):
+    """
+    Pick the best supported content coding for a request.
+
+    Args:
+        header: Raw Accept-Encoding header value
+
+    Returns:
+        str: 'zstd', 'gzip' or None if the client accepts neither
+    """
+    if not header:
+        return None
+    codings = parse_accept_encoding(header)
+    wildcard = codings.get('*', 0.0)
+    gzip_q = codings.get('gzip', wildcard)
+    zstd_q = codings.get('zstd', wildcard) if zstandard is not None else 0.0
+    if zstd_q > 0 and zstd_q >= gzip_q:
+        return 'zstd'
+    if gzip_q > 0:
+        return 'gzip'
+    return None
+
+
+def _is_strong_etag(etag):
+    return bool(etag) and not etag.startswith('W/') and etag.startswith('"')
+
+
+def _tag_etag(etag, encoding):
+    """Give each encoded representation its own ETag: "abc" -> "abc-gzip"."""
+    if etag.startswith('W/'):
+        return 'W/' + _tag_etag(etag[2:], encoding)
+    if etag.endswith('"'):
+        return f'{etag[:-1]}-{encoding}"'
+    return etag
+
+
+def _untag_etags(header):
+    """Strip our encoding suffixes so the app can match its own ETags."""
+    for encoding in ('gzip', 'zstd'):
+        header = header.replace(f'-{encoding}"', '"')
+    return header
+
+
+class CompressionMiddleware:
+    """
+    WSGI middleware that compresses text responses above a size threshold.
+
+    Bodies with a known Content-Length are compressed in one go; streamed
+    bodies (no Content-Length) are compressed chunk by chunk with a sync flush
+    after each chunk so the client still receives them incrementally.
+    """
+
+    def __init__(self, app, min_size=500, level=6, cache_size=128):
+        """
+        Args:
+            app: The wrapped WSGI application
+            min_size: Smallest body in bytes worth compressing
+            level: Compression level used for gzip and zstd
+            cache_size: Number of compressed bodies kept for strong ETags
+        """
+        self.app = app
+        self.min_size = min_size
+        self.level = level
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        encoding = choose_encoding(environ.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None or environ.get('REQUEST_METHOD') == 'HEAD':
+            return self.app(environ, start_response)
+
+        for header in ('HTTP_IF_NONE_MATCH', 'HTTP_IF_MATCH'):
+            if header in environ:
+                environ[header] = _untag_etags(environ[header])
+
+        captured = {}
+        written = []
+
+        def capture_start_response(status, headers, exc_info=None):
+            captured['status'] = status
+            captured['headers'] = headers
+            captured['exc_info'] = exc_info
+            return written.append
+
+        app_iter = self.app(environ, capture_start_response)
+        status = captured['status']
+        headers = captured['headers']
+
+        if not self._should_compress(status, headers):
+            start_response(status, headers, captured['exc_info'])
+            return self._chain(written, app_iter)
+
+        content_length = _get_header(headers, 'Content-Length')
+        if content_length is None:
+            return self._compress_stream(start_response, status, headers, encoding,
+                                         written, app_iter)
+
+        if int(content_length) < self.min_size:
+            start_response(status, _add_vary(headers), captured['exc_info'])
+            return self._chain(written, app_iter)
+
+        try:
+            body = b''.join(written) + b''.join(app_iter)
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+
+        etag = _get_header(headers, 'ETag')
+        cache_key = None
+        if _is_strong_etag(etag):
+            cache_key = (environ.get('PATH_INFO', ''), environ.get('QUERY_STRING', ''),
+                         etag, encoding)
+        compressed = self._cache_get(cache_key)
+        if compressed is None:
+            compressed = self._compress(body, encoding)
+            self._cache_put(cache_key, compressed)
+
+        headers = [(k, v) for k, v in headers
+                   if k.lower() not in ('content-length', 'etag', 'accept-ranges')]
+        headers.append(('Content-Encoding', encoding))
+        headers.append(('Content-Length', str(len(compressed))))
+        if etag:
+            headers.append(('ETag', _tag_etag(etag, encoding)))
+        start_response(status, _add_vary(headers), captured['exc_info'])
+        return [compressed]
+
+    def _should_compress(self, status, headers):
+        """Check whether a response is a compressible text body."""
+        try:
+            code = int(status.split(' ', 1)[0])
+        except ValueError:
+            return False
+        if code < 200 or code in UNCOMPRESSIBLE_STATUSES:
+            return False
+        if _get_header(headers, 'Content-Encoding') or _get_header(headers, 'Content-Range'):
+            return False
+        if 'no-transform' in (_get_header(headers, 'Cache-Control') or ''):
+            return False
+        content_type = (_get_header(headers, 'Content-Type') or '').lower()
+        return content_type.startswith(COMPRESSIBLE_TYPES)
+
+    def _compress(self, body, encoding):
+        if encoding == 'zstd':
+            return zstandard.ZstdCompressor(level=self.level).compress(body)
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, 31)
+        return compressor.compress(body) + compressor.flush()
+
+    def _compress_stream(self, start_response, status, headers, encoding, written, app_iter):
+        """Compress a streamed body, flushing after every chunk."""
+        headers = [(k, v) for k, v in headers if k.lower() not in ('etag', 'accept-ranges')]
+        headers.append(('Content-Encoding', encoding))
+        start_response(status, _add_vary(headers))
+
+        if encoding == 'zstd':
+            compressor = zstandard.ZstdCompressor(level=self.level).compressobj()
+
+            def flush():
+                return compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+            def finish():
+                return compressor.flush(zstandard.COMPRESSOBJ_FLUSH_FINISH)
+        else:
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, 31)
+
+            def flush():
+                return compressor.flush(zlib.Z_SYNC_FLUSH)
+
+            def finish():
+                return compressor.flush()
+
+        def generate():
+            try:
+                for chunk in self._chain(written, app_iter):
+                    if chunk:
+                        yield compressor.compress(chunk) + flush()
+                yield finish()
+            finally:
+                if hasattr(app_iter, 'close'):
+                    app_iter.close()
+
+        return generate()
+
+    def _chain(self, written, app_iter):
+        """Return the body, prepending anything sent through write()."""
+        if not written:
+            return app_iter
+        return _ClosingChain(written, app_iter)
+
+    def _cache_get(self, key):
+        if key is None:
+            return None
+        with self._cache_lock:
+            compressed = self._cache.get(key)
+            if compressed is not None:
+                self._cache.move_to_end(key)
+            return compressed
+
+    def _cache_put(self, key, compressed):
+        if key is None or self.cache_size <= 0:
+            return
+        with self._cache_lock:
+            self._cache[key] = compressed
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+
+class _ClosingChain:
+    """Iterate written chunks then the app iterable, forwarding close()."""
+
+    def __init__(self, written, app_iter):
+        self.written = written
+        self.app_iter = app_iter
+
+    def __iter__(self):
+        yield from self.written
+        yield from self.app_iter
+
+    def close(self):
+        if hasattr(self.app_iter, 'close'):
+            self.app_iter.close()
+
+
+def _get_header(headers, name):
+    name = name.lower()
+    for key, value in headers:
+        if key.lower() == name:
+            return value
+    return None
+
+
+def _add_vary(headers):
+    """Add Accept-Encoding to the Vary header so caches keep encodings apart."""
+    vary = _get_header(headers, 'Vary')
+    if vary is None:
+        return headers + [('Vary', 'Accept-Encoding')]
+    if 'accept-encoding' in vary.lower() or vary.strip() == '*':
+        return headers
+    headers = [(k, v) for k, v in headers if k.lower() != 'vary']
+    return headers + [('Vary', f'{vary}, Accept-Encoding')]
@@ -0,0 +1,243 @@
+"""
+Content scanner module.
+Letters are free text from children. Before a letter is stored (session,
+archive) or quoted back in Santa's reply, its free-text fields are
+scanned once:
+
+- Personal details (email addresses, phone numbers, links, street
+  addresses, UK postcodes) are replaced with a placeholder such as
+  ``[phone]``.
+- Phrases from a safety lexicon (self-harm, abuse, bullying, ...) flag
+  the letter with their categories. Flagged text is kept for whoever
+  reviews the letter, but Santa's reply doesn't quote it.
+
+Each field is read in a single pass: one compiled regex alternates the
+personal-detail patterns with a plain word pattern, and every word it
+yields steps a word-level Aho-Corasick automaton built from the lexicon.
+The lexicon can be replaced with a file of ``category: phrase`` lines
+(SAFETY_LEXICON), and its size doesn't change the cost per word.
+"""
+
+import re
+from collections import Counter, deque
+
+SCANNED_FIELDS = ('feeling', 'wish', 'memory')
+
+# Each match first swallows the gap before its token, so the alternatives
+# are only tried where a token starts. They are tried in order there. Plain
+# words come first, as they are nearly all of a letter. They are letters
+# only, matched possessively so a failed lookahead doesn't retry shorter
+# words, and must not be the start of an email or postcode. Dates come
+# before phones so that 24.12.2023 is left alone.
+TOKEN = re.compile(r"""[^\w+]*+(?:
+    (?P<link>(?:https?://|www\.)[^\s<>"]+)
+  | (?P<word>[^\W\d_]++(?:'\w+)*+)(?![\w.+-]*+@|\d)
+  | (?P<email>[\w.+-]+@[\w-]+(?:\.[\w-]+)+)
+  | (?P<date>\b\d{1,4}(?P<separator>[./-])\d{1,2}(?P=separator)\d{1,4}\b)
+  | (?P<address>\b\d{1,5}[a-z]?\s+(?:[a-z]+\s+){1,3}
+        (?:street|st|road|rd|avenue|ave|lane|ln|drive|dr|court|ct|close|way|
+           boulevard|blvd|place|pl|terrace|crescent|gardens)\b\.?)
+  | (?P<phone>(?<![\w+])\+?\d(?:[\s().-]{0,2}\d){8,14}(?!\w))
+  | (?P<postcode>\b[a-z]{1,2}\d[a-z\d]?\s*\d[a-z]{2}\b)
+  | (?P<other>\w+(?:'\w+)*)
+)""", re.IGNORECASE | re.VERBOSE)
+WORD = re.compile(r"\w+(?:'\w+)*")
+# Phone keyboards type a curly apostrophe; each folds to ' without moving offsets
+APOSTROPHES = str.maketrans({'\u2019': "'", '\u2018': "'", '\u02bc': "'"})
+
+DEFAULT_LEXICON = {
+    'self_harm': ('kill myself', 'killing myself', 'hurt myself', 'hurting myself',
+                  'cut myself', 'cutting myself', 'want to die', 'wanna die',
+                  'end my life', 'suicide', 'suicidal', 'better off dead',
+                  'no reason to live', "don't want to be alive"),
+    'abuse': ('hits me', 'beats me', 'kicks me', 'hurts me',
+              'touches me', 'touched me', 'locks me', 'locked me in', 'abuse',
+              'abused', 'scared to go home', 'afraid to go home'),
+    'bullying': ('bullied', 'bully me', 'bullies me', 'bullying me', 'bullying',
+                 'everyone hates me', 'nobody likes me', 'no one likes me'),
+    'neglect': ('no food', 'nothing to eat', 'always hungry', 'hungry all the time',
+                'nobody feeds me', 'no home', 'homeless', 'left alone at night',
+                'no heating', 'sleep outside'),
+    'contact': ('meet me', 'come to my house', 'my address is', 'my phone number',
+                'my number is', 'text me', 'call me on', 'add me on'),
+}
+
+_default_scanner = None
+
+
+def words(text):
+    """Lower-case words as the scanner sees them."""
+    return [word.lower() for word in WORD.findall((text or '').translate(APOSTROPHES))]
+
+
+class Lexicon:
+    """
+    Word-level Aho-Corasick automaton over (category, phrase) pairs.
+
+    States are indexes into parallel lists: `goto` maps a word to the next
+    state, `fail` is the longest proper suffix that is also a prefix of
+    some phrase, and `output` holds the categories of the phrases ending
+    in a state, including those reached through failure links.
+    """
+
+    def __init__(self, entries):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [frozenset()]
+        self.phrases = 0
+        for category, phrase in entries:
+            phrase_words = words(phrase)
+            if not phrase_words:
+                continue
+            state = 0
+            for word in phrase_words:
+                following = self.goto[state].get(word)
+                if following is None:
+                    following = len(self.goto)
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append(frozenset())
+                    self.goto[state][word] = following
+                state = following
+            self.output[state] |= {category}
+            self.phrases += 1
+
+        # Breadth first, so every state's failure target is done before it
+        pending = deque(self.goto[0].values())
+        while pending:
+            state = pending.popleft()
+            for word, following in self.goto[state].items():
+                pending.append(following)
+                fallback = self.fail[state]
+                while fallback and word not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[following] = self.goto[fallback].get(word, 0)
+                self.output[following] |= self.output[self.fail[following]]
+
+    @classmethod
+    def from_mapping(cls, mapping):
+        return cls((category, phrase) for category, phrases in mapping.items()
+                   for phrase in phrases)
+
+    @classmethod
+    def from_file(cls, path):
+        """
+        Read a lexicon file: one ``category: phrase`` per line, ``#`` comments.
+
+        Raises:
+            ValueError: If a line has no category
+        """
+        entries = []
+        with open(path, encoding='utf-8') as lexicon_file:
+            for number, line in enumerate(lexicon_file, start=1):
+                line = line.split('#', 1)[0].strip()
+                if not line:
+                    continue
+                category, separator, phrase = line.partition(':')
+                if not separator or not category.strip():
+                    raise ValueError(f'{path}:{number}: expected "category: phrase"')
+                entries.append((category.strip(), phrase.strip()))
+        return cls(entries)
+
+
+class ContentScanner:
+    """Redacts personal details and flags lexicon phrases in letter text."""
+
+    def __init__(self, lexicon=None):
+        self.lexicon = lexicon if lexicon is not None else Lexicon.from_mapping(DEFAULT_LEXICON)
+
+    def scan(self, text):
+        """
+        Scan one field.
+
+        Args:
+            text: Field text
+
+        Returns:
+            tuple: (text with personal details replaced, Counter of
+                   redacted kinds, set of flagged categories)
+        """
+        redacted = Counter()
+        flags = set()
+        if not text:
+            return text, redacted, flags
+        goto, fail, output = self.lexicon.goto, self.lexicon.fail, self.lexicon.output
+        parts = []
+        kept = 0
+        state = 0
+        # Fold apostrophes and lower-case once up front, unless lower-casing
+        # would move the offsets; replacements are cut from the original text
+        folded = text.translate(APOSTROPHES)
+        lowered = folded.lower()
+        lower_words = len(lowered) != len(text)
+        if lower_words:
+            lowered = folded
+        for match in TOKEN.finditer(lowered):
+            kind = match.lastgroup
+            if kind == 'word' or kind == 'other':
+                word = match[kind].lower() if lower_words else match[kind]
+                while state and word not in goto[state]:
+                    state = fail[state]
+                state = goto[state].get(word, 0)
+                if output[state]:
+                    flags |= output[state]
+            elif kind == 'date':
+                state = 0
+            else:
+                state = 0
+                start, end = match.span(kind)
+                parts.append(text[kept:start])
+                parts.append(f'[{kind}]')
+                kept = end
+                redacted[kind] += 1
+        if not parts:
+            return text, redacted, flags
+        parts.append(text[kept:])
+        return ''.join(parts), redacted, flags
+
+    def scan_letter(self, letter):
+        """
+        Scan a letter's free-text fields.
+
+        Args:
+            letter: Letter fields
+
+        Returns:
+            tuple: (copy of the letter with redacted fields and `flags`, a
+                   sorted list of categories or None; Counter of redactions)
+        """
+        scanned = dict(letter)
+        redacted = Counter()
+        flags = set()
+        for field in SCANNED_FIELDS:
+            value = letter.get(field)
+            if value:
+                scanned[field], field_redacted, field_flags = self.scan(value)
+                redacted += field_redacted
+                flags |= field_flags
+        scanned['flags'] = sorted(flags) or None
+        return scanned, redacted
+
+
+def scan_letter(letter):
+    """
+    Scan a letter with the app's scanner.
+    Returns the letter unchanged (and no redactions) if scanning is off.
+    """
+    if _default_scanner is None:
+        return letter, Counter()
+    return _default_scanner.scan_letter(letter)
+
+
+def init_app(app, lexicon_path=None):
+    """
+    Scan letters with the default lexicon, or the one in `lexicon_path`.
+
+    Args:
+        app: Flask application
+        lexicon_path: File of ``category: phrase`` lines (default: DEFAULT_LEXICON)
+    """
+    global _default_scanner
+    lexicon = Lexicon.from_file(lexicon_path) if lexicon_path else None
+    _default_scanner = ContentScanner(lexicon)
+    app.extensions['content_scanner'] = _default_scanner
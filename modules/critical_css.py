@@ -0,0 +1,439 @@
+"""
+Critical CSS module.
+Build-time tool that renders every page, works out which rules of
+static/style.css style the markup above the fold and writes them to a
+manifest keyed by endpoint. base.html inlines those rules and loads the
+full stylesheet asynchronously, with a <noscript> fallback.
+
+There is no layout engine here, so "above the fold" is approximated by the
+first FOLD_BYTES of each page's <body> markup (the initial TCP congestion
+window), and media queries are evaluated against COMMON_VIEWPORTS. Selector
+matching errs on the side of including a rule: pseudo-classes and sibling
+combinators are ignored, and child combinators are treated as descendants.
+"""
+
+import contextlib
+import json
+import os
+import re
+import tempfile
+from html.parser import HTMLParser
+
+import click
+from flask import request
+
+from modules import event_log
+from modules.minify import minify_css
+
+MANIFEST_FILENAME = 'critical_css.json'
+STYLESHEET = 'style.css'
+
+# Bytes of <body> markup treated as above the fold (initial congestion window)
+FOLD_BYTES = 14600
+
+# Common viewport sizes (width, height) used to evaluate media queries
+COMMON_VIEWPORTS = ((360, 740), (768, 1024), (1366, 768), (1920, 1080))
+
+COMMENT_PATTERN = re.compile(r'/\*.*?\*/', re.DOTALL)
+STYLE_BLOCK_PATTERN = re.compile(r'<style[^>]*>(.*?)</style>', re.DOTALL | re.IGNORECASE)
+URL_PATTERN = re.compile(r'url\(\s*([\'"]?)(?![\'"]?(?:/|data:|https?:))([^\'")]+)\1\s*\)')
+MEDIA_FEATURE_PATTERN = re.compile(r'\(\s*(min|max)-(width|height)\s*:\s*([\d.]+)px\s*\)')
+COMPOUND_PATTERN = re.compile(r'([#.]?[\w-]+|\*|\[[^\]]*\]|::?[\w-]+(?:\([^)]*\))?)')
+ANIMATION_PATTERN = re.compile(r'animation(?:-name)?\s*:\s*([^;}]+)')
+
+_manifest_cache = {}
+
+
+# ---------------------------------------------------------------------------
+# CSS parsing
+# ---------------------------------------------------------------------------
+
+def parse_stylesheet(css, media=None):
+    """
+    Split a stylesheet into top-level items.
+
+    Args:
+        css: Stylesheet source
+        media: Media query the stylesheet is nested in, if any
+
+    Returns:
+        list: Tuples of (kind, prelude, body, media) where kind is 'rule',
+              'keyframes', 'font-face' or 'at-rule'
+    """
+    css = COMMENT_PATTERN.sub('', css)
+    items = []
+    position = 0
+    length = len(css)
+    while position < length:
+        brace = css.find('{', position)
+        semicolon = css.find(';', position)
+        if brace == -1:
+            break
+        prelude = css[position:brace].strip()
+        if semicolon != -1 and semicolon < brace and prelude.startswith('@'):
+            # Statement at-rule such as @import or @charset
+            items.append(('at-rule', css[position:semicolon + 1].strip(), '', media))
+            position = semicolon + 1
+            continue
+
+        depth = 0
+        end = brace
+        while end < length:
+            if css[end] == '{':
+                depth += 1
+            elif css[end] == '}':
+                depth -= 1
+                if depth == 0:
+                    break
+            end += 1
+        body = css[brace + 1:end].strip()
+        position = end + 1
+
+        lowered = prelude.lower()
+        if lowered.startswith('@media'):
+            query = prelude[6:].strip()
+            items.extend(parse_stylesheet(body, media=query))
+        elif lowered.startswith(('@keyframes', '@-webkit-keyframes')):
+            items.append(('keyframes', prelude, body, media))
+        elif lowered.startswith('@font-face'):
+            items.append(('font-face', prelude, body, media))
+        elif lowered.startswith('@'):
+            items.append(('at-rule', prelude, body, media))
+        else:
+            items.append(('rule', prelude, body, media))
+    return items
+
+
+def media_matches(query, viewport):
+    """
+    Evaluate a media query against a viewport.
+    Unknown features count as matching so rules are never wrongly dropped.
+
+    Args:
+        query: Media query text (without '@media')
+        viewport: (width, height) tuple in CSS pixels
+
+    Returns:
+        bool: True if the query can apply at this viewport
+    """
+    if not query:
+        return True
+    width, height = viewport
+    for alternative in query.split(','):
+        alternative = alternative.strip().lower()
+        if 'print' in alternative and 'screen' not in alternative:
+            continue
+        matched = True
+        for bound, feature, value in MEDIA_FEATURE_PATTERN.findall(alternative):
+            actual = width if feature == 'width' else height
+            value = float(value)
+            if (bound == 'min' and actual < value) or (bound == 'max' and actual > value):
+                matched = False
+        if 'orientation' in alternative:
+            landscape = width >= height
+            if ('landscape' in alternative) != landscape:
+                matched = False
+        if alternative.startswith('not '):
+            matched = True
+        if matched:
+            return True
+    return False
+
+
+# ---------------------------------------------------------------------------
+# Markup and selector matching
+# ---------------------------------------------------------------------------
+
+class _Element:
+    __slots__ = ('tag', 'id', 'classes', 'attrs', 'parent')
+
+    def __init__(self, tag, attrs, parent):
+        self.tag = tag
+        self.attrs = dict(attrs)
+        self.id = self.attrs.get('id')
+        self.classes = set((self.attrs.get('class') or '').split())
+        self.parent = parent
+
+
+class _FoldParser(HTMLParser):
+    """Collect elements that start within the first fold_bytes of <body>."""
+
+    VOID_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input',
+                 'link', 'meta', 'source', 'track', 'wbr'}
+
+    def __init__(self, fold_bytes):
+        super().__init__(convert_charrefs=True)
+        self.fold_bytes = fold_bytes
+        self.body_offset = None
+        self.consumed = 0
+        self.stack = []
+        self.elements = []
+
+    def handle_starttag(self, tag, attrs):
+        parent = self.stack[-1] if self.stack else None
+        element = _Element(tag, attrs, parent)
+        if tag == 'body':
+            self.body_offset = self.consumed
+        in_fold = (self.body_offset is None
+                   or self.consumed - self.body_offset <= self.fold_bytes)
+        if in_fold:
+            self.elements.append(element)
+        if tag not in self.VOID_TAGS:
+            self.stack.append(element)
+
+    def handle_endtag(self, tag):
+        for index in range(len(self.stack) - 1, -1, -1):
+            if self.stack[index].tag == tag:
+                del self.stack[index:]
+                break
+
+    def feed_document(self, html):
+        # Track an approximate offset by feeding line by line
+        for line in html.splitlines(keepends=True):
+            self.feed(line)
+            self.consumed += len(line)
+        self.close()
+
+
+def _compound_matches(compound, element):
+    for token in COMPOUND_PATTERN.findall(compound):
+        if token == '*' or token.startswith((':', '[')):
+            if token == ':root' and element.tag != 'html':
+                return False
+            continue
+        if token.startswith('#'):
+            if element.id != token[1:]:
+                return False
+        elif token.startswith('.'):
+            if token[1:] not in element.classes:
+                return False
+        elif element.tag != token.lower():
+            return False
+    return True
+
+
+def selector_matches(selector, element):
+    """
+    Check whether a selector can match an element (superset semantics).
+
+    Args:
+        selector: Single CSS selector (no commas)
+        element: Parsed element with ancestors
+
+    Returns:
+        bool: True if the selector may apply to the element
+    """
+    # Sibling combinators: only the part after the last one has to match
+    selector = re.split(r'\s*[+~]\s*', selector)[-1]
+    parts = [part for part in re.split(r'\s*>\s*|\s+', selector.strip()) if part]
+    if not parts or not _compound_matches(parts[-1], element):
+        return False
+    ancestor = element.parent
+    for compound in reversed(parts[:-1]):
+        while ancestor is not None and not _compound_matches(compound, ancestor):
+            ancestor = ancestor.parent
+        if ancestor is None:
+            return False
+        ancestor = ancestor.parent
+    return True
+
+
+# ---------------------------------------------------------------------------
+# Extraction
+# ---------------------------------------------------------------------------
+
+def rewrite_urls(css, base_url):
+    """Make relative url() references absolute so the CSS can be inlined."""
+    return URL_PATTERN.sub(lambda m: f'url({m.group(1)}{base_url}{m.group(2)}{m.group(1)})', css)
+
+
+def extract_critical_css(html, css, fold_bytes=FOLD_BYTES, viewports=COMMON_VIEWPORTS):
+    """
+    Select the rules of a stylesheet that apply above the fold of a page.
+
+    Args:
+        html: Rendered page
+        css: Stylesheet source
+        fold_bytes: Bytes of <body> markup considered above the fold
+        viewports: (width, height) tuples used for media queries
+
+    Returns:
+        str: Critical CSS, grouped back into @media blocks
+    """
+    parser = _FoldParser(fold_bytes)
+    parser.feed_document(html)
+    elements = parser.elements
+
+    kept = []
+    animations = set()
+    for kind, prelude, body, media in parse_stylesheet(css):
+        if media and not any(media_matches(media, viewport) for viewport in viewports):
+            continue
+        if kind == 'rule':
+            selectors = [s.strip() for s in prelude.split(',')]
+            if any(selector_matches(s, e) for s in selectors for e in elements):
+                kept.append((prelude, body, media))
+                for names in ANIMATION_PATTERN.findall(body):
+                    animations.update(re.findall(r'[\w-]+', names))
+        elif kind in ('font-face', 'at-rule'):
+            kept.append((prelude, body, media))
+        else:
+            kept.append((prelude, body, media, kind))
+
+    output = []
+    for item in kept:
+        prelude, body, media = item[:3]
+        if len(item) == 4:
+            name = prelude.split(None, 1)[1].strip() if ' ' in prelude else ''
+            if name not in animations:
+                continue
+        block = f'{prelude}{{{body}}}' if body or not prelude.endswith(';') else prelude
+        output.append(f'@media {media}{{{block}}}' if media else block)
+    return minify_css('\n'.join(output))
+
+
+def inline_style_bytes(html):
+    """Bytes of render-blocking <style> blocks written into a page."""
+    return sum(len(block.encode()) for block in STYLE_BLOCK_PATTERN.findall(html))
+
+
+def manifest_path(app):
+    return os.path.join(app.static_folder, MANIFEST_FILENAME)
+
+
+def load_manifest(app):
+    """Load the critical CSS manifest once per process (empty if not built)."""
+    path = manifest_path(app)
+    if path not in _manifest_cache:
+        try:
+            with open(path, encoding='utf-8') as manifest_file:
+                _manifest_cache[path] = json.load(manifest_file)
+        except (OSError, ValueError):
+            _manifest_cache[path] = {}
+    return _manifest_cache[path]
+
+
+def critical_css_for(app, endpoint):
+    """
+    Get the inline critical CSS for an endpoint.
+
+    Returns:
+        str: Critical CSS, or None to fall back to a blocking stylesheet
+    """
+    if not app.config.get('CRITICAL_CSS', True) or not endpoint:
+        return None
+    entry = load_manifest(app).get(endpoint)
+    return entry['css'] if entry else None
+
+
+def _page_routes(app):
+    """Endpoints with a parameterless GET route that renders a page."""
+    for rule in app.url_map.iter_rules():
+        if 'GET' in rule.methods and not rule.arguments and rule.endpoint not in ('static', 'reset'):
+            yield rule.endpoint, rule.rule
+
+
+def _player_client(app, submitted):
+    """Test client for a player who finished the modules and, optionally, sent a letter."""
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['modules_completed'] = {name: True for name in
+                                        ('elf', 'reindeer', 'ethics', 'emotion')}
+        if submitted:
+            session['letter_data'] = {
+                'name': 'Friend', 'age': None, 'gender': None, 'country': None,
+                'feeling': 'happy', 'wish': 'snow', 'memory': 'cookies',
+                'submitted': True
+            }
+            session['santa_reply'] = 'Dear Friend,'
+    return client
+
+
+@contextlib.contextmanager
+def _scratch_telemetry(app):
+    """Send the event log and metrics of the build's requests to a temporary folder."""
+    writer = event_log._default_writer
+    metrics = app.extensions.get('metrics')
+    saved = (metrics.directory, metrics.store) if metrics else None
+    with tempfile.TemporaryDirectory(prefix='santa-critical-css-') as scratch:
+        scratch_writer = None
+        if writer is not None:
+            scratch_writer = event_log.JsonlWriter(os.path.join(scratch, 'events'), 'events')
+            event_log._default_writer = app.extensions['event_log'] = scratch_writer
+        if metrics:
+            metrics.directory, metrics.store = os.path.join(scratch, 'metrics'), None
+        try:
+            yield
+        finally:
+            if scratch_writer is not None:
+                scratch_writer.close()
+                event_log._default_writer = app.extensions['event_log'] = writer
+            if metrics:
+                metrics.directory, metrics.store = saved
+
+
+def build_manifest(app):
+    """
+    Render every page and extract its critical CSS. Pages are rendered as a
+    player who finished the game, or, for pages that redirect such a player
+    (the letter form), as one who hasn't sent a letter yet.
+
+    Returns:
+        dict: Manifest keyed by endpoint with the CSS and byte metrics
+    """
+    with open(os.path.join(app.static_folder, STYLESHEET), encoding='utf-8') as css_file:
+        stylesheet = css_file.read()
+    stylesheet = rewrite_urls(stylesheet, app.static_url_path + '/')
+    stylesheet_bytes = len(stylesheet.encode())
+
+    enabled = app.config.get('CRITICAL_CSS', True)
+    app.config['CRITICAL_CSS'] = False
+    try:
+        with _scratch_telemetry(app):
+            clients = (_player_client(app, submitted=True), _player_client(app, submitted=False))
+            manifest = {}
+            for endpoint, path in _page_routes(app):
+                for client in clients:
+                    response = client.get(path)
+                    if response.status_code == 200 and response.mimetype == 'text/html':
+                        break
+                else:
+                    continue
+                html = response.get_data(as_text=True)
+                critical = extract_critical_css(html, stylesheet)
+                inline_bytes = inline_style_bytes(html)
+                manifest[endpoint] = {
+                    'css': critical,
+                    'blocking_bytes_before': inline_bytes + stylesheet_bytes,
+                    'blocking_bytes_after': inline_bytes + len(critical.encode()),
+                }
+    finally:
+        app.config['CRITICAL_CSS'] = enabled
+    return manifest
+
+
+def init_app(app):
+    """
+    Expose ``critical_css`` to templates and register ``flask critical-css``.
+
+    Args:
+        app: Flask application
+    """
+    @app.context_processor
+    def inject_critical_css():
+        return {'critical_css': critical_css_for(app, request.endpoint)}
+
+    @app.cli.command('critical-css')
+    def build_critical_css_command():
+        """Build the per-endpoint critical CSS manifest."""
+        manifest = build_manifest(app)
+        path = manifest_path(app)
+        with open(path, 'w', encoding='utf-8') as manifest_file:
+            json.dump(manifest, manifest_file, indent=1, sort_keys=True)
+        _manifest_cache.pop(path, None)
+
+        click.echo(f"{'endpoint':<22}{'critical':>10}{'blocking before':>17}{'after':>8}")
+        for endpoint, entry in sorted(manifest.items()):
+            click.echo(f"{endpoint:<22}{len(entry['css']):>10}"
+                       f"{entry['blocking_bytes_before']:>17}{entry['blocking_bytes_after']:>8}")
+        click.echo(f'Wrote {path}')
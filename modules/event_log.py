@@ -0,0 +1,235 @@
+"""
+Structured event log module.
+Writes JSON lines (access records and funnel events such as module
+completions, letter submissions and detected emotions) without blocking
+requests: events go into a bounded queue and a background thread writes
+them in batches. When the queue is full, events are dropped and counted
+instead of making the request wait.
+
+Each process appends to its own file (<prefix>-<pid>.jsonl) and rotates it
+by size, so gunicorn workers never interleave or race on rotation.
+"""
+
+import atexit
+import glob
+import json
+import os
+import queue
+import threading
+import time
+
+from flask import g, request
+
+_STOP = object()
+
+_default_writer = None
+
+
+class JsonlWriter:
+    """Bounded, batched, rotating JSON-lines writer running on a daemon thread."""
+
+    def __init__(self, directory, prefix, max_bytes=10 * 1024 * 1024, backup_count=5,
+                 queue_size=10000, batch_size=500, flush_interval=1.0):
+        """
+        Args:
+            directory: Folder for the log files
+            prefix: File name prefix, e.g. 'events'
+            max_bytes: Rotate the file once it grows past this size
+            backup_count: Rotated files kept (<file>.1 is the newest)
+            queue_size: Records buffered before new ones are dropped
+            batch_size: Most records written per write() call
+            flush_interval: Seconds to wait for more records before writing
+        """
+        self.directory = directory
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._reported_dropped = 0
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def path(self):
+        return os.path.join(self.directory, f'{self.prefix}-{os.getpid()}.jsonl')
+
+    def emit(self, record):
+        """
+        Queue a record for writing; never blocks.
+
+        Args:
+            record: JSON-serialisable dict
+
+        Returns:
+            bool: False if the record was dropped because the queue is full
+        """
+        if self._pid != os.getpid():
+            self._start()
+        try:
+            self._queue.put_nowait(record)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def _start(self):
+        # Started lazily, and again after a fork, since threads don't survive fork
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(self.queue_size)
+            self._thread = threading.Thread(target=self._run, name=f'{self.prefix}-writer',
+                                            daemon=True)
+            self._pid = os.getpid()
+            self._thread.start()
+            atexit.register(self.close)
+
+    def close(self, timeout=5.0):
+        """Write everything still queued and stop the writer thread."""
+        if self._pid != os.getpid() or not self._thread.is_alive():
+            return
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+
+    def _run(self):
+        os.makedirs(self.directory, exist_ok=True)
+        stopping = False
+        while not stopping:
+            try:
+                batch = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if _STOP in batch:
+                stopping = True
+                batch = [record for record in batch if record is not _STOP]
+            if self.dropped != self._reported_dropped:
+                batch.append({'ts': time.time(), 'event': 'log.dropped',
+                              'count': self.dropped - self._reported_dropped})
+                self._reported_dropped = self.dropped
+            if batch:
+                self._write(batch)
+
+    def _write(self, batch):
+        data = ''.join(json.dumps(record, separators=(',', ':'), default=str) + '\n'
+                       for record in batch).encode('utf-8')
+        path = self.path
+        try:
+            with open(path, 'ab') as log_file:
+                log_file.write(data)
+                size = log_file.tell()
+        except OSError:
+            self.dropped += len(batch)
+            return
+        if size >= self.max_bytes:
+            self._rotate(path)
+
+    def _rotate(self, path):
+        for index in range(self.backup_count - 1, 0, -1):
+            source = f'{path}.{index}'
+            if os.path.exists(source):
+                os.replace(source, f'{path}.{index + 1}')
+        if self.backup_count > 0:
+            os.replace(path, f'{path}.1')
+        else:
+            os.remove(path)
+
+
+def iter_records(directory, prefix):
+    """
+    Read back every record written by JsonlWriters with a given prefix.
+
+    Covers all workers' files including rotated ones, oldest file first.
+    Lines that do not parse (e.g. cut off by a crash) are skipped.
+
+    Args:
+        directory: Folder the writers used
+        prefix: File name prefix, e.g. 'vitals'
+
+    Yields:
+        dict: One record per line
+    """
+    paths = []
+    for path in glob.glob(os.path.join(directory, f'{prefix}-*.jsonl*')):
+        try:
+            paths.append((os.path.getmtime(path), path))
+        except OSError:
+            continue  # rotated away since the glob
+    for _, path in sorted(paths):
+        try:
+            log_file = open(path, encoding='utf-8')
+        except OSError:
+            continue
+        with log_file:
+            for line in log_file:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+
+def log_event(event, **fields):
+    """
+    Record a structured event in the app's event log.
+    Does nothing if the event log is not enabled.
+
+    Args:
+        event: Dotted event name, e.g. 'letter.submitted'
+        **fields: JSON-serialisable event attributes
+    """
+    if _default_writer is None:
+        return
+    fields['ts'] = time.time()
+    fields['event'] = event
+    _default_writer.emit(fields)
+
+
+def init_app(app, access_log=True):
+    """
+    Enable the event log, optionally with one access record per request.
+
+    Args:
+        app: Flask application
+        access_log: Also log method, path, status and duration of requests
+
+    Returns:
+        JsonlWriter: The writer behind log_event()
+    """
+    global _default_writer
+    directory = app.config.get('EVENT_LOG_DIR') or os.path.join(app.instance_path, 'events')
+    _default_writer = JsonlWriter(directory, 'events',
+                                  max_bytes=app.config.get('EVENT_LOG_MAX_BYTES', 10 * 1024 * 1024))
+    app.extensions['event_log'] = _default_writer
+
+    if access_log:
+        @app.before_request
+        def start_access_timer():
+            g.access_start = time.perf_counter()
+
+        @app.after_request
+        def log_access(response):
+            start = g.pop('access_start', None)
+            log_event(
+                'request',
+                method=request.method,
+                path=request.path,
+                endpoint=request.endpoint,
+                status=response.status_code,
+                bytes=response.content_length,
+                duration_ms=round((time.perf_counter() - start) * 1000, 3) if start else None,
+            )
+            return response
+
+    return _default_writer
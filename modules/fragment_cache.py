@@ -0,0 +1,89 @@
+"""
+Template fragment cache module.
+Adds a ``{% cache %}`` tag to Jinja so shared components (progress bar,
+mission header, level nodes) are rendered once per distinct input instead
+of on every request:
+
+    {% cache 'progress_bar', progress %}
+        ...markup that only depends on progress...
+    {% endcache %}
+
+The first argument names the fragment, the rest are the only values the
+fragment may depend on. Anything else used inside the block is frozen at
+its first render.
+"""
+
+import threading
+from collections import OrderedDict
+
+from jinja2 import nodes
+from jinja2.ext import Extension
+
+
+class FragmentCache:
+    """Small thread-safe LRU mapping of fragment keys to rendered markup."""
+
+    def __init__(self, maxsize=512):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class FragmentCacheExtension(Extension):
+    """Jinja extension implementing ``{% cache name, *inputs %}...{% endcache %}``."""
+
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=FragmentCache())
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        call = self.call_method('_render_cached', [nodes.List(args)])
+        return nodes.CallBlock(call, [], [], body).set_lineno(lineno)
+
+    def _render_cached(self, args, caller):
+        # repr() gives a hashable key for dicts and lists of inputs too
+        key = repr(args)
+        cache = self.environment.fragment_cache
+        markup = cache.get(key)
+        if markup is None:
+            markup = caller()
+            cache.set(key, markup)
+        return markup
+
+
+def init_app(app):
+    """
+    Enable the ``{% cache %}`` tag in a Flask app's templates.
+
+    Args:
+        app: Flask application
+    """
+    app.jinja_env.add_extension(FragmentCacheExtension)
@@ -0,0 +1,196 @@
+"""
+Game frame-time telemetry module.
+The elf and reindeer games record requestAnimationFrame intervals into a
+fixed histogram (static/frame_stats.js) and send one compact beacon when a
+round ends. POST /telemetry/frames validates it and queues it for a
+background JsonlWriter, like the Web Vitals beacons.
+
+``flask frames-report`` merges the histograms per game and device class and
+prints frame-time percentiles and long-frame rates, showing which game
+loops drop frames on which devices.
+"""
+
+import os
+import time
+from collections import defaultdict
+
+import click
+from flask import jsonify, request, url_for
+
+from modules.event_log import JsonlWriter, iter_records
+
+GAMES = ('elf', 'reindeer')
+OUTCOMES = ('success', 'fail', 'abandoned')
+
+# Upper bounds in ms of the frame-time buckets (120Hz, 60Hz, 2-6 missed
+# frames, ...); the client adds an overflow bucket. Shared with frame_stats.js.
+BUCKETS = (8.4, 16.7, 25, 33.4, 50, 66.7, 100, 200, 500)
+PERCENTILES = (50, 95, 99)
+
+MAX_BODY_BYTES = 4 * 1024
+MAX_FRAMES = 10 ** 6
+
+
+def default_frames_dir(app):
+    return app.config.get('FRAMES_DIR') or os.path.join(app.instance_path, 'frames')
+
+
+def device_class(device):
+    """
+    Bucket a device by form factor and rough performance tier.
+
+    Args:
+        device: {'cores': int, 'memory': GB, 'mobile': bool} hints from the browser
+
+    Returns:
+        str: e.g. 'mobile-low', 'desktop-high' or 'desktop-unknown'
+    """
+    device = device if isinstance(device, dict) else {}
+    form = 'mobile' if device.get('mobile') is True else 'desktop'
+    cores = _number(device.get('cores'))
+    memory = _number(device.get('memory'))
+    if cores is None and memory is None:
+        tier = 'unknown'
+    elif (cores is not None and cores <= 4) or (memory is not None and memory <= 2):
+        tier = 'low'
+    else:
+        tier = 'high'
+    return f'{form}-{tier}'
+
+
+def _number(value):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    return value
+
+
+def clean_beacon(beacon):
+    """
+    Validate a frame-time beacon.
+
+    Args:
+        beacon: Decoded JSON body
+
+    Returns:
+        dict: The record to store, or None if the beacon is invalid
+    """
+    if not isinstance(beacon, dict):
+        return None
+    if beacon.get('game') not in GAMES or beacon.get('outcome') not in OUTCOMES:
+        return None
+    buckets = beacon.get('buckets')
+    if (not isinstance(buckets, list) or len(buckets) != len(BUCKETS) + 1
+            or not all(isinstance(n, int) and not isinstance(n, bool) and n >= 0 for n in buckets)):
+        return None
+    frames = sum(buckets)
+    long_frames = _number(beacon.get('long_frames'))
+    if not 0 < frames <= MAX_FRAMES or long_frames is None or not 0 <= long_frames <= frames:
+        return None
+    return {
+        'game': beacon['game'],
+        'outcome': beacon['outcome'],
+        'device': device_class(beacon.get('device')),
+        'frames': frames,
+        'long_frames': int(long_frames),
+        'max_ms': _number(beacon.get('max_ms')),
+        'duration_ms': _number(beacon.get('duration_ms')),
+        'buckets': buckets,
+    }
+
+
+def histogram_percentile(counts, pct):
+    """
+    Percentile of a bucketed histogram, as the upper bound of its bucket.
+
+    Returns:
+        float: Bucket bound in ms, or None when in the overflow bucket
+    """
+    target = pct / 100 * sum(counts)
+    cumulative = 0
+    for bound, count in zip(BUCKETS + (None,), counts):
+        cumulative += count
+        if cumulative >= target:
+            return bound
+    return None
+
+
+def aggregate(records, since=None):
+    """
+    Merge beacons per (game, device class).
+
+    Returns:
+        dict: {(game, device): {'rounds', 'frames', 'long_frames', 'buckets'}}
+    """
+    groups = defaultdict(lambda: {'rounds': 0, 'frames': 0, 'long_frames': 0,
+                                  'buckets': [0] * (len(BUCKETS) + 1)})
+    for record in records:
+        if since is not None and record.get('ts', 0) < since:
+            continue
+        buckets = record.get('buckets')
+        if not isinstance(buckets, list) or len(buckets) != len(BUCKETS) + 1:
+            continue  # written with a different bucket layout
+        group = groups[(record.get('game'), record.get('device'))]
+        group['rounds'] += 1
+        group['frames'] += record.get('frames', 0)
+        group['long_frames'] += record.get('long_frames', 0)
+        for i, count in enumerate(buckets):
+            group['buckets'][i] += count
+    return groups
+
+
+def init_app(app):
+    """
+    Expose the frame telemetry settings to templates, accept beacons and
+    register ``flask frames-report``.
+
+    Args:
+        app: Flask application
+
+    Returns:
+        JsonlWriter: The writer the beacons go to
+    """
+    writer = JsonlWriter(default_frames_dir(app), 'frames', flush_interval=2.0)
+    app.extensions['frames'] = writer
+
+    @app.context_processor
+    def inject_frame_telemetry():
+        return {'frame_telemetry': {'url': url_for('collect_frames'), 'buckets': BUCKETS}}
+
+    @app.route('/telemetry/frames', methods=['POST'])
+    def collect_frames():
+        """Accept one game round's frame-time histogram from sendBeacon."""
+        if (request.content_length or 0) > MAX_BODY_BYTES:
+            return jsonify(error='beacon too large'), 413
+        record = clean_beacon(request.get_json(force=True, silent=True))
+        if record is None:
+            return jsonify(error='invalid frame beacon'), 400
+        record['ts'] = time.time()
+        writer.emit(record)
+        return '', 204
+
+    @app.cli.command('frames-report')
+    @click.option('--hours', type=float, default=None,
+                  help='Only include rounds from the last N hours.')
+    @click.option('--dir', 'directory', default=None,
+                  help='Beacon folder (default: FRAMES_DIR or instance/frames).')
+    def frames_report_command(hours, directory):
+        """Print frame-time percentiles per game and device class."""
+        since = time.time() - hours * 3600 if hours else None
+        groups = aggregate(iter_records(directory or default_frames_dir(app), 'frames'), since)
+        if not groups:
+            click.echo('No frame beacons recorded.')
+            return
+
+        header = ''.join(f'{f"p{pct}":>9}' for pct in PERCENTILES)
+        click.echo(f"{'game':<10}{'device':<16}{'rounds':>7}{'frames':>10}{header}"
+                   f"{'long/1k':>9}")
+        for (game, device), group in sorted(groups.items(), key=lambda item: str(item[0])):
+            cells = ''
+            for pct in PERCENTILES:
+                bound = histogram_percentile(group['buckets'], pct)
+                cells += f"{f'<={bound:g}ms' if bound is not None else f'>{BUCKETS[-1]:g}ms':>9}"
+            rate = 1000 * group['long_frames'] / group['frames'] if group['frames'] else 0
+            click.echo(f"{game:<10}{device:<16}{group['rounds']:>7}{group['frames']:>10}"
+                       f"{cells}{rate:>9.1f}")
+
+    return writer
@@ -0,0 +1,460 @@
+"""
+Letter archive module.
+Keeps every submitted letter, with its detected emotion and Santa's reply,
+in an append-only SQLite database (WAL mode) so that letters outlive the
+player's session cookie.
+
+submit_letter only puts the letter on a bounded in-memory queue. A
+background thread per process inserts queued letters in batched
+transactions, so no request waits for SQLite or a disk sync. When the
+queue is full, letters are appended to a per-process spill file instead
+and loaded into the database once the writer catches up. The queue is
+drained when the process exits (atexit, and gunicorn's worker_exit hook).
+
+A letter that fails to insert for any reason other than SQLite itself
+(a malformed spill line, say) is moved to a quarantine file,
+letters-quarantine-<pid>.jsonl, so it can't stop the writer or block the
+letters behind it.
+"""
+
+import atexit
+import glob
+import json
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+
+from modules import letter_dedup, letter_rollups, letter_segments
+from modules.event_log import log_event
+
+_STOP = object()
+
+_default_archive = None
+
+LETTER_FIELDS = ('name', 'age', 'gender', 'country', 'feeling', 'wish', 'memory')
+COLUMNS = ('created_at',) + LETTER_FIELDS + ('emotion', 'reply', 'flags')
+
+# Schema changes in order; PRAGMA user_version records how many have run.
+# Each is a SQL script, or a function given the connection for changes
+# that also need Python.
+MIGRATIONS = (
+    """
+    CREATE TABLE letters (
+        id INTEGER PRIMARY KEY,
+        created_at REAL NOT NULL,
+        name TEXT,
+        age INTEGER,
+        gender TEXT,
+        country TEXT,
+        feeling TEXT,
+        wish TEXT,
+        memory TEXT,
+        emotion TEXT,
+        reply TEXT
+    );
+    CREATE INDEX letters_created_at ON letters (created_at);
+    """,
+    # Full-text index over the free-text fields (see modules.letter_search).
+    # External content: the text lives only in letters, and the triggers keep
+    # the index in step inside the same transaction as each write.
+    """
+    CREATE VIRTUAL TABLE letters_fts USING fts5 (
+        wish, feeling, memory,
+        content='letters', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    );
+    CREATE TRIGGER letters_fts_insert AFTER INSERT ON letters BEGIN
+        INSERT INTO letters_fts (rowid, wish, feeling, memory)
+        VALUES (new.id, new.wish, new.feeling, new.memory);
+    END;
+    CREATE TRIGGER letters_fts_delete AFTER DELETE ON letters BEGIN
+        INSERT INTO letters_fts (letters_fts, rowid, wish, feeling, memory)
+        VALUES ('delete', old.id, old.wish, old.feeling, old.memory);
+    END;
+    CREATE TRIGGER letters_fts_update AFTER UPDATE OF wish, feeling, memory ON letters BEGIN
+        INSERT INTO letters_fts (letters_fts, rowid, wish, feeling, memory)
+        VALUES ('delete', old.id, old.wish, old.feeling, old.memory);
+        INSERT INTO letters_fts (rowid, wish, feeling, memory)
+        VALUES (new.id, new.wish, new.feeling, new.memory);
+    END;
+    INSERT INTO letters_fts (letters_fts) VALUES ('rebuild');
+    """,
+    # Dashboard counters, kept up to date by LetterArchive._insert
+    letter_rollups.create,
+    # Duplicate detection; older letters are classified by flask dedup-letters
+    letter_dedup.MIGRATION,
+    # Categories modules.content_scanner flagged, comma separated
+    """
+    ALTER TABLE letters ADD COLUMN flags TEXT;
+    CREATE INDEX letters_flagged ON letters (id) WHERE flags IS NOT NULL;
+    """,
+    # Sparse index of the cold monthly segments (see modules.letter_maintenance)
+    letter_segments.MIGRATION,
+    # Dashboard countries counted case-insensitively, with their display names
+    letter_rollups.key_countries,
+)
+
+SPILL_PATTERN = re.compile(r'letters-(spill|ingest)-(\d+)(?:-\d+)?\.jsonl$')
+
+
+def connect(path):
+    """
+    Open the archive, creating or migrating the schema as needed.
+
+    Args:
+        path: SQLite database file
+
+    Returns:
+        sqlite3.Connection: Connection in WAL mode
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    connection.execute('PRAGMA journal_mode=WAL')
+    # In WAL mode NORMAL only syncs at checkpoints, not on every commit
+    connection.execute('PRAGMA synchronous=NORMAL')
+    migrate(connection)
+    return connection
+
+
+def _statements(script):
+    """Split a SQL script into statements, keeping trigger bodies whole."""
+    statement = ''
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            yield statement.strip()
+            statement = ''
+    if statement.strip():
+        yield statement.strip()
+
+
+def migrate(connection):
+    """Apply pending MIGRATIONS, each in its own write transaction."""
+    if connection.execute('PRAGMA user_version').fetchone()[0] >= len(MIGRATIONS):
+        return
+    isolation_level = connection.isolation_level
+    connection.isolation_level = None  # manage the transactions explicitly
+    try:
+        for number, script in enumerate(MIGRATIONS, start=1):
+            # IMMEDIATE takes the write lock, so two workers starting at
+            # once cannot both apply the same migration
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                if connection.execute('PRAGMA user_version').fetchone()[0] >= number:
+                    connection.execute('ROLLBACK')
+                    continue
+                if callable(script):
+                    script(connection)
+                else:
+                    for statement in _statements(script):
+                        connection.execute(statement)
+                connection.execute(f'PRAGMA user_version = {number}')
+                connection.execute('COMMIT')
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+    finally:
+        connection.isolation_level = isolation_level
+
+
+def letter_row(letter, emotion=None, reply=None, created_at=None):
+    """
+    Build an archive record from the session's letter data.
+
+    Args:
+        letter: Letter fields as stored by save_letter_data
+        emotion: Detected emotion of the feeling text
+        reply: Santa's generated reply
+        created_at: Unix timestamp (default: now)
+
+    Returns:
+        dict: JSON-serialisable record with one key per column
+    """
+    record = {field: letter.get(field) or None for field in LETTER_FIELDS}
+    try:
+        record['age'] = int(record['age']) if record['age'] is not None else None
+    except (TypeError, ValueError):
+        record['age'] = None
+    record['emotion'] = emotion
+    record['reply'] = reply
+    record['flags'] = ','.join(letter.get('flags') or ()) or None
+    record['created_at'] = created_at if created_at is not None else time.time()
+    return record
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class LetterArchive:
+    """Bounded queue plus a background thread that batches letters into SQLite."""
+
+    def __init__(self, path, queue_size=1000, batch_size=200, flush_interval=0.5):
+        """
+        Args:
+            path: SQLite database file
+            queue_size: Letters buffered in memory before spilling to disk
+            batch_size: Most letters inserted per transaction
+            flush_interval: Seconds to wait for more letters before writing
+        """
+        self.path = path
+        self.directory = os.path.dirname(os.path.abspath(path))
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.written = 0
+        self.spilled = 0
+        self.quarantined = 0
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._spill_lock = threading.Lock()
+        self._claims = 0
+        self._claimed = []
+
+    def connect(self):
+        """Open another connection to the archive, e.g. for admin reads."""
+        return connect(self.path)
+
+    @property
+    def spill_path(self):
+        return os.path.join(self.directory, f'letters-spill-{os.getpid()}.jsonl')
+
+    @property
+    def quarantine_path(self):
+        return os.path.join(self.directory, f'letters-quarantine-{os.getpid()}.jsonl')
+
+    def submit(self, record):
+        """
+        Queue a letter record for the archive; never waits for the database.
+
+        Returns:
+            bool: False if the queue was full and the letter was spilled to disk
+        """
+        if self._pid != os.getpid():
+            self._start()
+        try:
+            self._queue.put_nowait(record)
+            return True
+        except queue.Full:
+            self._spill([record])
+            return False
+
+    def _start(self):
+        # Started lazily, and again after a fork, since threads don't survive fork
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(self.queue_size)
+            self._thread = threading.Thread(target=self._run, name='letter-archive-writer',
+                                            daemon=True)
+            self._pid = os.getpid()
+            self._thread.start()
+            atexit.register(self.close)
+
+    def close(self, timeout=10.0):
+        """Write everything still queued or spilled and stop the writer thread."""
+        if self._pid != os.getpid() or not self._thread.is_alive():
+            return
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+
+    def _run(self):
+        connection = connect(self.path)
+        self._ingest_spills(connection)
+        stopping = False
+        while not stopping:
+            try:
+                batch = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                # Idle: a good moment to load letters that overflowed earlier
+                self._ingest_spills(connection)
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if _STOP in batch:
+                stopping = True
+                batch = [record for record in batch if record is not _STOP]
+            if batch and not self._write(connection, batch):
+                self._spill(batch)
+        self._ingest_spills(connection)
+        connection.close()
+
+    def _write(self, connection, batch):
+        """
+        Insert a batch in one transaction; returns False if SQLite failed
+        (locked, busy, out of disk), so the batch should be retried later.
+
+        A batch that fails any other way, including a constraint or a value
+        SQLite can't store, is retried a letter at a time, and letters that
+        fail again are quarantined instead of being retried.
+        """
+        try:
+            self._commit(connection, batch)
+        except sqlite3.OperationalError:
+            return False
+        except Exception as error:
+            log_event('archive.batch_failed', letters=len(batch), error=repr(error))
+            for number, record in enumerate(batch):
+                try:
+                    self._commit(connection, [record])
+                except sqlite3.OperationalError:
+                    # The letters before this one are in; spill only the rest
+                    self._spill(batch[number:])
+                    break
+                except Exception as error:
+                    self._quarantine(record, error)
+        return True
+
+    def _commit(self, connection, batch):
+        with connection:
+            # Take the write lock before classifying, so another worker's
+            # writer can't archive the same letter as an original meanwhile
+            connection.execute('BEGIN IMMEDIATE')
+            self._insert(connection, batch)
+        self.written += len(batch)
+
+    def _insert(self, connection, batch):
+        columns = COLUMNS + letter_dedup.COLUMNS
+        sql = (f'INSERT INTO letters ({", ".join(columns)}) '
+               f'VALUES ({", ".join("?" for _ in columns)})')
+        for record in batch:
+            # One at a time: each letter may duplicate one earlier in the batch
+            dedup = letter_dedup.classify(connection, record)
+            values = dict(record, **dedup)
+            letter_id = connection.execute(sql, [values.get(column) for column in columns]).lastrowid
+            if dedup['bands']:
+                letter_dedup.index(connection, letter_id, dedup['bands'])
+        # Same transaction as the letters, so the counters never drift from them
+        letter_rollups.add_records(connection, batch)
+
+    def _spill(self, records):
+        data = ''.join(json.dumps(record, separators=(',', ':')) + '\n' for record in records)
+        with self._spill_lock:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self.spill_path, 'a', encoding='utf-8') as spill_file:
+                spill_file.write(data)
+        self.spilled += len(records)
+
+    def _quarantine(self, record, error):
+        data = json.dumps(record, separators=(',', ':'), default=repr) + '\n'
+        with self._spill_lock:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self.quarantine_path, 'a', encoding='utf-8') as quarantine_file:
+                quarantine_file.write(data)
+        self.quarantined += 1
+        log_event('archive.letter_quarantined', path=self.quarantine_path, error=repr(error))
+
+    def _claim(self, path):
+        """Rename a spill file to a name only this archive uses; None if another won."""
+        self._claims += 1
+        claimed = os.path.join(self.directory, f'letters-ingest-{os.getpid()}-{self._claims}.jsonl')
+        try:
+            os.replace(path, claimed)
+        except FileNotFoundError:
+            return None
+        self._claimed.append(claimed)
+        return claimed
+
+    def _ingest_spills(self, connection):
+        """Load this process's spill file, and those left by processes that died."""
+        own_pid = os.getpid()
+        for path in sorted(glob.glob(os.path.join(self.directory, 'letters-*.jsonl'))):
+            match = SPILL_PATTERN.search(os.path.basename(path))
+            if match is None:
+                continue
+            pid = int(match.group(2))
+            if pid == own_pid:
+                if match.group(1) == 'spill':
+                    with self._spill_lock:
+                        self._claim(path)
+            elif not _pid_alive(pid):
+                self._claim(path)
+        for path in list(self._claimed):
+            if not self._ingest_file(connection, path):
+                break  # SQLite is failing; retried when idle
+
+    def _ingest_file(self, connection, path):
+        records = []
+        with open(path, encoding='utf-8') as spill_file:
+            for line in spill_file:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue  # cut off by a crash mid-write
+        for start in range(0, len(records), self.batch_size):
+            if not self._write(connection, records[start:start + self.batch_size]):
+                # Keep only the letters not written yet, so a retry adds no duplicates
+                self._rewrite(path, records[start:])
+                return False
+        os.remove(path)
+        self._claimed.remove(path)
+        return True
+
+    @staticmethod
+    def _rewrite(path, records):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as spill_file:
+            spill_file.writelines(json.dumps(record, separators=(',', ':')) + '\n'
+                                  for record in records)
+        os.replace(tmp_path, path)
+
+
+def archive_letter(letter, emotion=None, reply=None):
+    """
+    Queue a submitted letter for the archive.
+    Does nothing if the archive is not enabled.
+
+    Args:
+        letter: Letter fields as stored by save_letter_data
+        emotion: Detected emotion of the feeling text
+        reply: Santa's generated reply
+    """
+    if _default_archive is None:
+        return
+    _default_archive.submit(letter_row(letter, emotion, reply))
+
+
+def shutdown():
+    """Drain the archive queue, e.g. from gunicorn's worker_exit hook."""
+    if _default_archive is not None:
+        _default_archive.close()
+
+
+def default_archive_path(app):
+    return app.config.get('LETTER_ARCHIVE_PATH') or os.path.join(app.instance_path, 'letters.db')
+
+
+def init_app(app, queue_size=1000):
+    """
+    Enable the letter archive.
+
+    Args:
+        app: Flask application
+        queue_size: Letters buffered in memory before spilling to disk
+
+    Returns:
+        LetterArchive: The archive behind archive_letter()
+    """
+    global _default_archive
+    _default_archive = LetterArchive(default_archive_path(app), queue_size=queue_size)
+    app.extensions['letter_archive'] = _default_archive
+    return _default_archive
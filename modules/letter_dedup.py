@@ -0,0 +1,337 @@
+"""
+Letter dedup module.
+Many letters are copy-pasted or templated by a classroom, and players
+resubmit the same letter after a reset. This module finds them:
+
+- Exact duplicates share a content hash of the normalised wish, feeling
+  and memory. They point at the first such letter (duplicate_of) but keep
+  their own reply, since the reply a player saw is usually a new one.
+- Near duplicates are found with MinHash over word 3-gram shingles and
+  banded LSH. Candidates from the letter_minhash buckets are checked with
+  the exact Jaccard similarity, and a match is recorded as similar_to.
+  Only letters that are neither kind of duplicate get buckets, so the
+  index grows with distinct letters rather than with all letters.
+
+Both run once, in the archive's writer thread (LetterArchive._insert),
+inside the batch's write transaction, so the writers of different workers
+classify one batch at a time and never both take a letter as the original.
+Reply reuse happens only before that, in memory: generating a reply
+costs tens of microseconds, about the same as a database lookup, so
+reply_for() keeps a small LRU cache of recent letters per process.
+"""
+
+import hashlib
+import re
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+import click
+from flask import current_app, jsonify
+
+from modules.admin import admin_required
+from modules.santa_reply_generator import detect_emotion_from_text, generate_santa_reply
+
+TEXT_FIELDS = ('wish', 'feeling', 'memory')
+IDENTITY_FIELDS = ('name', 'age', 'gender', 'country')
+COLUMNS = ('content_hash', 'duplicate_of', 'similar_to')
+# A letter's reply; duplicates archived by earlier versions share their original's
+RESOLVED_REPLY = ('coalesce(reply, (SELECT original.reply FROM letters AS original '
+                  'WHERE original.id = letters.duplicate_of))')
+
+SHINGLE_WORDS = 3
+NUM_PERM = 32
+BANDS = 8
+ROWS = NUM_PERM // BANDS  # letters ~60% alike share a bucket half the time
+NEAR_THRESHOLD = 0.7
+MAX_CANDIDATES = 5
+
+_HASHES = struct.Struct(f'<{NUM_PERM}I')
+WORD = re.compile(r'\w+')
+
+_default_cache = None
+
+MIGRATION = """
+ALTER TABLE letters ADD COLUMN content_hash BLOB;
+ALTER TABLE letters ADD COLUMN duplicate_of INTEGER;
+ALTER TABLE letters ADD COLUMN similar_to INTEGER;
+CREATE INDEX letters_content_hash ON letters (content_hash);
+CREATE INDEX letters_duplicate_of ON letters (duplicate_of) WHERE duplicate_of IS NOT NULL;
+CREATE TABLE letter_minhash (
+    band INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    letter_id INTEGER NOT NULL,
+    PRIMARY KEY (band, bucket, letter_id)
+) WITHOUT ROWID;
+CREATE INDEX letter_minhash_letter ON letter_minhash (letter_id);
+CREATE TRIGGER letters_dedup_delete BEFORE DELETE ON letters BEGIN
+    -- Duplicates that share this letter's reply get their own copy first
+    UPDATE letters SET reply = old.reply
+    WHERE duplicate_of = old.id AND reply IS NULL AND old.reply IS NOT NULL;
+    DELETE FROM letter_minhash WHERE letter_id = old.id;
+END;
+"""
+
+
+def normalise(text):
+    """Lower-case words only, so spacing, punctuation and case don't matter."""
+    return ' '.join(WORD.findall((text or '').lower()))
+
+
+def _digest(letter, fields):
+    text = '\x1f'.join(normalise(str(letter.get(field) or '')) for field in fields)
+    return hashlib.blake2b(text.encode(), digest_size=16).digest()
+
+
+def content_hash(letter):
+    """16-byte hash of the normalised wish, feeling and memory."""
+    return _digest(letter, TEXT_FIELDS)
+
+
+def letter_key(letter):
+    """Hash of everything a reply depends on: the text and who wrote it."""
+    return _digest(letter, TEXT_FIELDS + IDENTITY_FIELDS)
+
+
+def shingles(letter):
+    """Set of word 3-grams over the wish, feeling and memory."""
+    words = WORD.findall(' '.join(str(letter.get(field) or '') for field in TEXT_FIELDS).lower())
+    if len(words) < SHINGLE_WORDS:
+        return {' '.join(words)} if words else set()
+    return {' '.join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+
+
+def minhash(shingle_set):
+    """
+    NUM_PERM minimum hashes of the shingles.
+
+    The NUM_PERM hash functions are the 32-bit words of one SHAKE-128
+    digest per shingle, which costs about a third of computing
+    a * x + b mod p per function in Python.
+    """
+    rows = [_HASHES.unpack(hashlib.shake_128(shingle.encode()).digest(_HASHES.size))
+            for shingle in shingle_set]
+    return list(map(min, zip(*rows)))
+
+
+def bands(signature):
+    """(band, bucket) pairs; letters sharing any pair are LSH candidates."""
+    return [(band, zlib.crc32(struct.pack(f'<{ROWS}I', *signature[band * ROWS:(band + 1) * ROWS])))
+            for band in range(BANDS)]
+
+
+def jaccard(first, second):
+    if not first or not second:
+        return 0.0
+    return len(first & second) / len(first | second)
+
+
+def classify(connection, letter, before_id=None):
+    """
+    Find the letter an incoming (or, with before_id, existing) letter duplicates.
+
+    Args:
+        connection: Connection to the archive
+        letter: Letter fields
+        before_id: Only compare with letters older than this id (backfill)
+
+    Returns:
+        dict: content_hash, duplicate_of, similar_to and bands (to index
+              once the letter has an id, or None)
+    """
+    digest = content_hash(letter)
+    older = ' AND id < ?' if before_id else ''
+    params = (digest, before_id) if before_id else (digest,)
+    row = connection.execute(
+        f'SELECT id FROM letters WHERE content_hash = ?{older} ORDER BY id LIMIT 1',
+        params).fetchone()
+    if row is not None:
+        return {'content_hash': digest, 'duplicate_of': row[0], 'similar_to': None, 'bands': None}
+
+    shingle_set = shingles(letter)
+    if not shingle_set:
+        return {'content_hash': digest, 'duplicate_of': None, 'similar_to': None, 'bands': None}
+    letter_bands = bands(minhash(shingle_set))
+    matches = ' OR '.join('(band = ? AND bucket = ?)' for _ in letter_bands)
+    params = [value for pair in letter_bands for value in pair]
+    if before_id:
+        params.append(before_id)
+    candidates = connection.execute(
+        f'SELECT letter_id FROM letter_minhash WHERE ({matches})'
+        f'{" AND letter_id < ?" if before_id else ""} '
+        f'GROUP BY letter_id ORDER BY count(*) DESC, letter_id LIMIT {MAX_CANDIDATES}',
+        params).fetchall()
+
+    similar_to, best = None, NEAR_THRESHOLD
+    if candidates:
+        placeholders = ', '.join('?' for _ in candidates)
+        for candidate_id, *text in connection.execute(
+                f'SELECT id, {", ".join(TEXT_FIELDS)} FROM letters WHERE id IN ({placeholders})',
+                [candidate_id for candidate_id, in candidates]):
+            similarity = jaccard(shingle_set, shingles(dict(zip(TEXT_FIELDS, text))))
+            if similarity >= best:
+                similar_to, best = candidate_id, similarity
+    return {'content_hash': digest, 'duplicate_of': None, 'similar_to': similar_to,
+            'bands': None if similar_to else letter_bands}
+
+
+def index(connection, letter_id, letter_bands):
+    """Add a distinct letter to the LSH buckets."""
+    connection.executemany(
+        'INSERT OR IGNORE INTO letter_minhash (band, bucket, letter_id) VALUES (?, ?, ?)',
+        [(band, bucket, letter_id) for band, bucket in letter_bands])
+
+
+def backfill(connection, batch_size=1000, echo=None):
+    """
+    Classify archived letters that predate dedup, oldest first.
+
+    Returns:
+        int: Letters classified
+    """
+    done = 0
+    while True:
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            rows = connection.execute(
+                f'SELECT id, {", ".join(TEXT_FIELDS)} FROM letters '
+                f'WHERE content_hash IS NULL ORDER BY id LIMIT ?', (batch_size,)).fetchall()
+            for letter_id, *text in rows:
+                result = classify(connection, dict(zip(TEXT_FIELDS, text)), before_id=letter_id)
+                connection.execute(
+                    'UPDATE letters SET content_hash = ?, duplicate_of = ?, similar_to = ? '
+                    'WHERE id = ?',
+                    (result['content_hash'], result['duplicate_of'], result['similar_to'],
+                     letter_id))
+                if result['bands']:
+                    index(connection, letter_id, result['bands'])
+        done += len(rows)
+        if echo and rows:
+            echo(done)
+        if len(rows) < batch_size:
+            return done
+
+
+def duplicate_stats(connection):
+    """Counts of exact and near duplicates, and reply text older duplicates share with their original."""
+    total, exact, near, shared = connection.execute(
+        'SELECT count(*), count(duplicate_of), count(similar_to), '
+        'sum(duplicate_of IS NOT NULL AND reply IS NULL) FROM letters').fetchone()
+    saved = connection.execute(
+        'SELECT coalesce(sum(length(c.reply)), 0) FROM letters d JOIN letters c '
+        'ON c.id = d.duplicate_of WHERE d.reply IS NULL').fetchone()[0]
+    largest = connection.execute(
+        'SELECT duplicate_of, count(*) + 1 FROM letters WHERE duplicate_of IS NOT NULL '
+        'GROUP BY duplicate_of ORDER BY count(*) DESC LIMIT 10').fetchall()
+    return {
+        'letters': total,
+        'exact_duplicates': exact,
+        'near_duplicates': near,
+        'shared_replies': shared or 0,
+        'reply_bytes_saved': saved,
+        'unclassified': connection.execute(
+            'SELECT count(*) FROM letters WHERE content_hash IS NULL').fetchone()[0],
+        'largest_groups': [{'letter_id': letter_id, 'copies': copies}
+                           for letter_id, copies in largest],
+    }
+
+
+class ReplyCache:
+    """Bounded LRU of (emotion, reply) by letter_key."""
+
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+def cached_reply(letter):
+    """(emotion, reply) written earlier for the same letter, or None."""
+    if _default_cache is None:
+        return None
+    return _default_cache.get(letter_key(letter))
+
+
+def remember_reply(letter, emotion, reply):
+    if _default_cache is not None:
+        _default_cache.put(letter_key(letter), (emotion, reply))
+
+
+def reply_for(letter):
+    """
+    Detect the emotion of a letter and write Santa's reply, reusing the
+    result for a letter seen recently (e.g. resubmitted after a reset).
+
+    Returns:
+        tuple: (emotion, reply)
+    """
+    cached = cached_reply(letter)
+    if cached is not None:
+        return cached
+    feeling = letter.get('feeling')
+    result = (detect_emotion_from_text(feeling) if feeling else None, generate_santa_reply(letter))
+    remember_reply(letter, *result)
+    return result
+
+
+def init_app(app, cache_size=512):
+    """
+    Enable reply reuse, GET /admin/letters/duplicates and ``flask dedup-letters``.
+
+    Args:
+        app: Flask application
+        cache_size: Recent letters whose replies are kept per process (0: off)
+    """
+    global _default_cache
+    _default_cache = ReplyCache(cache_size) if cache_size > 0 else None
+
+    if 'letter_archive' not in app.extensions:
+        return
+
+    @app.route('/admin/letters/duplicates')
+    @admin_required
+    def letter_duplicates():
+        """How many archived letters are duplicates, and the largest groups."""
+        connection = current_app.extensions['letter_archive'].connect()
+        try:
+            stats = duplicate_stats(connection)
+        finally:
+            connection.close()
+        if _default_cache is not None:
+            stats['reply_cache'] = {'hits': _default_cache.hits, 'misses': _default_cache.misses,
+                                    'size': len(_default_cache._entries)}
+        return jsonify(stats)
+
+    @app.cli.command('dedup-letters')
+    @click.option('--batch-size', default=1000, show_default=True)
+    def dedup_letters(batch_size):
+        """Classify archived letters that were stored before dedup existed."""
+        start = time.perf_counter()
+        connection = current_app.extensions['letter_archive'].connect()
+        try:
+            done = backfill(connection, batch_size,
+                            echo=lambda count: click.echo(f'\r{count} letters', nl=False, err=True))
+        finally:
+            connection.close()
+        click.echo(f'\nClassified {done} letters in {time.perf_counter() - start:.1f}s', err=True)
@@ -0,0 +1,317 @@
+"""
+Letter export module.
+Streams archived letters as NDJSON or CSV, for the admin endpoint and the
+``flask export-letters`` command.
+
+Letters are read in id order, a page at a time. Each page is a fresh
+query that continues after the last id seen (keyset pagination), so the
+export never holds the whole result, or one long read transaction that
+would stop WAL checkpoints, and can resume after an interruption from the
+last id received. The highest id is fixed when the export starts, so
+letters arriving during a long export don't extend it, and a resumed
+export ends in the same place.
+
+Letters compacted into cold segments (modules.letter_segments) hold the
+lowest ids, so an export reads the blocks it needs from the segments
+first and then carries on in the database.
+"""
+
+import csv
+import io
+import itertools
+import json
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+import click
+from flask import Response, current_app, jsonify, request, stream_with_context
+
+from modules import letter_segments
+from modules.admin import admin_required
+from modules.letter_archive import COLUMNS
+from modules.letter_dedup import RESOLVED_REPLY
+
+FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+EXPORT_COLUMNS = ('id',) + COLUMNS + ('duplicate_of', 'similar_to')
+# Duplicates with the same reply as their original don't store it again
+SELECT_EXPRESSIONS = {'reply': RESOLVED_REPLY}
+PAGE_SIZE = 1000
+CHUNK_SIZE = 64 * 1024
+
+
+def parse_time(value, end_of_day=False):
+    """
+    Parse a date filter: Unix seconds, an ISO date or an ISO date and time.
+    Times without a zone are taken as UTC.
+
+    Args:
+        value: Text to parse, or None
+        end_of_day: For a bare date, return the start of the next day, so
+                    an `until` date includes the whole day
+
+    Returns:
+        float: Unix timestamp, or None if value is empty
+
+    Raises:
+        ValueError: If the value is not a date, time or number
+    """
+    if value is None or value == '':
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f'cannot read {value!r} as a date or time') from None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    if end_of_day and len(value) == 10:
+        parsed += timedelta(days=1)
+    return parsed.timestamp()
+
+
+def export_range(connection, since=None, until=None, after_id=None, until_id=None):
+    """
+    Narrow the id range to export using the created_at index.
+
+    Returns:
+        tuple: (after_id, until_id); ids in after_id < id <= until_id
+    """
+    if until_id is None:
+        until_id = (connection.execute('SELECT max(id) FROM letters').fetchone()[0]
+                    or letter_segments.cold_through(connection))
+    after_id = after_id or 0
+    if since is not None:
+        first = connection.execute('SELECT min(id) FROM letters WHERE created_at >= ?',
+                                   (since,)).fetchone()[0]
+        after_id = max(after_id, (first or until_id + 1) - 1)
+    if until is not None:
+        last = connection.execute('SELECT max(id) FROM letters WHERE created_at < ?',
+                                  (until,)).fetchone()[0]
+        until_id = min(until_id, last or 0)
+    return after_id, until_id
+
+
+def iter_letters(connection, since=None, until=None, emotions=(), countries=(), flagged=False,
+                 after_id=None, until_id=None, limit=None, page_size=PAGE_SIZE):
+    """
+    Yield archived letters matching the filters in id order.
+
+    Args:
+        connection: Connection to the archive
+        since: Unix timestamp; letters created at or after it
+        until: Unix timestamp; letters created before it
+        emotions: Detected emotions to include (default: all)
+        countries: Countries to include, ignoring case and spacing (default: all)
+        flagged: Only letters the content scanner flagged
+        after_id: Resume after this id
+        until_id: Stop at this id (default: the highest id right now)
+        limit: Most letters to yield
+        page_size: Letters fetched per query
+
+    Yields:
+        tuple: Values in EXPORT_COLUMNS order
+    """
+    remaining = limit
+    cold_through = letter_segments.cold_through(connection)
+    if (after_id or 0) < cold_through and remaining != 0:
+        if until_id is None:
+            until_id = export_range(connection)[1]
+        countries_wanted = {' '.join(country.split()).lower() for country in countries}
+        for letter in letter_segments.iter_rows(connection, after_id, min(until_id, cold_through),
+                                                since, until):
+            if ((not emotions or letter['emotion'] in emotions)
+                    and (not countries or (letter['country'] or '').strip().lower()
+                         in countries_wanted)
+                    and (not flagged or letter['flags'] is not None)):
+                yield tuple(letter.get(column) for column in EXPORT_COLUMNS)
+                if remaining is not None:
+                    remaining -= 1
+                    if remaining == 0:
+                        return
+        after_id = cold_through
+
+    after_id, until_id = export_range(connection, since, until, after_id, until_id)
+    where = ['id > ?', 'id <= ?']
+    params = []
+    if since is not None:
+        where.append('created_at >= ?')
+        params.append(since)
+    if until is not None:
+        where.append('created_at < ?')
+        params.append(until)
+    if emotions:
+        where.append(f'emotion IN ({", ".join("?" for _ in emotions)})')
+        params += emotions
+    if countries:
+        where.append(f'lower(trim(country)) IN ({", ".join("?" for _ in countries)})')
+        params += [' '.join(country.split()).lower() for country in countries]
+    if flagged:
+        where.append('flags IS NOT NULL')
+    columns = ', '.join(SELECT_EXPRESSIONS.get(column, column) for column in EXPORT_COLUMNS)
+    sql = (f'SELECT {columns} FROM letters WHERE {" AND ".join(where)} '
+           f'ORDER BY id LIMIT ?')
+
+    while after_id < until_id and remaining != 0:
+        count = page_size if remaining is None else min(page_size, remaining)
+        rows = connection.execute(sql, [after_id, until_id] + params + [count]).fetchall()
+        if not rows:
+            break
+        yield from rows
+        after_id = rows[-1][0]
+        if remaining is not None:
+            remaining -= len(rows)
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps(dict(zip(EXPORT_COLUMNS, row)), ensure_ascii=False,
+                         separators=(',', ':')) + '\n'
+
+
+def csv_lines(rows):
+    # One small buffer reused for every row, as csv.writer needs a file
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in itertools.chain([EXPORT_COLUMNS], rows):
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def chunked(lines, size=CHUNK_SIZE):
+    """Join lines into chunks of about `size` characters for fewer, larger writes."""
+    buffer = []
+    buffered = 0
+    for line in lines:
+        buffer.append(line)
+        buffered += len(line)
+        if buffered >= size:
+            yield ''.join(buffer)
+            buffer = []
+            buffered = 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+def export(connection, output_format='ndjson', **filters):
+    """
+    Stream matching letters in the given format.
+
+    Args:
+        connection: Connection to the archive
+        output_format: 'ndjson' or 'csv'
+        **filters: See iter_letters
+
+    Yields:
+        str: Chunks of the export
+    """
+    lines = ndjson_lines if output_format == 'ndjson' else csv_lines
+    return chunked(lines(iter_letters(connection, **filters)))
+
+
+def _split(values):
+    """Filters given as repeated and/or comma separated values."""
+    return [value.strip() for item in values for value in item.split(',') if value.strip()]
+
+
+def init_app(app):
+    """
+    Add GET /admin/letters/export and the ``flask export-letters`` command.
+    Requires modules.letter_archive.
+
+    Query parameters: format (ndjson or csv), since, until, emotion and
+    country (repeated or comma separated), flagged=1, after_id, until_id
+    and limit.
+
+    Args:
+        app: Flask application
+    """
+    @app.route('/admin/letters/export')
+    @admin_required
+    def export_letters():
+        """Stream archived letters as NDJSON or CSV."""
+        archive = current_app.extensions['letter_archive']
+        output_format = request.args.get('format', 'ndjson')
+        if output_format not in FORMATS:
+            return jsonify(error=f'format must be one of {", ".join(FORMATS)}'), 400
+        try:
+            filters = {
+                'since': parse_time(request.args.get('since')),
+                'until': parse_time(request.args.get('until'), end_of_day=True),
+                'emotions': _split(request.args.getlist('emotion')),
+                'countries': _split(request.args.getlist('country')),
+                'flagged': request.args.get('flagged', '0') != '0',
+                'after_id': request.args.get('after_id', type=int),
+                'until_id': request.args.get('until_id', type=int),
+                'limit': request.args.get('limit', type=int),
+            }
+        except ValueError as error:
+            return jsonify(error=str(error)), 400
+
+        connection = archive.connect()
+        if filters['until_id'] is None:
+            # Fixed now and returned, so a resumed download ends in the same place
+            filters['until_id'] = export_range(connection)[1]
+
+        def generate():
+            try:
+                yield from export(connection, output_format, **filters)
+            finally:
+                connection.close()
+
+        filename = f"letters-{time.strftime('%Y%m%d-%H%M%S')}.{output_format}"
+        return Response(stream_with_context(generate()), mimetype=FORMATS[output_format],
+                        headers={'Content-Disposition': f'attachment; filename={filename}',
+                                 'X-Export-Until-Id': str(filters['until_id'])})
+
+    @app.cli.command('export-letters')
+    @click.option('--format', 'output_format', type=click.Choice(list(FORMATS)), default='ndjson')
+    @click.option('--since', help='Unix time, ISO date or ISO date and time (UTC)')
+    @click.option('--until', help='Exclusive; a bare date includes that whole day')
+    @click.option('--emotion', multiple=True, help='Repeat or separate with commas')
+    @click.option('--country', multiple=True, help='Repeat or separate with commas')
+    @click.option('--flagged', is_flag=True, help='Only letters the content scanner flagged')
+    @click.option('--after-id', type=int, help='Resume after this letter id')
+    @click.option('--until-id', type=int, help='Stop at this letter id')
+    @click.option('--limit', type=int)
+    @click.option('--output', type=click.Path(dir_okay=False), help='File (default: stdout)')
+    def export_letters_command(output_format, since, until, emotion, country, flagged, after_id,
+                               until_id, limit, output):
+        """Export archived letters as NDJSON or CSV."""
+        try:
+            since, until = parse_time(since), parse_time(until, end_of_day=True)
+        except ValueError as error:
+            raise click.BadParameter(str(error))
+        connection = current_app.extensions['letter_archive'].connect()
+        try:
+            _, until_id = export_range(connection, until_id=until_id)
+            rows = iter_letters(connection, since=since, until=until, emotions=_split(emotion),
+                                countries=_split(country), flagged=flagged, after_id=after_id,
+                                until_id=until_id, limit=limit)
+            exported = {'letters': 0, 'last_id': after_id}
+
+            def counted(rows):
+                for row in rows:
+                    exported['letters'] += 1
+                    exported['last_id'] = row[0]
+                    yield row
+
+            lines = ndjson_lines if output_format == 'ndjson' else csv_lines
+            target = (open(output, 'w', encoding='utf-8', newline='') if output
+                      else sys.stdout)
+            try:
+                for chunk in chunked(lines(counted(rows))):
+                    target.write(chunk)
+            finally:
+                if output:
+                    target.close()
+        finally:
+            connection.close()
+        click.echo(f"Exported {exported['letters']} letters; last id {exported['last_id']}, "
+                   f"until id {until_id} (resume with --after-id {exported['last_id']} "
+                   f"--until-id {until_id})", err=True)
@@ -3,6 +3,8 @@ Letter to Santa logic module.
 Handles storing and retrieving user letter responses in session.
 """
 
+from modules.timing import timed
+
 def initialize_letter_session(session):
     """Initialize letter data in session if not exists."""
     if 'letter_data' not in session:
@@ -14,6 +16,7 @@ def initialize_letter_session(session):
             'feeling': None,
             'wish': None,
             'memory': None,
+            'flags': None,
             'submitted': False
         }
         session.modified = True
@@ -35,11 +38,13 @@ def save_letter_data(session, form_data):
     session['letter_data']['feeling'] = form_data.get('feeling', '').strip()
     session['letter_data']['wish'] = form_data.get('wish', '').strip()
     session['letter_data']['memory'] = form_data.get('memory', '').strip()
+    session['letter_data']['flags'] = form_data.get('flags') or None
     session['letter_data']['submitted'] = True
     session.modified = True
     
     return True
 
+@timed('letter')
 def get_letter_data(session):
     """
     Get letter data from session.
@@ -0,0 +1,309 @@
+"""
+Letter maintenance module.
+Keeps the letter archive from growing without bound over a season:
+
+- Retention: after LETTER_TEXT_DAYS, a letter's raw text (name, feeling,
+  wish, memory, reply) is removed. Its time, country, age, emotion and
+  flags stay, and the dashboard counters are untouched.
+- Compaction: letters older than LETTER_HOT_DAYS move out of SQLite into
+  compressed monthly segments (modules.letter_segments), which export and
+  search still read.
+- Housekeeping: FTS5 'optimize' merges the search index, then VACUUM
+  returns the freed pages to the filesystem and the WAL is truncated.
+
+All of it runs from ``flask maintain-archive`` (e.g. a nightly cron job)
+or, with LETTER_MAINTENANCE_HOURS, a background thread in each worker.
+Either way, a lock file lets only one process maintain the archive at a
+time, and no request waits for it. While VACUUM holds the database, the
+archive writer's inserts time out and its letters go to the spill files
+it already loads once the database is free.
+"""
+
+import contextlib
+import os
+import threading
+import time
+
+import click
+from flask import current_app, jsonify
+
+from modules import letter_segments
+from modules.admin import admin_required
+from modules.event_log import log_event
+from modules.letter_archive import connect
+from modules.letter_dedup import RESOLVED_REPLY
+
+try:
+    import fcntl
+except ImportError:  # Windows: no lock, so no scheduled runs
+    fcntl = None
+
+BATCH_LETTERS = 1000
+TEXT_PRESENT = ' OR '.join(f'{column} IS NOT NULL' for column in letter_segments.TEXT_COLUMNS)
+
+
+def day_cutoff(days, now=None):
+    """Midnight UTC `days` days before now, as a Unix timestamp."""
+    now = time.time() if now is None else now
+    return (int(now - days * 86400) // 86400) * 86400
+
+
+def strip_text(connection, cutoff, batch_size=BATCH_LETTERS):
+    """
+    Remove the raw text of letters created before `cutoff`, a batch of ids
+    per write transaction. Duplicates created later that share one of
+    these letters' replies get their own copy first.
+
+    Returns:
+        int: Letters whose text was removed
+    """
+    last = connection.execute('SELECT max(id) FROM letters WHERE created_at < ?',
+                              (cutoff,)).fetchone()[0]
+    stripped = 0
+    after = 0
+    while last is not None:
+        # Skip past letters already stripped by earlier runs
+        row = connection.execute(f'SELECT id FROM letters WHERE id > ? AND ({TEXT_PRESENT}) '
+                                 f'ORDER BY id LIMIT 1', (after,)).fetchone()
+        if row is None or row[0] > last:
+            break
+        after, upto = row[0] - 1, min(row[0] - 1 + batch_size, last)
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.execute(
+                f'UPDATE letters SET reply = {RESOLVED_REPLY} WHERE duplicate_of > ? '
+                f'AND duplicate_of <= ? AND reply IS NULL AND created_at >= ?',
+                (after, upto, cutoff))
+            connection.execute(
+                'DELETE FROM letter_minhash WHERE letter_id IN '
+                '(SELECT id FROM letters WHERE id > ? AND id <= ? AND created_at < ?)',
+                (after, upto, cutoff))
+            stripped += connection.execute(
+                f'UPDATE letters SET {", ".join(f"{column} = NULL" for column in letter_segments.TEXT_COLUMNS)} '
+                f'WHERE id > ? AND id <= ? AND created_at < ? AND ({TEXT_PRESENT})',
+                (after, upto, cutoff)).rowcount
+        after = upto
+    return stripped
+
+
+def optimise(connection, vacuum=True):
+    """
+    Merge the search index, refresh planner statistics, VACUUM and
+    truncate the WAL.
+
+    Returns:
+        dict: Seconds taken by each step
+    """
+    timings = {}
+    start = time.perf_counter()
+    with connection:
+        connection.execute("INSERT INTO letters_fts (letters_fts) VALUES ('optimize')")
+    timings['fts_optimize_s'] = round(time.perf_counter() - start, 3)
+    connection.execute('PRAGMA optimize')
+    if vacuum:
+        start = time.perf_counter()
+        connection.execute('VACUUM')
+        timings['vacuum_s'] = round(time.perf_counter() - start, 3)
+    connection.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    return timings
+
+
+def storage(connection):
+    """Sizes of the database, its WAL and the cold segments, and letters per tier."""
+    page_size = connection.execute('PRAGMA page_size').fetchone()[0]
+    pages = connection.execute('PRAGMA page_count').fetchone()[0]
+    free = connection.execute('PRAGMA freelist_count').fetchone()[0]
+    path = connection.execute('PRAGMA database_list').fetchone()[2]
+    wal = path + '-wal'
+    hot, oldest, stripped = connection.execute(
+        f'SELECT count(*), min(created_at), count(*) - count(CASE WHEN {TEXT_PRESENT} THEN 1 END) '
+        f'FROM letters').fetchone()
+    cold = letter_segments.tier_stats(connection)
+    return {
+        'database_bytes': page_size * pages,
+        'free_bytes': page_size * free,
+        'wal_bytes': os.path.getsize(wal) if path and os.path.exists(wal) else 0,
+        'segment_bytes': cold['bytes'],
+        'hot': {'letters': hot, 'oldest': oldest, 'text_removed': stripped},
+        'cold': cold,
+    }
+
+
+def maintain(connection, text_days=0, hot_days=0, vacuum=True, echo=None):
+    """
+    Apply the retention and compaction policies, then tidy the database.
+
+    Args:
+        connection: Connection to the archive
+        text_days: Remove letters' raw text after this many days (0: keep)
+        hot_days: Move letters older than this many days to segments (0: never)
+        vacuum: Run VACUUM at the end
+        echo: Called with progress messages
+
+    Returns:
+        dict: What was done, and storage before and after
+    """
+    echo = echo or (lambda message: None)
+    now = time.time()
+    start = time.perf_counter()
+    result = {'before': storage(connection)}
+    if text_days:
+        cutoff = day_cutoff(text_days, now)
+        result['text_cutoff'] = cutoff
+        result['text_removed'] = strip_text(connection, cutoff)
+        echo(f"removed the text of {result['text_removed']} letters")
+    if hot_days:
+        cutoff = day_cutoff(hot_days, now)
+        result['hot_cutoff'] = cutoff
+        result['compacted'] = letter_segments.compact(connection, cutoff)
+        echo(f"moved {result['compacted']} letters to segments")
+    if text_days:
+        result['cold_text_removed'] = letter_segments.strip_text(connection, result['text_cutoff'])
+        echo(f"removed the text of {result['cold_text_removed']} letters in segments")
+    letter_segments.remove_unused(connection)
+    result.update(optimise(connection, vacuum))
+    result['after'] = storage(connection)
+    result['seconds'] = round(time.perf_counter() - start, 3)
+    log_event('archive.maintained', **{key: value for key, value in result.items()
+                                       if key not in ('before', 'after')},
+              database_bytes=result['after']['database_bytes'],
+              segment_bytes=result['after']['segment_bytes'])
+    return result
+
+
+def lock_path(archive_path):
+    return os.path.splitext(archive_path)[0] + '-maintenance.lock'
+
+
+@contextlib.contextmanager
+def maintenance_lock(archive_path):
+    """
+    Hold the archive's maintenance lock if it is free.
+
+    Yields:
+        bool: True if this process holds the lock (always, without fcntl)
+    """
+    with open(lock_path(archive_path), 'a') as lock_file:
+        if fcntl is None:
+            yield True
+            return
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class MaintenanceScheduler:
+    """Background thread that runs maintain() every `interval` seconds across all workers."""
+
+    def __init__(self, archive_path, interval, **policy):
+        self.archive_path = archive_path
+        self.interval = interval
+        self.policy = policy
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def ensure_started(self):
+        if self._pid != os.getpid():
+            self._start()
+
+    def _start(self):
+        # Started lazily, and again after a fork, since threads don't survive fork
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._thread = threading.Thread(target=self._run, name='letter-maintenance',
+                                            daemon=True)
+            self._pid = os.getpid()
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            # Check often enough that a worker restart doesn't delay a due run much
+            time.sleep(min(self.interval, 600))
+            try:
+                self.run_if_due()
+            except Exception as error:  # keep the thread alive for the next run
+                log_event('archive.maintenance_failed', error=repr(error))
+
+    def run_if_due(self):
+        """Run maintenance if no process has in the last interval; returns the result or None."""
+        with maintenance_lock(self.archive_path) as held:
+            path = lock_path(self.archive_path)
+            if not held or time.time() - os.path.getmtime(path) < self.interval:
+                return None
+            connection = connect(self.archive_path)
+            try:
+                result = maintain(connection, **self.policy)
+            finally:
+                connection.close()
+            os.utime(path)
+            return result
+
+
+def init_app(app, text_days=0, hot_days=0, interval_hours=0):
+    """
+    Add the ``flask maintain-archive`` command and GET /admin/letters/storage,
+    and optionally run maintenance in the background.
+    Requires modules.letter_archive.
+
+    Args:
+        app: Flask application
+        text_days: Remove letters' raw text after this many days (0: keep)
+        hot_days: Move letters older than this many days to segments (0: never)
+        interval_hours: Run maintenance this often in-process (0: only the command)
+    """
+    policy = {'text_days': text_days, 'hot_days': hot_days}
+    archive = app.extensions['letter_archive']
+
+    if interval_hours > 0 and fcntl is not None:
+        scheduler = MaintenanceScheduler(archive.path, interval_hours * 3600, **policy)
+        # A new lock file counts as a run just now rather than one long overdue
+        with open(lock_path(archive.path), 'a'):
+            pass
+
+        @app.before_request
+        def start_maintenance():
+            scheduler.ensure_started()
+
+    @app.route('/admin/letters/storage')
+    @admin_required
+    def letter_storage():
+        """Archive size per tier and the retention policy."""
+        connection = current_app.extensions['letter_archive'].connect()
+        try:
+            return jsonify(dict(storage(connection), policy=dict(policy,
+                                                                 interval_hours=interval_hours)))
+        finally:
+            connection.close()
+
+    @app.cli.command('maintain-archive')
+    @click.option('--text-days', type=int, default=text_days, show_default=True,
+                  help='Remove raw text after this many days (0: keep; default LETTER_TEXT_DAYS)')
+    @click.option('--hot-days', type=int, default=hot_days, show_default=True,
+                  help='Move letters older than this to segments (0: never; default LETTER_HOT_DAYS)')
+    @click.option('--no-vacuum', is_flag=True, help='Skip VACUUM')
+    def maintain_archive(text_days, hot_days, no_vacuum):
+        """Apply retention, compact old letters into segments, optimise and VACUUM."""
+        path = current_app.extensions['letter_archive'].path
+        with maintenance_lock(path) as held:
+            if not held:
+                raise click.ClickException('another process is maintaining the archive')
+            connection = current_app.extensions['letter_archive'].connect()
+            try:
+                result = maintain(connection, text_days, hot_days, vacuum=not no_vacuum,
+                                  echo=lambda message: click.echo(message, err=True))
+            finally:
+                connection.close()
+            os.utime(lock_path(path))
+        for label, key in (('database', 'database_bytes'), ('segments', 'segment_bytes'),
+                           ('WAL', 'wal_bytes')):
+            click.echo(f"{label:>9}: {result['before'][key] / 2 ** 20:9.1f} MiB -> "
+                       f"{result['after'][key] / 2 ** 20:9.1f} MiB", err=True)
+        click.echo(f"Done in {result['seconds']:.1f}s", err=True)
@@ -0,0 +1,285 @@
+"""
+Letter rollups module.
+Counts archived letters per hour, country, age band and detected emotion
+in the letter_rollups table, so the Santa dashboard reads counters,
+whose number depends on the hours shown rather than the letters received,
+instead of scanning the archive.
+
+The archive writer adds each batch's counts in the same transaction that
+inserts the letters, so the counters always match the archive, including
+letters loaded from spill files. ``flask rebuild-rollups`` recounts
+everything from the raw letters.
+
+Countries are counted under a case-insensitive key ("UK", "uk" and " Uk "
+are one country), and the dashboard shows each key as it was first
+spelled, kept in letter_countries, or from COUNTRY_NAMES for acronyms.
+"""
+
+import time
+from collections import Counter
+
+import click
+from flask import current_app, jsonify, request
+
+from modules import letter_segments
+from modules.admin import admin_required
+
+# (lowest age, highest age or None, label)
+AGE_BANDS = (
+    (0, 5, '0-5'),
+    (6, 8, '6-8'),
+    (9, 12, '9-12'),
+    (13, 17, '13-17'),
+    (18, None, '18+'),
+)
+UNKNOWN = 'unknown'
+MAX_COUNTRY_LENGTH = 56
+# Shown instead of the first spelling seen, which is often lower case
+COUNTRY_NAMES = {'uk': 'UK', 'us': 'US', 'usa': 'USA', 'uae': 'UAE', 'drc': 'DRC'}
+DEFAULT_HOURS = 7 * 24
+
+SCHEMA = """
+CREATE TABLE letter_rollups (
+    hour INTEGER NOT NULL,
+    country TEXT NOT NULL,
+    age_band TEXT NOT NULL,
+    emotion TEXT NOT NULL,
+    letters INTEGER NOT NULL,
+    PRIMARY KEY (hour, country, age_band, emotion)
+) WITHOUT ROWID
+"""
+COUNTRY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS letter_countries (
+    country TEXT PRIMARY KEY,
+    name TEXT NOT NULL
+) WITHOUT ROWID
+"""
+
+
+def age_band(age):
+    """Label of the AGE_BANDS entry an age falls in, or UNKNOWN."""
+    if age is None or age < 0:
+        return UNKNOWN
+    for low, high, label in AGE_BANDS:
+        if age >= low and (high is None or age <= high):
+            return label
+    return UNKNOWN
+
+
+def country_name(country):
+    """Country as typed in the form, with runs of whitespace collapsed (None if blank)."""
+    return ' '.join((country or '').split())[:MAX_COUNTRY_LENGTH] or None
+
+
+def normalise_country(country):
+    """Key a country is counted under: its name casefolded, or UNKNOWN."""
+    name = country_name(country)
+    return name.casefold() if name else UNKNOWN
+
+
+def country_names(countries):
+    """
+    Display name of each country key: COUNTRY_NAMES, else the first spelling.
+
+    Returns:
+        dict: key -> name
+    """
+    names = {}
+    for country in countries:
+        name = country_name(country)
+        if name:
+            key = name.casefold()
+            if key not in names:
+                names[key] = COUNTRY_NAMES.get(key, name)
+    return names
+
+
+def rollup_key(created_at, country, age, emotion):
+    """
+    Bucket of one letter.
+
+    Returns:
+        tuple: (hour as a Unix timestamp, country, age band, emotion)
+    """
+    return (int(created_at // 3600) * 3600, normalise_country(country), age_band(age),
+            emotion or UNKNOWN)
+
+
+def count_records(records):
+    """Rollup deltas for a batch of archive records (letter_archive.letter_row)."""
+    return Counter(rollup_key(record['created_at'], record.get('country'), record.get('age'),
+                              record.get('emotion'))
+                   for record in records)
+
+
+def apply_deltas(connection, deltas, names=None):
+    """
+    Add counts to letter_rollups, and country names not seen before to
+    letter_countries; runs inside the caller's transaction.
+    """
+    connection.executemany(
+        'INSERT INTO letter_rollups (hour, country, age_band, emotion, letters) '
+        'VALUES (?, ?, ?, ?, ?) '
+        'ON CONFLICT (hour, country, age_band, emotion) DO UPDATE '
+        'SET letters = letters + excluded.letters',
+        [key + (count,) for key, count in deltas.items()])
+    if names:
+        connection.executemany('INSERT OR IGNORE INTO letter_countries (country, name) VALUES (?, ?)',
+                               names.items())
+
+
+def add_records(connection, records):
+    """Count a batch of archive records; runs inside the caller's transaction."""
+    apply_deltas(connection, count_records(records),
+                 country_names(record.get('country') for record in records))
+
+
+def recount(connection, since=None):
+    """
+    Replace letter_rollups with counts from the letters table.
+    Runs inside the caller's transaction.
+
+    Args:
+        connection: Connection to the archive
+        since: Only replace hours from this time on (an hour boundary);
+               earlier counters are kept
+
+    Returns:
+        int: Letters counted
+    """
+    # Deleting first takes the write lock, so no batch can commit between
+    # the count and the replace
+    where, params = ('WHERE created_at >= ?', (since,)) if since is not None else ('', ())
+    connection.execute(f'DELETE FROM letter_rollups {"WHERE hour >= ?" if where else ""}', params)
+    counts = Counter()
+    countries = []
+    total = 0
+    for created_at, country, age, emotion in connection.execute(
+            f'SELECT created_at, country, age, emotion FROM letters {where} ORDER BY id', params):
+        counts[rollup_key(created_at, country, age, emotion)] += 1
+        countries.append(country)
+        total += 1
+    # Names are kept: hours before `since` still refer to them
+    apply_deltas(connection, counts, country_names(countries))
+    return total
+
+
+def create(connection):
+    """Archive migration: create letter_rollups and count the letters already archived."""
+    connection.execute(SCHEMA)
+    connection.execute(COUNTRY_SCHEMA)
+    recount(connection)
+
+
+def key_countries(connection):
+    """
+    Archive migration: merge counters of countries that differ only in
+    case, which were stored title-cased ("Uk"), and record their names.
+    """
+    connection.execute(COUNTRY_SCHEMA)
+    names = country_names(country for country, in connection.execute(
+        'SELECT country FROM letters ORDER BY id'))
+    counts = Counter()
+    for hour, country, band, emotion, letters in connection.execute(
+            'SELECT hour, country, age_band, emotion, letters FROM letter_rollups').fetchall():
+        key = country.casefold()
+        counts[hour, key, band, emotion] += letters
+        # Letters already moved to segments leave only the stored spelling
+        if key != UNKNOWN and key not in names:
+            names[key] = COUNTRY_NAMES.get(key, country)
+    connection.execute('DELETE FROM letter_rollups')
+    apply_deltas(connection, counts, names)
+
+
+def rebuild(connection):
+    """
+    Recount letter_rollups from the raw archive in one write transaction.
+    Hours before the cold tier's cutoff keep their counters, since their
+    letters may have moved to segments.
+
+    Returns:
+        int: Letters counted
+    """
+    with connection:
+        connection.execute('BEGIN IMMEDIATE')
+        return recount(connection, since=letter_segments.cold_cutoff(connection))
+
+
+def dashboard(connection, since=None):
+    """
+    Emotion distribution overall, by country and by age band, and letters per hour.
+
+    Reads only letter_rollups, so the cost grows with the number of buckets
+    in the window rather than with the number of letters.
+
+    Args:
+        connection: Connection to the archive
+        since: Unix timestamp of the first hour to include (default: all)
+
+    Returns:
+        dict: 'letters', 'emotions', 'by_country', 'by_age_band' and 'hourly'
+    """
+    where, params = ('WHERE hour >= ?', (int(since // 3600) * 3600,)) if since else ('', ())
+    names = dict(connection.execute('SELECT country, name FROM letter_countries'))
+    emotions = Counter()
+    by_country = {}
+    by_age_band = {}
+    # Grouping in SQL keeps Python's work to the few hundred combinations
+    for country, band, emotion, letters in connection.execute(
+            f'SELECT country, age_band, emotion, sum(letters) FROM letter_rollups {where} '
+            f'GROUP BY country, age_band, emotion', params):
+        emotions[emotion] += letters
+        by_country.setdefault(names.get(country, country), Counter())[emotion] += letters
+        by_age_band.setdefault(band, Counter())[emotion] += letters
+    hourly = {}
+    for hour, emotion, letters in connection.execute(
+            f'SELECT hour, emotion, sum(letters) FROM letter_rollups {where} '
+            f'GROUP BY hour, emotion', params):
+        hourly.setdefault(hour, Counter())[emotion] = letters
+
+    band_order = {label: index for index, (_, _, label) in enumerate(AGE_BANDS)}
+    return {
+        'letters': sum(emotions.values()),
+        'emotions': dict(emotions.most_common()),
+        'by_country': {country: dict(counts.most_common()) for country, counts in
+                       sorted(by_country.items(), key=lambda item: -sum(item[1].values()))},
+        'by_age_band': {band: dict(by_age_band[band].most_common()) for band in
+                        sorted(by_age_band, key=lambda band: band_order.get(band, len(band_order)))},
+        'hourly': [{'hour': time.strftime('%Y-%m-%dT%H:00:00Z', time.gmtime(hour)),
+                    'letters': sum(counts.values()), 'emotions': dict(counts.most_common())}
+                   for hour, counts in sorted(hourly.items())],
+    }
+
+
+def init_app(app):
+    """
+    Add GET /admin/letters/dashboard and the ``flask rebuild-rollups``
+    command. Requires modules.letter_archive.
+
+    Args:
+        app: Flask application
+    """
+    @app.route('/admin/letters/dashboard')
+    @admin_required
+    def letters_dashboard():
+        """Letter counts for the last `hours` hours (default a week, 0 for all)."""
+        hours = max(request.args.get('hours', DEFAULT_HOURS, type=float), 0)
+        connection = current_app.extensions['letter_archive'].connect()
+        try:
+            result = dashboard(connection, since=time.time() - hours * 3600 if hours else None)
+        finally:
+            connection.close()
+        return jsonify(dict(result, hours=hours))
+
+    @app.cli.command('rebuild-rollups')
+    def rebuild_rollups():
+        """Recount the dashboard rollups from the letter archive."""
+        start = time.perf_counter()
+        connection = current_app.extensions['letter_archive'].connect()
+        try:
+            total = rebuild(connection)
+            buckets = connection.execute('SELECT count(*) FROM letter_rollups').fetchone()[0]
+        finally:
+            connection.close()
+        click.echo(f'Counted {total} letters into {buckets} buckets '
+                   f'in {time.perf_counter() - start:.1f}s')
@@ -0,0 +1,373 @@
+"""
+Letter search module.
+Full-text search over archived letters' wishes, feelings and memories,
+backed by the letters_fts FTS5 index that the archive's triggers keep up
+to date (see modules.letter_archive).
+
+Queries are plain text for moderators, not raw FTS5 syntax:
+
+    bike                  letters mentioning "bike"
+    bike* helmet          words starting with "bike", and "helmet"
+    "new bike"            the exact phrase
+    puppy OR kitten       either word
+    bike -scooter         "bike" but not "scooter"
+
+Results are ranked by BM25 (or newest first) and paged with a keyset
+cursor rather than OFFSET, so deep pages cost the same as the first.
+BM25 has to score every match before it can return the best one, so
+ranking only looks at the newest RANK_WINDOW matches.
+
+Letters compacted into cold segments are searched with tier=cold, newest
+first: each block is loaded into an in-memory FTS5 table and queried
+with the same expression, after a cheap check that skips blocks missing
+a required word. A page scans at most COLD_BLOCKS blocks, so it may hold
+fewer than `limit` results and still have a `next` cursor.
+"""
+
+import re
+import sqlite3
+
+from flask import current_app, jsonify, request
+
+from modules import letter_archive, letter_segments
+from modules.admin import admin_required
+
+SEARCH_FIELDS = ('wish', 'feeling', 'memory')
+
+# BM25 column weights, in SEARCH_FIELDS order; a hit in the wish counts double
+WEIGHTS = (2.0, 1.0, 1.0)
+
+SORTS = ('rank', 'newest')
+TIERS = ('hot', 'cold')
+
+# Ranked search scores at most this many of the newest matching letters, so
+# a word found in most letters costs the same as one found in a few
+RANK_WINDOW = 20000
+MAX_LIMIT = 100
+MAX_TERMS = 16
+SNIPPET_TOKENS = 16
+HIGHLIGHT = ('[', ']')
+COLD_BLOCKS = 50
+
+TOKEN = re.compile(r'(-?)"([^"]*)"(\*?)|(\S+)')
+WORD = re.compile(r'\w+')
+
+
+def _phrase(words, prefix=False):
+    # Every term is quoted, so FTS5 operators typed by the user stay plain text
+    return '"' + ' '.join(words) + '"' + ('*' if prefix else '')
+
+
+def _terms(text):
+    """Yield 'OR', or (words, prefix, negated) for each term of a query."""
+    for match in TOKEN.finditer(text or ''):
+        negated, quoted, star, bare = match.groups()
+        if bare is not None:
+            if bare == 'OR':
+                yield 'OR'
+                continue
+            negated, star = ('-' if bare.startswith('-') else ''), ('*' if bare.endswith('*') else '')
+            quoted = bare
+        words = WORD.findall(quoted)
+        if words:
+            yield words, bool(star), bool(negated)
+
+
+def required_words(text):
+    """Lower-case words every matching letter contains (none if the query uses OR)."""
+    terms = list(_terms(text))
+    if 'OR' in terms:
+        return []
+    return [word.lower() for words, _, negated in terms if not negated for word in words]
+
+
+def build_match(text, fields=None):
+    """
+    Translate a moderator's query into an FTS5 MATCH expression.
+
+    Args:
+        text: Query text (words, "phrases", prefix*, OR, -excluded)
+        fields: Fields to search (default: all of SEARCH_FIELDS)
+
+    Returns:
+        str: MATCH expression for letters_fts
+
+    Raises:
+        ValueError: If the query has no searchable words or names an unknown field
+    """
+    fields = tuple(fields or SEARCH_FIELDS)
+    unknown = set(fields) - set(SEARCH_FIELDS)
+    if unknown:
+        raise ValueError(f'unknown field {sorted(unknown)[0]!r}; use {", ".join(SEARCH_FIELDS)}')
+
+    terms, excluded = [], []
+    for term in _terms(text):
+        if term == 'OR':
+            if terms and terms[-1] != 'OR':
+                terms.append('OR')
+            continue
+        words, prefix, negated = term
+        if negated:
+            excluded.append(_phrase(words, prefix))
+        else:
+            terms.append(_phrase(words, prefix))
+    if terms and terms[-1] == 'OR':
+        terms.pop()
+    if not terms:
+        raise ValueError('query has no words to search for')
+    if len(terms) + len(excluded) > MAX_TERMS:
+        raise ValueError(f'query has more than {MAX_TERMS} terms')
+
+    expression = ' '.join(terms)
+    if excluded:
+        expression = f'({expression}) NOT ({" OR ".join(excluded)})'
+    if fields != SEARCH_FIELDS:
+        expression = '{' + ' '.join(fields) + '} : (' + expression + ')'
+    return expression
+
+
+def parse_cursor(cursor, sort):
+    """
+    Decode the `after` cursor of a previous page.
+
+    Returns:
+        tuple: (score, id, lowest id in the rank window) when sorting by
+               rank, (id,) when newest first
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    try:
+        if sort == 'rank':
+            score, letter_id, floor = cursor.split(':')
+            return float(score), int(letter_id), int(floor)
+        return (int(cursor),)
+    except ValueError:
+        raise ValueError(f'malformed cursor {cursor!r}') from None
+
+
+def rank_floor(connection, expression):
+    """Lowest id among the newest RANK_WINDOW letters matching the expression."""
+    # Walking the match list by rowid is cheap next to scoring each match
+    row = connection.execute(
+        'SELECT rowid FROM letters_fts WHERE letters_fts MATCH ? ORDER BY rowid DESC '
+        'LIMIT 1 OFFSET ?', (expression, RANK_WINDOW - 1)).fetchone()
+    return row[0] if row else 0
+
+
+def older_matches(connection, expression, floor):
+    """Whether letters below the rank window's floor match too (and so were left out)."""
+    return floor > 0 and connection.execute(
+        'SELECT rowid FROM letters_fts WHERE letters_fts MATCH ? AND rowid < ? '
+        'ORDER BY rowid DESC LIMIT 1', (expression, floor)).fetchone() is not None
+
+
+def search(connection, text, fields=None, sort='rank', limit=20, after=None):
+    """
+    Search archived letters.
+
+    Args:
+        connection: Connection to the archive (letter_archive.connect)
+        text: Query text, see build_match
+        fields: Fields to search (default: all)
+        sort: 'rank' (best BM25 match among the newest RANK_WINDOW
+              matches first) or 'newest'
+        limit: Results per page
+        after: Cursor returned as `next` by the previous page
+
+    Returns:
+        dict: 'match' (the FTS5 expression), 'results' (id, created_at,
+              name, country, emotion, score and highlighted snippets of
+              the fields that matched) and 'next' (cursor for the
+              following page, or None on the last page); when sorting
+              by rank also 'ranked_window' (RANK_WINDOW) and 'truncated'
+              (True if older matches were left out of the ranking)
+
+    Raises:
+        ValueError: On a bad query, sort or cursor
+    """
+    if sort not in SORTS:
+        raise ValueError(f'sort must be one of {", ".join(SORTS)}')
+    expression = build_match(text, fields)
+    cursor = parse_cursor(after, sort) if after else None
+    bm25 = f'bm25(letters_fts, {", ".join(str(weight) for weight in WEIGHTS)})'
+
+    if sort == 'rank':
+        # The window is fixed by the first page, so later pages rank the same letters
+        floor = cursor[2] if cursor else rank_floor(connection, expression)
+        # BM25 scores are negative, lower is better; id breaks ties so the
+        # keyset (score, id) is unique
+        sql = (f'SELECT id, score FROM (SELECT rowid AS id, {bm25} AS score FROM letters_fts '
+               f'WHERE letters_fts MATCH ? AND rowid >= ?) ')
+        params = [expression, floor]
+        if cursor:
+            sql += 'WHERE (score, id) > (?, ?) '
+            params += cursor[:2]
+        sql += 'ORDER BY score, id LIMIT ?'
+    else:
+        # rowid order comes straight from the index, so this stops after `limit` hits
+        sql = f'SELECT rowid, {bm25} FROM letters_fts WHERE letters_fts MATCH ? '
+        params = [expression]
+        if cursor:
+            sql += 'AND rowid < ? '
+            params += cursor
+        sql += 'ORDER BY rowid DESC LIMIT ?'
+    page = connection.execute(sql, params + [limit]).fetchall()
+
+    results = _describe(connection, expression, page) if page else []
+    next_cursor = None
+    if len(page) == limit:
+        last_id, last_score = page[-1]
+        next_cursor = f'{last_score!r}:{last_id}:{floor}' if sort == 'rank' else str(last_id)
+    result = {'match': expression, 'results': results, 'next': next_cursor}
+    if sort == 'rank':
+        result.update(ranked_window=RANK_WINDOW,
+                      truncated=older_matches(connection, expression, floor))
+    return result
+
+
+def search_cold(connection, text, fields=None, limit=20, after=None, max_blocks=COLD_BLOCKS):
+    """
+    Search letters in the cold segments, newest first.
+
+    Args:
+        connection: Connection to the archive
+        text: Query text, see build_match
+        fields: Fields to search (default: all)
+        limit: Results per page
+        after: Cursor returned as `next` by the previous page
+        max_blocks: Most segment blocks read for this page
+
+    Returns:
+        dict: As search(); scores are BM25 within each block
+
+    Raises:
+        ValueError: On a bad query or cursor
+    """
+    expression = build_match(text, fields)
+    before = parse_cursor(after, 'newest')[0] if after else None
+    required = [word.encode() for word in required_words(text)]
+    directory = letter_segments.segment_directory(connection)
+    scratch = sqlite3.connect(':memory:')
+    # Same columns and tokenizer as letters_fts, so the expression means the same
+    scratch.execute(f"CREATE VIRTUAL TABLE block_fts USING fts5 ({', '.join(SEARCH_FIELDS)}, "
+                    f"tokenize='unicode61 remove_diacritics 2')")
+    bm25 = f'bm25(block_fts, {", ".join(str(weight) for weight in WEIGHTS)})'
+    marks = ', '.join(f"snippet(block_fts, {column}, '{HIGHLIGHT[0]}', '{HIGHLIGHT[1]}', "
+                      f"'…', {SNIPPET_TOKENS})" for column in range(len(SEARCH_FIELDS)))
+    results = []
+    next_cursor = None
+    try:
+        until_id = before - 1 if before is not None else None
+        for scanned, block in enumerate(letter_segments.blocks(connection, until_id=until_id,
+                                                               descending=True)):
+            if scanned == max_blocks:
+                # Everything below the last block read is still to be searched
+                next_cursor = str(block['last_id'] + 1)
+                break
+            data = letter_segments.read_block(directory, block)
+            # Diacritics are folded by the tokenizer, so only ASCII text can be ruled out
+            if required and data.isascii():
+                lowered = data.lower()
+                if not all(word in lowered for word in required):
+                    continue
+            letters = {letter['id']: letter for letter in letter_segments.block_letters(data)
+                       if before is None or letter['id'] < before}
+            scratch.executemany(
+                f'INSERT INTO block_fts (rowid, {", ".join(SEARCH_FIELDS)}) VALUES (?, ?, ?, ?)',
+                [(letter_id, *(letter[field] for field in SEARCH_FIELDS))
+                 for letter_id, letter in letters.items()])
+            for letter_id, score, *snippets in scratch.execute(
+                    f'SELECT rowid, {bm25}, {marks} FROM block_fts WHERE block_fts MATCH ? '
+                    f'ORDER BY rowid DESC LIMIT ?', (expression, limit - len(results))):
+                letter = letters[letter_id]
+                results.append({
+                    'id': letter_id,
+                    'created_at': letter['created_at'],
+                    'name': letter['name'],
+                    'country': letter['country'],
+                    'emotion': letter['emotion'],
+                    'score': round(-score, 6),
+                    'snippets': {field: snippet for field, snippet in zip(SEARCH_FIELDS, snippets)
+                                 if snippet and HIGHLIGHT[0] in snippet},
+                })
+            scratch.execute('DELETE FROM block_fts')
+            if len(results) == limit:
+                next_cursor = str(results[-1]['id'])
+                break
+    finally:
+        scratch.close()
+    return {'match': expression, 'results': results, 'next': next_cursor}
+
+
+def _describe(connection, expression, page):
+    """Load the letters on a page and highlight where each field matched."""
+    ids = [letter_id for letter_id, _ in page]
+    marks = ', '.join(f"snippet(letters_fts, {column}, '{HIGHLIGHT[0]}', '{HIGHLIGHT[1]}', "
+                      f"'…', {SNIPPET_TOKENS})" for column in range(len(SEARCH_FIELDS)))
+    placeholders = ', '.join('?' for _ in ids)
+    snippets = {row[0]: row[1:] for row in connection.execute(
+        f'SELECT rowid, {marks} FROM letters_fts WHERE letters_fts MATCH ? '
+        f'AND rowid IN ({placeholders})', [expression] + ids)}
+    letters = {row[0]: row[1:] for row in connection.execute(
+        f'SELECT id, created_at, name, country, emotion FROM letters '
+        f'WHERE id IN ({placeholders})', ids)}
+
+    results = []
+    for letter_id, score in page:
+        if letter_id not in letters:
+            continue  # deleted since the search ran
+        created_at, name, country, emotion = letters[letter_id]
+        results.append({
+            'id': letter_id,
+            'created_at': created_at,
+            'name': name,
+            'country': country,
+            'emotion': emotion,
+            'score': round(-score, 6),
+            'snippets': {field: text for field, text in zip(SEARCH_FIELDS, snippets.get(letter_id, ()))
+                         if text and HIGHLIGHT[0] in text},
+        })
+    return results
+
+
+def init_app(app):
+    """
+    Add GET /admin/letters/search. Requires modules.letter_archive.
+
+    Query parameters: q, fields (comma separated), sort (rank or newest),
+    limit (default 20, at most MAX_LIMIT), after (the previous page's
+    `next` cursor) and tier (hot, the default, or cold for compacted
+    letters, newest first).
+
+    Args:
+        app: Flask application
+    """
+    @app.route('/admin/letters/search')
+    @admin_required
+    def search_letters():
+        """Full-text search over archived letters."""
+        archive = current_app.extensions['letter_archive']
+        fields = [field.strip() for field in request.args.get('fields', '').split(',')
+                  if field.strip()]
+        limit = min(max(request.args.get('limit', 20, type=int), 1), MAX_LIMIT)
+        tier = request.args.get('tier', 'hot')
+        if tier not in TIERS:
+            return jsonify(error=f'tier must be one of {", ".join(TIERS)}'), 400
+        if tier == 'cold' and request.args.get('sort', 'newest') != 'newest':
+            return jsonify(error='cold letters are searched newest first only'), 400
+        connection = letter_archive.connect(archive.path)
+        try:
+            connection.execute('PRAGMA query_only = 1')
+            if tier == 'cold':
+                result = search_cold(connection, request.args.get('q', ''), fields=fields,
+                                     limit=limit, after=request.args.get('after'))
+            else:
+                result = search(connection, request.args.get('q', ''), fields=fields,
+                                sort=request.args.get('sort', 'rank'), limit=limit,
+                                after=request.args.get('after'))
+        except ValueError as error:
+            return jsonify(error=str(error)), 400
+        finally:
+            connection.close()
+        return jsonify(dict(result, query=request.args.get('q', '')))
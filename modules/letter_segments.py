@@ -0,0 +1,308 @@
+"""
+Letter segments module.
+Cold storage for old archived letters. Compaction moves letters out of
+the SQLite archive into one compressed file per month, next to the
+database (`letters.db` keeps its segments in `letters-segments/`):
+
+    letters-2025-12.ndjson.gz
+
+A segment is NDJSON, one letter per line, written as a series of gzip
+members of BLOCK_LETTERS letters each. Members are only ever appended, so
+`zcat` reads a whole month, and the sparse index in the
+letter_segment_blocks table (first and last id, time range, byte offset
+and length per member) lets export and search decompress just the blocks
+they need.
+
+Letters are moved in id order, and a letter never goes to an earlier
+month than the one before it, so the cold tier always holds exactly the
+letters up to some id (cold_through) and blocks never overlap.
+"""
+
+import gzip
+import itertools
+import json
+import os
+import re
+import time
+import zlib
+
+from modules.letter_dedup import RESOLVED_REPLY
+
+BLOCK_LETTERS = 1000
+COLUMNS = ('id', 'created_at', 'name', 'age', 'gender', 'country', 'feeling', 'wish', 'memory',
+           'emotion', 'reply', 'flags', 'content_hash', 'duplicate_of', 'similar_to')
+# Raw text removed by the retention policy; everything else stays for aggregates
+TEXT_COLUMNS = ('name', 'feeling', 'wish', 'memory', 'reply')
+SEGMENT_PATTERN = re.compile(r'letters-\d{4}-\d{2}(?:-r\d+)?\.ndjson\.gz$')
+BLOCK_COLUMNS = ('first_id', 'last_id', 'month', 'file', 'offset', 'length', 'letters',
+                 'min_created', 'max_created', 'text_removed')
+# Duplicates sharing their original's reply get their own copy in the segment
+SELECT_EXPRESSIONS = {'reply': RESOLVED_REPLY, 'content_hash': 'lower(hex(content_hash))'}
+
+MIGRATION = """
+CREATE TABLE letter_segment_blocks (
+    first_id INTEGER PRIMARY KEY,
+    last_id INTEGER NOT NULL,
+    month TEXT NOT NULL,
+    file TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    letters INTEGER NOT NULL,
+    min_created REAL NOT NULL,
+    max_created REAL NOT NULL,
+    text_removed INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX letter_segment_blocks_file ON letter_segment_blocks (file);
+CREATE TABLE letter_compactions (
+    id INTEGER PRIMARY KEY,
+    started_at REAL NOT NULL,
+    cutoff REAL NOT NULL,
+    through_id INTEGER NOT NULL DEFAULT 0,
+    letters INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+
+def segment_directory(connection):
+    """Directory of the archive's segments, or None for an in-memory archive."""
+    path = connection.execute('PRAGMA database_list').fetchone()[2]
+    return os.path.splitext(path)[0] + '-segments' if path else None
+
+
+def cold_through(connection):
+    """Highest letter id in the cold tier (0 if nothing has been compacted)."""
+    return connection.execute('SELECT max(last_id) FROM letter_segment_blocks').fetchone()[0] or 0
+
+
+def cold_cutoff(connection):
+    """
+    Time before which letters may be cold (None if never compacted).
+    Every letter created at or after it is still in the letters table.
+    """
+    return connection.execute('SELECT max(cutoff) FROM letter_compactions').fetchone()[0]
+
+
+def month_of(created_at):
+    return time.strftime('%Y-%m', time.gmtime(created_at))
+
+
+def blocks(connection, after_id=None, until_id=None, since=None, until=None, descending=False):
+    """
+    Index entries of the blocks that may hold matching letters.
+
+    Args:
+        connection: Connection to the archive
+        after_id: Only blocks with letters after this id
+        until_id: Only blocks with letters up to this id
+        since: Only blocks with letters created at or after this time
+        until: Only blocks with letters created before this time
+        descending: Newest block first
+
+    Returns:
+        list: dicts with BLOCK_COLUMNS keys
+    """
+    where, params = [], []
+    for condition, value in (('last_id > ?', after_id), ('first_id <= ?', until_id),
+                             ('max_created >= ?', since), ('min_created < ?', until)):
+        if value is not None:
+            where.append(condition)
+            params.append(value)
+    sql = f'SELECT {", ".join(BLOCK_COLUMNS)} FROM letter_segment_blocks'
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    sql += f' ORDER BY first_id {"DESC" if descending else ""}'
+    return [dict(zip(BLOCK_COLUMNS, row)) for row in connection.execute(sql, params)]
+
+
+def read_block(directory, block):
+    """Decompressed NDJSON of one block (a single gzip member)."""
+    with open(os.path.join(directory, block['file']), 'rb') as segment:
+        segment.seek(block['offset'])
+        return zlib.decompress(segment.read(block['length']), wbits=31)
+
+
+def block_letters(data):
+    return [json.loads(line) for line in data.splitlines()]
+
+
+def iter_rows(connection, after_id=None, until_id=None, since=None, until=None):
+    """
+    Yield cold letters in id order as dicts with COLUMNS keys.
+
+    Blocks are chosen with the sparse index; letters inside a block are
+    filtered by id and creation time.
+    """
+    directory = segment_directory(connection)
+    for block in blocks(connection, after_id, until_id, since, until):
+        for letter in block_letters(read_block(directory, block)):
+            if ((after_id is None or letter['id'] > after_id)
+                    and (until_id is None or letter['id'] <= until_id)
+                    and (since is None or letter['created_at'] >= since)
+                    and (until is None or letter['created_at'] < until)):
+                yield letter
+
+
+def _encode(letters):
+    lines = ''.join(json.dumps(letter, ensure_ascii=False, separators=(',', ':')) + '\n'
+                    for letter in letters)
+    # mtime=0 keeps the output a function of the letters alone
+    return gzip.compress(lines.encode('utf-8'), compresslevel=6, mtime=0)
+
+
+def _append(directory, file_name, end, data):
+    """Append one member at the indexed end of a segment; returns its offset."""
+    path = os.path.join(directory, file_name)
+    with open(path, 'ab') as segment:
+        # Bytes past the index are from a run that died before committing
+        segment.truncate(end)
+        segment.write(data)
+        segment.flush()
+        os.fsync(segment.fileno())
+    return end
+
+
+def compact(connection, cutoff, echo=None):
+    """
+    Move letters created before `cutoff` into monthly segments.
+
+    Moves every letter below the first one created at or after the cutoff,
+    except the newest letter in the archive, a block per write transaction: the block is appended to its segment,
+    indexed and deleted from letters (the triggers drop it from the search
+    and near-duplicate indexes, and hand its reply to hot duplicates).
+
+    Args:
+        connection: Connection to the archive (not in a transaction)
+        cutoff: Unix timestamp, on an hour boundary so the dashboard
+                counters can be rebuilt from the letters after it
+        echo: Called with the number of letters moved so far
+
+    Returns:
+        int: Letters moved
+    """
+    directory = segment_directory(connection)
+    if directory is None:
+        raise ValueError('an in-memory archive has no segment directory')
+    os.makedirs(directory, exist_ok=True)
+    first_hot = connection.execute('SELECT min(id) FROM letters WHERE created_at >= ?',
+                                   (cutoff,)).fetchone()[0]
+    # The newest letter always stays: letters has no AUTOINCREMENT, so once
+    # it was empty SQLite would hand out the moved letters' ids again
+    newest = connection.execute('SELECT max(id) FROM letters').fetchone()[0] or 0
+    last = min(first_hot - 1, newest - 1) if first_hot is not None else newest - 1
+    with connection:
+        run = connection.execute('INSERT INTO letter_compactions (started_at, cutoff) VALUES (?, ?)',
+                                 (time.time(), cutoff)).lastrowid
+
+    select = ', '.join(SELECT_EXPRESSIONS.get(column, column) for column in COLUMNS)
+    moved = 0
+    while True:
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            newest = connection.execute(
+                'SELECT month, file FROM letter_segment_blocks ORDER BY first_id DESC LIMIT 1'
+            ).fetchone()
+            rows = connection.execute(
+                f'SELECT {select} FROM letters WHERE id > ? AND id <= ? ORDER BY id LIMIT ?',
+                (cold_through(connection), last, BLOCK_LETTERS)).fetchall()
+            if not rows:
+                break
+            letters = [dict(zip(COLUMNS, row)) for row in rows]
+            # Never an earlier month than the newest block, so blocks stay in id order
+            month = max(month_of(letters[0]['created_at']), newest[0] if newest else '')
+            block = list(itertools.takewhile(
+                lambda letter: month_of(letter['created_at']) <= month, letters))
+            file_name = newest[1] if newest and newest[0] == month else f'letters-{month}.ndjson.gz'
+            end = connection.execute(
+                'SELECT coalesce(max(offset + length), 0) FROM letter_segment_blocks WHERE file = ?',
+                (file_name,)).fetchone()[0]
+            data = _encode(block)
+            offset = _append(directory, file_name, end, data)
+            created = [letter['created_at'] for letter in block]
+            first_id, last_id = block[0]['id'], block[-1]['id']
+            connection.execute(
+                f'INSERT INTO letter_segment_blocks ({", ".join(BLOCK_COLUMNS)}) '
+                f'VALUES ({", ".join("?" for _ in BLOCK_COLUMNS)})',
+                (first_id, last_id, month, file_name, offset, len(data), len(block),
+                 min(created), max(created),
+                 int(all(letter['feeling'] is None for letter in block))))
+            connection.execute('DELETE FROM letters WHERE id >= ? AND id <= ?', (first_id, last_id))
+            connection.execute('UPDATE letter_compactions SET through_id = ?, '
+                               'letters = letters + ? WHERE id = ?', (last_id, len(block), run))
+        moved += len(block)
+        if echo:
+            echo(moved)
+    return moved
+
+
+def strip_text(connection, cutoff):
+    """
+    Remove the raw text (TEXT_COLUMNS) of cold months whose letters were
+    all created before `cutoff`.
+
+    Each month is rewritten to a new file, the index is switched to it in
+    one transaction and the old file is deleted, so readers see either
+    the old or the new segment, never a mix.
+
+    Returns:
+        int: Letters whose text was removed
+    """
+    directory = segment_directory(connection)
+    stripped = 0
+    months = [month for month, in connection.execute(
+        'SELECT month FROM letter_segment_blocks GROUP BY month '
+        'HAVING max(max_created) < ? AND min(text_removed) = 0 ORDER BY month', (cutoff,))]
+    for month in months:
+        month_blocks = [block for block in blocks(connection) if block['month'] == month]
+        revision = int(time.time())
+        while os.path.exists(os.path.join(directory, f'letters-{month}-r{revision}.ndjson.gz')):
+            revision += 1
+        file_name = f'letters-{month}-r{revision}.ndjson.gz'
+        entries = []
+        with open(os.path.join(directory, file_name), 'wb') as segment:
+            for block in month_blocks:
+                letters = block_letters(read_block(directory, block))
+                for letter in letters:
+                    letter.update(dict.fromkeys(TEXT_COLUMNS))
+                data = _encode(letters)
+                entries.append((file_name, segment.tell(), len(data), block['first_id']))
+                segment.write(data)
+            segment.flush()
+            os.fsync(segment.fileno())
+        with connection:
+            connection.executemany(
+                'UPDATE letter_segment_blocks SET file = ?, offset = ?, length = ?, '
+                'text_removed = 1 WHERE first_id = ?', entries)
+        stripped += sum(block['letters'] for block in month_blocks)
+    remove_unused(connection)
+    return stripped
+
+
+def remove_unused(connection):
+    """Delete segment files the index no longer refers to (old revisions, failed runs)."""
+    directory = segment_directory(connection)
+    if directory is None or not os.path.isdir(directory):
+        return 0
+    used = {file_name for file_name, in connection.execute(
+        'SELECT DISTINCT file FROM letter_segment_blocks')}
+    removed = 0
+    for name in os.listdir(directory):
+        if SEGMENT_PATTERN.match(name) and name not in used:
+            os.remove(os.path.join(directory, name))
+            removed += 1
+    return removed
+
+
+def tier_stats(connection):
+    """Letters and bytes per cold month, and the cold tier's totals."""
+    months = [{'month': month, 'letters': letters, 'bytes': size, 'blocks': count,
+               'text_removed': bool(removed)}
+              for month, letters, size, count, removed in connection.execute(
+                  'SELECT month, sum(letters), sum(length), count(*), min(text_removed) '
+                  'FROM letter_segment_blocks GROUP BY month ORDER BY month')]
+    return {
+        'letters': sum(month['letters'] for month in months),
+        'bytes': sum(month['bytes'] for month in months),
+        'through_id': cold_through(connection),
+        'cutoff': cold_cutoff(connection),
+        'months': months,
+    }
@@ -0,0 +1,226 @@
+"""
+Memory diagnostics module.
+Admin endpoints that take tracemalloc snapshots of the worker that serves
+the request and diff them, grouped by file and line, to show what grows
+with traffic (Jinja caches, per-letter state, ...).
+
+Tracing slows allocations down, so it only starts with the first snapshot,
+or at startup when TRACEMALLOC is set. Snapshots are kept per process; send
+the diff request to the same worker (e.g. with a single gunicorn worker).
+"""
+
+import gc
+import os
+import threading
+import time
+import tracemalloc
+from collections import OrderedDict
+
+from flask import jsonify, request
+
+from modules.admin import admin_required
+
+MAX_SNAPSHOTS = 10
+GROUPINGS = ('lineno', 'filename', 'traceback')
+
+# Allocations of the tracing machinery itself are noise in every diff
+_IGNORED = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    tracemalloc.Filter(False, '<unknown>'),
+)
+
+
+def current_rss():
+    """
+    Resident set size of this process in bytes.
+
+    Returns:
+        int: Current RSS from /proc, or the peak RSS where /proc is missing
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on Linux, bytes on macOS
+        return peak if os.uname().sysname == 'Darwin' else peak * 1024
+
+
+def memory_summary():
+    """RSS and traced memory of this process, in bytes."""
+    summary = {'pid': os.getpid(), 'rss': current_rss(), 'tracing': tracemalloc.is_tracing()}
+    if tracemalloc.is_tracing():
+        summary['traced'], summary['traced_peak'] = tracemalloc.get_traced_memory()
+    return summary
+
+
+def format_stat(stat, grouping):
+    """
+    Turn a tracemalloc StatisticDiff into a JSON-friendly dict.
+
+    Args:
+        stat: tracemalloc.StatisticDiff
+        grouping: 'lineno', 'filename' or 'traceback'
+
+    Returns:
+        dict: Location, size and count with their change
+    """
+    frames = stat.traceback
+    if grouping == 'traceback':
+        location = [f'{frame.filename}:{frame.lineno}' for frame in frames]
+    elif grouping == 'filename':
+        location = frames[0].filename
+    else:
+        location = f'{frames[0].filename}:{frames[0].lineno}'
+    return {
+        'location': location,
+        'size': stat.size,
+        'size_diff': stat.size_diff,
+        'count': stat.count,
+        'count_diff': stat.count_diff,
+    }
+
+
+class SnapshotStore:
+    """The most recent tracemalloc snapshots of this process, by id."""
+
+    def __init__(self, frames=1, max_snapshots=MAX_SNAPSHOTS):
+        self.frames = frames
+        self.max_snapshots = max_snapshots
+        self._snapshots = OrderedDict()
+        self._next_id = 1
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def _check_pid(self):
+        # Snapshots taken in the gunicorn master mean nothing in a worker
+        if self._pid != os.getpid():
+            self._snapshots.clear()
+            self._pid = os.getpid()
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+
+    def take(self):
+        """
+        Collect garbage and snapshot the traced allocations.
+
+        Returns:
+            dict: Snapshot id, timestamp and memory summary
+        """
+        self.start()
+        gc.collect()
+        snapshot = tracemalloc.take_snapshot().filter_traces(_IGNORED)
+        with self._lock:
+            self._check_pid()
+            snapshot_id = self._next_id
+            self._next_id += 1
+            self._snapshots[snapshot_id] = (time.time(), snapshot)
+            while len(self._snapshots) > self.max_snapshots:
+                self._snapshots.popitem(last=False)
+        return dict(memory_summary(), id=snapshot_id, taken_at=time.time())
+
+    def get(self, snapshot_id):
+        with self._lock:
+            self._check_pid()
+            entry = self._snapshots.get(snapshot_id)
+        return entry[1] if entry else None
+
+    def listing(self):
+        with self._lock:
+            self._check_pid()
+            return [{'id': snapshot_id, 'taken_at': taken_at}
+                    for snapshot_id, (taken_at, _) in self._snapshots.items()]
+
+    def clear(self):
+        """Drop every snapshot and stop tracing."""
+        with self._lock:
+            self._snapshots.clear()
+        tracemalloc.stop()
+
+    def diff(self, old_id, new_id=None, grouping='lineno', limit=25):
+        """
+        Compare two snapshots, or a snapshot with the current allocations.
+
+        Args:
+            old_id: Id of the baseline snapshot
+            new_id: Id of the newer snapshot; None takes a fresh one
+            grouping: 'lineno', 'filename' or 'traceback'
+            limit: Number of entries to return, largest growth first
+
+        Returns:
+            dict: Totals and top differences, or None if an id is unknown
+        """
+        old = self.get(old_id)
+        if old is None:
+            return None
+        if new_id is None:
+            new_id = self.take()['id']
+        new = self.get(new_id)
+        if new is None:
+            return None
+        stats = new.compare_to(old, grouping, cumulative=grouping == 'traceback')
+        return {
+            'from': old_id,
+            'to': new_id,
+            'grouping': grouping,
+            'size_diff': sum(stat.size_diff for stat in stats),
+            'count_diff': sum(stat.count_diff for stat in stats),
+            'top': [format_stat(stat, grouping) for stat in stats[:limit]],
+        }
+
+
+def init_app(app, trace_at_startup=False, frames=1):
+    """
+    Register the admin memory routes.
+
+    Args:
+        app: Flask application
+        trace_at_startup: Start tracemalloc now instead of at the first snapshot
+        frames: Stack frames stored per allocation (needed for 'traceback')
+    """
+    store = SnapshotStore(frames)
+    app.extensions['memory'] = store
+    if trace_at_startup:
+        store.start()
+
+    @app.route('/admin/memory', methods=['GET'])
+    @admin_required
+    def memory_status():
+        """RSS, traced memory and the snapshots held by this worker."""
+        return jsonify(dict(memory_summary(), snapshots=store.listing()))
+
+    @app.route('/admin/memory/snapshot', methods=['POST'])
+    @admin_required
+    def memory_snapshot():
+        """Take a snapshot, starting tracemalloc if it is not running yet."""
+        return jsonify(store.take()), 201
+
+    @app.route('/admin/memory/diff', methods=['GET'])
+    @admin_required
+    def memory_diff():
+        """Diff ?from=<id> (default: oldest) against ?to=<id> (default: now)."""
+        grouping = request.args.get('group', 'lineno')
+        if grouping not in GROUPINGS:
+            return jsonify(error=f'group must be one of {", ".join(GROUPINGS)}'), 400
+        listing = store.listing()
+        old_id = request.args.get('from', type=int) or (listing[0]['id'] if listing else None)
+        new_id = request.args.get('to', type=int)
+        if old_id is None:
+            return jsonify(error='take a snapshot first (POST /admin/memory/snapshot)'), 409
+        limit = min(max(request.args.get('limit', 25, type=int), 1), 500)
+        result = store.diff(old_id, new_id, grouping, limit)
+        if result is None:
+            return jsonify(error='unknown snapshot id', snapshots=listing), 404
+        return jsonify(dict(memory_summary(), **result))
+
+    @app.route('/admin/memory', methods=['DELETE'])
+    @admin_required
+    def memory_reset():
+        """Forget all snapshots and stop tracing."""
+        store.clear()
+        return '', 204
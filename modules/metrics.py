@@ -0,0 +1,344 @@
+"""
+Prometheus-style metrics module.
+Records per-endpoint request latency, status counts, response bytes and
+session cookie sizes.
+
+Every process writes its own memory-mapped file of float64 slots under
+METRICS_DIR, so gunicorn workers never contend on a shared lock. /metrics
+sums the files of all workers into one text exposition. The slot layout is
+derived from the app's endpoints, so every worker of the same deploy
+agrees on it.
+"""
+
+import glob
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+from flask import Response, g, request
+
+PREFIX = 'santa'
+FILE_PATTERN = 'metrics-*.db'
+HEADER = struct.Struct('<8sQ')  # magic, number of slots
+MAGIC = b'SANTAMET'
+
+# Upper bounds in seconds; +Inf is implicit
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Upper bounds in bytes for the session cookie; browsers reject cookies past ~4096
+SESSION_BUCKETS = (256, 512, 1024, 2048, 3072, 3584, 4096, 8192)
+
+# Status codes tracked individually; everything else is counted as 'other'
+STATUS_CODES = ('200', '204', '302', '304', '400', '403', '404', '405', '500')
+
+UNMATCHED_ENDPOINT = '_unmatched'
+
+
+def default_metrics_dir():
+    return os.path.join(tempfile.gettempdir(), 'santa-metrics')
+
+
+class Histogram:
+    """Histogram family with one label, stored as per-bucket counts plus a sum."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, label, values, buckets, offset):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.values = tuple(values)
+        self.buckets = tuple(buckets)
+        self.stride = len(self.buckets) + 2  # buckets, +Inf, sum
+        self.offsets = {value: offset + i * self.stride for i, value in enumerate(self.values)}
+        self.size = self.stride * len(self.values)
+
+    def observe(self, slots, label_value, amount):
+        base = self.offsets[label_value]
+        slots[base + bisect_left(self.buckets, amount)] += 1
+        slots[base + self.stride - 1] += amount
+
+    def expose(self, slots):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        bounds = [_format_number(b) for b in self.buckets] + ['+Inf']
+        for value, base in self.offsets.items():
+            label = f'{self.label}="{value}"'
+            cumulative = 0
+            for i, bound in enumerate(bounds):
+                cumulative += slots[base + i]
+                lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {_format_number(cumulative)}')
+            lines.append(f'{self.name}_sum{{{label}}} {_format_number(slots[base + self.stride - 1])}')
+            lines.append(f'{self.name}_count{{{label}}} {_format_number(cumulative)}')
+        return lines
+
+
+class Counter:
+    """Counter family keyed by a tuple of label values."""
+
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labels, values, offset):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.offsets = {tuple(value): offset + i for i, value in enumerate(values)}
+        self.size = len(self.offsets)
+
+    def inc(self, slots, label_values, amount=1):
+        slots[self.offsets[label_values]] += amount
+
+    def expose(self, slots):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        for values, index in self.offsets.items():
+            label = ','.join(f'{k}="{v}"' for k, v in zip(self.labels, values))
+            lines.append(f'{self.name}{{{label}}} {_format_number(slots[index])}')
+        return lines
+
+
+class Registry:
+    """Fixed set of metric families and their slot offsets."""
+
+    def __init__(self, endpoints):
+        self.endpoints = tuple(sorted(endpoints)) + (UNMATCHED_ENDPOINT,)
+        self.families = []
+        self.size = 0
+
+        self.latency = self._add(Histogram(
+            f'{PREFIX}_request_duration_seconds', 'Request latency in seconds.',
+            'endpoint', self.endpoints, LATENCY_BUCKETS, self.size))
+        statuses = STATUS_CODES + ('other',)
+        self.requests = self._add(Counter(
+            f'{PREFIX}_requests_total', 'Requests by endpoint and status code.',
+            ('endpoint', 'status'),
+            [(e, s) for e in self.endpoints for s in statuses], self.size))
+        self.response_bytes = self._add(Counter(
+            f'{PREFIX}_response_bytes_total', 'Response body bytes before compression.',
+            ('endpoint',), [(e,) for e in self.endpoints], self.size))
+        self.session_bytes = self._add(Histogram(
+            f'{PREFIX}_session_cookie_bytes', 'Serialized session cookie size in bytes.',
+            'endpoint', self.endpoints, SESSION_BUCKETS, self.size))
+
+    def _add(self, family):
+        self.families.append(family)
+        self.size += family.size
+        return family
+
+    def expose(self, slots):
+        lines = []
+        for family in self.families:
+            lines.extend(family.expose(slots))
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsStore:
+    """
+    This process's memory-mapped slot file.
+
+    The file is (re)opened lazily and whenever the pid changes, so a store
+    created before gunicorn forks still gives every worker its own file.
+    """
+
+    def __init__(self, directory, size):
+        self.directory = directory
+        self.size = size
+        self.lock = threading.Lock()
+        self._pid = None
+        self._mmap = None
+        self._slots = None
+
+    @property
+    def slots(self):
+        """Writable view of this process's slots; hold ``lock`` while updating."""
+        if self._pid != os.getpid():
+            self._open()
+        return self._slots
+
+    def _open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f'metrics-{os.getpid()}.db')
+        length = HEADER.size + 8 * self.size
+        # A file with this pid belongs to a dead process whose pid was reused:
+        # carry on from its counts rather than lose them, unless its layout
+        # is from another deploy
+        if not _has_layout(path, self.size):
+            with open(path, 'wb') as metrics_file:
+                metrics_file.write(HEADER.pack(MAGIC, self.size))
+                metrics_file.truncate(length)
+        with open(path, 'r+b') as metrics_file:
+            self._mmap = mmap.mmap(metrics_file.fileno(), length)
+        self._slots = memoryview(self._mmap)[HEADER.size:].cast('d')
+        self._pid = os.getpid()
+
+
+def _has_layout(path, size):
+    """Whether a slot file exists with `size` slots."""
+    try:
+        with open(path, 'rb') as metrics_file:
+            header = metrics_file.read(HEADER.size)
+            length = os.fstat(metrics_file.fileno()).st_size
+    except OSError:
+        return False
+    return (len(header) == HEADER.size and HEADER.unpack(header) == (MAGIC, size)
+            and length == HEADER.size + 8 * size)
+
+
+def read_all(directory, size):
+    """
+    Sum the slot files of every process in a metrics directory.
+
+    Files with a different layout (e.g. left over from another deploy) are
+    skipped.
+
+    Returns:
+        array: Aggregated slot values
+    """
+    totals = array('d', bytes(8 * size))
+    for path in glob.glob(os.path.join(directory, FILE_PATTERN)):
+        try:
+            with open(path, 'rb') as metrics_file:
+                data = metrics_file.read()
+        except OSError:
+            continue
+        if len(data) != HEADER.size + 8 * size:
+            continue
+        magic, slots = HEADER.unpack_from(data)
+        if magic != MAGIC or slots != size:
+            continue
+        values = array('d')
+        values.frombytes(data[HEADER.size:])
+        for i, value in enumerate(values):
+            if value:
+                totals[i] += value
+    return totals
+
+
+def clear_directory(directory):
+    """Remove all slot files, e.g. when the gunicorn master starts."""
+    for path in glob.glob(os.path.join(directory, FILE_PATTERN)):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _format_number(value):
+    return repr(int(value)) if float(value).is_integer() else repr(value)
+
+
+def _count_streamed_bytes(iterable, record):
+    total = 0
+    try:
+        for chunk in iterable:
+            total += len(chunk)
+            yield chunk
+    finally:
+        record(total)
+
+
+class RequestMetrics:
+    """Wires the registry and store into a Flask app."""
+
+    def __init__(self, app, directory):
+        self.app = app
+        self.directory = directory
+        self.registry = None
+        self.store = None
+        self._init_lock = threading.Lock()
+
+    def _ensure_ready(self):
+        # Built on first use so every route has been registered by then
+        if self.store is None:
+            with self._init_lock:
+                if self.store is None:
+                    self.registry = Registry(self.app.view_functions)
+                    self.store = MetricsStore(self.directory, self.registry.size)
+        return self.registry, self.store
+
+    def observe(self, endpoint, status_code, duration, size):
+        """
+        Record one finished request.
+
+        Args:
+            endpoint: Flask endpoint name (None for unmatched URLs)
+            status_code: Integer HTTP status
+            duration: Latency in seconds
+            size: Response body bytes (None if not known yet)
+        """
+        registry, store = self._ensure_ready()
+        if endpoint not in registry.latency.offsets:
+            endpoint = UNMATCHED_ENDPOINT
+        status = str(status_code)
+        if status not in STATUS_CODES:
+            status = 'other'
+        with store.lock:
+            slots = store.slots
+            registry.latency.observe(slots, endpoint, duration)
+            registry.requests.inc(slots, (endpoint, status))
+            if size:
+                registry.response_bytes.inc(slots, (endpoint,), size)
+
+    def add_bytes(self, endpoint, size):
+        registry, store = self._ensure_ready()
+        if endpoint not in registry.latency.offsets:
+            endpoint = UNMATCHED_ENDPOINT
+        with store.lock:
+            registry.response_bytes.inc(store.slots, (endpoint,), size)
+
+    def observe_session_size(self, endpoint, size):
+        """Record the session cookie size sent with (or kept by) a response."""
+        registry, store = self._ensure_ready()
+        if endpoint not in registry.latency.offsets:
+            endpoint = UNMATCHED_ENDPOINT
+        with store.lock:
+            registry.session_bytes.observe(store.slots, endpoint, size)
+
+    def exposition(self):
+        registry, _ = self._ensure_ready()
+        return registry.expose(read_all(self.directory, registry.size))
+
+
+def init_app(app):
+    """
+    Instrument every request and serve the aggregate at /metrics.
+
+    Args:
+        app: Flask application
+
+    Returns:
+        RequestMetrics: The instrumentation, also stored in app.extensions
+    """
+    directory = app.config.get('METRICS_DIR') or default_metrics_dir()
+    metrics = RequestMetrics(app, directory)
+    app.extensions['metrics'] = metrics
+
+    @app.before_request
+    def start_request_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def record_request_metrics(response):
+        start = g.pop('metrics_start', None)
+        if start is None:
+            return response
+        endpoint = request.endpoint
+        size = response.content_length
+        if size is None and response.is_streamed:
+            # Count streamed bodies as they are sent
+            response.response = _count_streamed_bytes(
+                response.response, lambda total: metrics.add_bytes(endpoint, total))
+        metrics.observe(endpoint, response.status_code, time.perf_counter() - start, size)
+        return response
+
+    # Public like a health check, for scrapers: only aggregate counts per
+    # endpoint, nothing about players or letters
+    @app.route('/metrics')
+    def metrics_endpoint():
+        """Prometheus text exposition aggregated across all workers."""
+        return Response(metrics.exposition(), mimetype='text/plain; version=0.0.4')
+
+    return metrics
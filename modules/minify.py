@@ -0,0 +1,268 @@
+"""
+HTML minification module.
+Minifies template sources (markup, inline <style> and inline <script>) when
+Jinja loads them, so each template is minified once per process and cached
+with the compiled template. Values rendered into a template, such as the
+letter text in santa_reply.html, are inserted after minification and are
+never altered.
+"""
+
+import re
+
+from jinja2 import BaseLoader
+
+# Jinja tags, expressions and comments are kept verbatim
+JINJA_PATTERN = re.compile(r'{{.*?}}|{%.*?%}|{#.*?#}', re.DOTALL)
+PLACEHOLDER = '\x00{}\x00'
+PLACEHOLDER_PATTERN = re.compile(r'\x00(\d+)\x00')
+
+# Elements whose content is handled separately from ordinary markup
+RAW_ELEMENT_PATTERN = re.compile(
+    r'(<(script|style|pre|textarea)\b[^>]*>)(.*?)(</\2\s*>)',
+    re.DOTALL | re.IGNORECASE
+)
+TAG_PATTERN = re.compile(r'<[^>]*>')
+HTML_COMMENT_PATTERN = re.compile(r'<!--(?!\[if).*?-->', re.DOTALL)
+QUOTED_PATTERN = re.compile(r'("[^"]*"|\'[^\']*\')')
+CSS_COMMENT_PATTERN = re.compile(
+    r'("(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\')|/\*.*?\*/', re.DOTALL
+)
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+JS_TYPES = ('', 'text/javascript', 'application/javascript', 'module')
+SCRIPT_TYPE_PATTERN = re.compile(r'\btype\s*=\s*["\']?([^"\'\s>]*)', re.IGNORECASE)
+
+# Characters and keywords after which a '/' starts a regex literal in JS
+REGEX_PRECEDERS = set('(,=:[!&|?{};+-*%<>~^')
+REGEX_KEYWORDS = {
+    'return', 'typeof', 'case', 'do', 'else', 'in', 'of', 'new',
+    'delete', 'void', 'throw', 'instanceof', 'yield', 'await'
+}
+CSS_PUNCTUATION_PATTERN = re.compile(r'\s*([{};,>])\s*')
+CSS_COLON_PATTERN = re.compile(r':\s+')
+
+
+def _collapse(text):
+    """Collapse whitespace runs, keeping a newline where there was one."""
+    return WHITESPACE_PATTERN.sub(lambda m: '\n' if '\n' in m.group() else ' ', text)
+
+
+def minify_css(css):
+    """
+    Minify a stylesheet: strip comments and redundant whitespace.
+    Quoted strings are left untouched.
+
+    Args:
+        css: Stylesheet source
+
+    Returns:
+        str: Minified stylesheet
+    """
+    css = CSS_COMMENT_PATTERN.sub(lambda m: m.group(1) or '', css)
+    parts = []
+    for i, part in enumerate(QUOTED_PATTERN.split(css)):
+        if i % 2:
+            parts.append(part)
+            continue
+        part = WHITESPACE_PATTERN.sub(' ', part)
+        part = CSS_PUNCTUATION_PATTERN.sub(r'\1', part)
+        part = CSS_COLON_PATTERN.sub(':', part)
+        parts.append(part)
+    return ''.join(parts).replace(';}', '}').strip()
+
+
+def minify_js(js):
+    """
+    Conservatively minify a script: strip comments and indentation.
+
+    Strings, template literals and regex literals are copied verbatim and
+    line breaks are preserved, so automatic semicolon insertion behaves
+    exactly as in the original source.
+
+    Args:
+        js: Script source
+
+    Returns:
+        str: Minified script
+    """
+    out = []
+    i = 0
+    length = len(js)
+
+    def emit_space(space):
+        # Merge with a preceding space token; a newline always wins
+        if out and out[-1] in (' ', '\n'):
+            out[-1] = '\n' if '\n' in (out[-1], space) else ' '
+        else:
+            out.append(space)
+
+    def last_significant():
+        for piece in reversed(out):
+            if piece not in (' ', '\n'):
+                return piece
+        return ''
+
+    def starts_regex():
+        previous = last_significant()
+        if not previous or previous[-1] in REGEX_PRECEDERS:
+            return True
+        word = re.search(r'[A-Za-z_$]+$', previous)
+        return bool(word) and word.group() in REGEX_KEYWORDS
+
+    while i < length:
+        char = js[i]
+        following = js[i + 1] if i + 1 < length else ''
+
+        if char in '\'"`':
+            end = i + 1
+            while end < length and js[end] != char:
+                if js[end] == '\\':
+                    end += 1
+                elif js[end] == '\n' and char != '`':
+                    break
+                end += 1
+            out.append(js[i:end + 1])
+            i = end + 1
+        elif char == '/' and following == '/':
+            end = js.find('\n', i)
+            i = length if end == -1 else end
+        elif char == '/' and following == '*':
+            end = js.find('*/', i + 2)
+            end = length if end == -1 else end + 2
+            emit_space('\n' if '\n' in js[i:end] else ' ')
+            i = end
+        elif char == '/' and starts_regex():
+            end = i + 1
+            in_class = False
+            while end < length and js[end] != '\n':
+                if js[end] == '\\':
+                    end += 1
+                elif js[end] == '[':
+                    in_class = True
+                elif js[end] == ']':
+                    in_class = False
+                elif js[end] == '/' and not in_class:
+                    break
+                end += 1
+            end += 1
+            while end < length and js[end].isalnum():
+                end += 1
+            out.append(js[i:end])
+            i = end
+        elif char.isspace():
+            end = i
+            while end < length and js[end].isspace():
+                end += 1
+            emit_space('\n' if '\n' in js[i:end] else ' ')
+            i = end
+        else:
+            end = i
+            while end < length and js[end] not in '\'"`/' and not js[end].isspace():
+                end += 1
+            end = max(end, i + 1)
+            out.append(js[i:end])
+            i = end
+
+    return ''.join(out).strip()
+
+
+def _minify_markup(html):
+    """Collapse whitespace in markup; whitespace inside attribute values is kept."""
+    html = HTML_COMMENT_PATTERN.sub('', html)
+    parts = []
+    position = 0
+    for match in TAG_PATTERN.finditer(html):
+        parts.append(_collapse(html[position:match.start()]))
+        tag = QUOTED_PATTERN.split(match.group())
+        parts.append(''.join(piece if i % 2 else _collapse(piece)
+                             for i, piece in enumerate(tag)))
+        position = match.end()
+    parts.append(_collapse(html[position:]))
+    return ''.join(parts)
+
+
+def _minify_raw_element(match):
+    open_tag, name, body, close_tag = match.groups()
+    name = name.lower()
+    if name == 'style':
+        body = minify_css(body)
+    elif name == 'script':
+        script_type = SCRIPT_TYPE_PATTERN.search(open_tag)
+        if (script_type.group(1).lower() if script_type else '') in JS_TYPES:
+            body = minify_js(body)
+    return _minify_markup(open_tag) + body + close_tag
+
+
+def minify_html(source):
+    """
+    Minify an HTML document or Jinja template source.
+
+    Collapses whitespace, strips HTML comments (conditional comments are
+    kept) and minifies inline <style> and <script> blocks. Content of <pre>
+    and <textarea> is left as is, as are all Jinja tags.
+
+    Args:
+        source: HTML or template source
+
+    Returns:
+        str: Minified source
+    """
+    protected = []
+
+    def protect(match):
+        protected.append(match.group())
+        return PLACEHOLDER.format(len(protected) - 1)
+
+    source = JINJA_PATTERN.sub(protect, source)
+
+    parts = []
+    position = 0
+    for match in RAW_ELEMENT_PATTERN.finditer(source):
+        parts.append(_minify_markup(source[position:match.start()]))
+        parts.append(_minify_raw_element(match))
+        position = match.end()
+    parts.append(_minify_markup(source[position:]))
+    minified = ''.join(parts).strip()
+
+    return PLACEHOLDER_PATTERN.sub(lambda m: protected[int(m.group(1))], minified)
+
+
+class MinifyingLoader(BaseLoader):
+    """
+    Jinja loader that minifies template sources from a wrapped loader.
+
+    Jinja caches compiled templates, so a template is minified once per
+    process (and again only when the source changes on disk in debug mode).
+    """
+
+    def __init__(self, loader, enabled=lambda: True):
+        """
+        Args:
+            loader: Loader providing the original template sources
+            enabled: Callable checked on each load, so minification can be
+                     switched off without rebuilding the environment
+        """
+        self.loader = loader
+        self.enabled = enabled
+
+    def get_source(self, environment, template):
+        source, filename, uptodate = self.loader.get_source(environment, template)
+        if self.enabled() and template.endswith('.html'):
+            source = minify_html(source)
+        return source, filename, uptodate
+
+    def list_templates(self):
+        return self.loader.list_templates()
+
+
+def init_app(app):
+    """
+    Minify all HTML templates of a Flask app while MINIFY_HTML is on.
+
+    Args:
+        app: Flask application
+    """
+    app.jinja_env.loader = MinifyingLoader(
+        app.jinja_env.loader,
+        enabled=lambda: app.config.get('MINIFY_HTML', True)
+    )
@@ -0,0 +1,175 @@
+"""
+On-demand sampling profiler module.
+Samples the stacks of all threads in this process at a fixed rate for a
+number of seconds and writes them as collapsed stacks, the input format of
+flamegraph.pl and speedscope:
+
+    MainThread;run (gunicorn/arbiter.py:201);... 42
+
+Each process writes its own file (profile-<pid>-<timestamp>.collapsed), so
+profiling is safe under gunicorn. A run is started from the admin endpoint
+or, when PROFILER_SIGNAL is set, by sending that signal to a worker.
+"""
+
+import os
+import signal
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from flask import jsonify, request, send_from_directory
+
+from modules.admin import admin_required
+
+MAX_SECONDS = 300
+MAX_RATE = 1000
+
+
+def default_profile_dir():
+    return os.path.join(tempfile.gettempdir(), 'santa-profiles')
+
+
+_labels = {}
+
+
+def _frame_label(code):
+    label = _labels.get(code)
+    if label is None:
+        filename = code.co_filename
+        for path in sorted(sys.path, key=len, reverse=True):
+            if path and filename.startswith(path + os.sep):
+                filename = filename[len(path) + 1:]
+                break
+        label = _labels[code] = f'{code.co_name} ({filename}:{code.co_firstlineno})'
+    return label
+
+
+def collapse_stack(frame):
+    """Turn a frame into a root-to-leaf list of frame labels."""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame.f_code))
+        frame = frame.f_back
+    labels.reverse()
+    return labels
+
+
+class SamplingProfiler:
+    """Background thread that samples all other threads' stacks."""
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds, rate):
+        """
+        Start a profiling run unless one is already running in this process.
+
+        Args:
+            seconds: How long to sample
+            rate: Samples per second
+
+        Returns:
+            str: Path of the output file, or None if a run is in progress
+        """
+        with self._lock:
+            if self.running:
+                return None
+            os.makedirs(self.output_dir, exist_ok=True)
+            path = os.path.join(self.output_dir,
+                                f'profile-{os.getpid()}-{int(time.time())}.collapsed')
+            self._thread = threading.Thread(
+                target=self._run, args=(seconds, rate, path),
+                name='sampling-profiler', daemon=True
+            )
+            self._thread.start()
+            return path
+
+    def _run(self, seconds, rate, path):
+        own_ident = threading.get_ident()
+        interval = 1.0 / rate
+        counts = Counter()
+        deadline = time.monotonic() + seconds
+        next_sample = time.monotonic()
+
+        while next_sample < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                stack = [names.get(ident, f'thread-{ident}')] + collapse_stack(frame)
+                counts[';'.join(label.replace(';', ':') for label in stack)] += 1
+            next_sample += interval
+            time.sleep(max(0.0, next_sample - time.monotonic()))
+
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as output:
+            for stack, count in counts.most_common():
+                output.write(f'{stack} {count}\n')
+        os.replace(tmp_path, path)
+
+
+def _bounded(value, default, upper):
+    try:
+        value = float(value) if value is not None else default
+    except ValueError:
+        value = default
+    return min(max(value, 0.1), upper)
+
+
+def init_app(app):
+    """
+    Register the admin profiling routes and the optional signal trigger.
+
+    Args:
+        app: Flask application
+    """
+    output_dir = app.config.get('PROFILE_DIR') or default_profile_dir()
+    default_seconds = app.config.get('PROFILER_SECONDS', 30)
+    default_rate = app.config.get('PROFILER_RATE', 100)
+    profiler = SamplingProfiler(output_dir)
+    app.extensions['profiler'] = profiler
+
+    signal_name = app.config.get('PROFILER_SIGNAL')
+    if signal_name and threading.current_thread() is threading.main_thread():
+        def handle_profile_signal(signum, frame):
+            # The handler runs on the main thread, possibly inside start()
+            # with its lock held, so it hands the call to a new thread
+            threading.Thread(target=profiler.start, args=(default_seconds, default_rate),
+                             name='profiler-signal', daemon=True).start()
+        signal.signal(getattr(signal, signal_name), handle_profile_signal)
+
+    @app.route('/admin/profile', methods=['POST'])
+    @admin_required
+    def start_profile():
+        """Start sampling this worker for ?seconds=N at ?rate=Hz."""
+        seconds = _bounded(request.args.get('seconds'), default_seconds, MAX_SECONDS)
+        rate = _bounded(request.args.get('rate'), default_rate, MAX_RATE)
+        path = profiler.start(seconds, rate)
+        if path is None:
+            return jsonify(error='a profile is already running in this worker'), 409
+        return jsonify(pid=os.getpid(), seconds=seconds, rate=rate,
+                       file=os.path.basename(path)), 202
+
+    @app.route('/admin/profile', methods=['GET'])
+    @admin_required
+    def list_profiles():
+        """List finished profiles from all workers."""
+        try:
+            files = sorted(f for f in os.listdir(output_dir) if f.endswith('.collapsed'))
+        except FileNotFoundError:
+            files = []
+        return jsonify(profiles=files)
+
+    @app.route('/admin/profile/<name>')
+    @admin_required
+    def download_profile(name):
+        """Download a collapsed-stack file."""
+        return send_from_directory(output_dir, name, mimetype='text/plain')
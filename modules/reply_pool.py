@@ -0,0 +1,96 @@
+"""
+Reply pool module.
+Runs emotion detection and reply generation in worker processes for bulk
+letter intake, so a class's worth of letters uses every core instead of
+one request thread.
+
+Pool processes are started with 'spawn' rather than fork: forking a
+gunicorn worker would copy the locks of its background threads (letter
+archive writer, metrics, watchdog) in whatever state they happened to be.
+"""
+
+import atexit
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from modules.santa_reply_generator import detect_emotion_from_text, generate_santa_reply
+
+_pool = None
+_pool_pid = None
+_pool_workers = None
+_lock = threading.Lock()
+
+
+def reply_chunk(letters):
+    """
+    Detect the emotion of and write a reply to each letter (runs in a pool process).
+
+    Args:
+        letters: List of letter dicts, as save_letter_data stores them
+
+    Returns:
+        list: (emotion, reply) per letter
+    """
+    return [(detect_emotion_from_text(letter['feeling']) if letter.get('feeling') else None,
+             generate_santa_reply(letter))
+            for letter in letters]
+
+
+def get_pool(workers):
+    """The process pool of this process, started on first use."""
+    global _pool, _pool_pid, _pool_workers
+    with _lock:
+        if _pool is None or _pool_pid != os.getpid() or _pool_workers != workers:
+            if _pool is not None and _pool_pid == os.getpid():
+                _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'))
+            _pool_pid = os.getpid()
+            _pool_workers = workers
+            atexit.register(shutdown)
+        return _pool
+
+
+def shutdown():
+    """Stop the pool processes, e.g. from gunicorn's worker_exit hook."""
+    global _pool
+    with _lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.shutdown(wait=True, cancel_futures=True)
+        _pool = None
+
+
+def map_chunks(chunks, workers, max_pending=None):
+    """
+    Run reply_chunk over chunks of letters, yielding results in order.
+
+    Only `max_pending` chunks are read ahead and in flight at once, so
+    memory stays bounded however many chunks the iterable produces.
+
+    Args:
+        chunks: Iterable of lists of letters
+        workers: Pool processes; 0 runs everything in this process
+        max_pending: Chunks submitted but not yet yielded (default 2 per worker)
+
+    Yields:
+        list: reply_chunk's result for each chunk
+    """
+    if workers <= 0:
+        for chunk in chunks:
+            yield reply_chunk(chunk)
+        return
+    pool = get_pool(workers)
+    pending = deque()
+    try:
+        for chunk in chunks:
+            pending.append(pool.submit(reply_chunk, chunk))
+            if len(pending) >= (max_pending or 2 * workers):
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        # Abandoned part way (e.g. the client went away): drop queued work
+        for future in pending:
+            future.cancel()
@@ -5,6 +5,9 @@ Generates personalized, emotional letters from Santa based on user responses.
 
 import random
 
+from modules.event_log import log_event
+from modules.timing import timed
+
 # Emotional response templates based on feelings
 FEELING_RESPONSES = {
     'happy': [
@@ -113,6 +116,7 @@ def detect_emotion_from_text(text):
     
     return 'generic'
 
+@timed('reply')
 def generate_santa_reply(letter_data):
     """
     Generate a personalized, emotional letter from Santa.
@@ -130,6 +134,8 @@ def generate_santa_reply(letter_data):
     age = letter_data.get('age')
     country = letter_data.get('country')
     
+    detected_emotion = detect_emotion_from_text(feeling) if feeling else None
+    
     # Start building the letter
     letter_parts = []
     
@@ -176,15 +182,15 @@ def generate_santa_reply(letter_data):
     
     # Address feeling/emotion
     if feeling:
-        detected_emotion = detect_emotion_from_text(feeling)
-        
         if detected_emotion in FEELING_RESPONSES:
             letter_parts.append(random.choice(FEELING_RESPONSES[detected_emotion]))
         else:
             letter_parts.append(random.choice(GENERIC_EMOTIONAL_RESPONSES))
         
-        # Add personalized touch about their specific feeling
-        letter_parts.append(f"When you wrote '{feeling[:50]}{'...' if len(feeling) > 50 else ''}', I could sense the depth of what you're experiencing.")
+        # Add personalized touch about their specific feeling, unless the
+        # content scanner flagged the letter: worrying words aren't quoted back
+        if not letter_data.get('flags'):
+            letter_parts.append(f"When you wrote '{feeling[:50]}{'...' if len(feeling) > 50 else ''}', I could sense the depth of what you're experiencing.")
         letter_parts.append("")
     
     # Address wish
@@ -223,7 +229,9 @@ def generate_santa_reply(letter_data):
     letter_parts.append("")
     letter_parts.append("P.S. Remember, you are never alone, and you are deeply valued.")
     
-    return "\n".join(letter_parts)
+    reply = "\n".join(letter_parts)
+    log_event('reply.generated', emotion=detected_emotion, length=len(reply))
+    return reply
 
 
 
@@ -0,0 +1,120 @@
+"""
+Session interface module.
+Signed-cookie sessions (Flask's default) with instrumentation hooks.
+
+Since letter_data and santa_reply live in the cookie, a long letter can push
+the session past the ~4KB browsers accept per cookie, and the browser then
+silently drops it. The interface measures the cookie on every response,
+exports the size to /metrics, logs a warning with a per-field breakdown
+near the limit and, when SESSION_TRIM is on, shrinks the largest fields
+before the cookie becomes invalid.
+"""
+
+from flask import request
+from flask.sessions import SecureCookieSessionInterface
+
+from modules.event_log import log_event
+from modules.timing import phase
+
+# Letter fields that may be shortened, and the length they never go below
+TRIMMABLE_LETTER_FIELDS = ('feeling', 'wish', 'memory')
+MIN_TRIMMED_LENGTH = 280
+
+
+def session_breakdown(serializer, session):
+    """
+    Approximate serialized size of each session field.
+
+    Args:
+        serializer: Session JSON serializer
+        session: Session mapping
+
+    Returns:
+        dict: Field name (nested as 'letter_data.wish') to bytes, largest first
+    """
+    sizes = {}
+    for key, value in session.items():
+        sizes[key] = len(serializer.dumps({key: value}))
+        if isinstance(value, dict):
+            for field, field_value in value.items():
+                sizes[f'{key}.{field}'] = len(serializer.dumps({field: field_value}))
+    return dict(sorted(sizes.items(), key=lambda item: item[1], reverse=True))
+
+
+def _shrink(session):
+    """Halve the longest letter field, or drop the regenerable reply."""
+    letter = session.get('letter_data') or {}
+    lengths = [(len(letter.get(field) or ''), field) for field in TRIMMABLE_LETTER_FIELDS]
+    length, field = max(lengths)
+    if length > MIN_TRIMMED_LENGTH:
+        letter[field] = letter[field][:max(length // 2, MIN_TRIMMED_LENGTH)].rstrip() + '…'
+        session.modified = True
+        return field
+    if 'santa_reply' in session:
+        # The reply page regenerates the reply when it is missing
+        session.pop('santa_reply')
+        return 'santa_reply'
+    return None
+
+
+class InstrumentedSessionInterface(SecureCookieSessionInterface):
+    """Cookie sessions with timing, size telemetry and optional trimming."""
+
+    def open_session(self, app, request):
+        with phase('session'):
+            return super().open_session(app, request)
+
+    def save_session(self, app, session, response):
+        super().save_session(app, session, response)
+        name = self.get_cookie_name(app)
+        size = self._cookie_size(response, name)
+
+        limit = app.config.get('SESSION_SIZE_LIMIT', 4000)
+        trimmed = []
+        if size is not None and size > limit and app.config.get('SESSION_TRIM', False):
+            while size > limit:
+                field = _shrink(session)
+                if field is None:
+                    break
+                trimmed.append(field)
+                self._remove_cookie(response, name)
+                super().save_session(app, session, response)
+                size = self._cookie_size(response, name)
+
+        sent = size is not None
+        if not sent:
+            # Cookie not re-sent: the browser keeps the one it sent us
+            value = request.cookies.get(name)
+            size = len(name) + 1 + len(value) if value else 0
+
+        metrics = app.extensions.get('metrics')
+        if metrics is not None:
+            metrics.observe_session_size(request.endpoint, size)
+
+        # Only warn when the cookie is written, not on every request carrying it
+        if sent and (size >= app.config.get('SESSION_SIZE_WARN', 3584) or trimmed):
+            breakdown = session_breakdown(self.serializer, session)
+            app.logger.warning(
+                'Session cookie is %d bytes on %s (limit %d), trimmed %s, largest fields: %s',
+                size, request.endpoint, limit, trimmed or 'nothing',
+                ', '.join(f'{k}={v}' for k, v in list(breakdown.items())[:5])
+            )
+            log_event('session.near_limit', endpoint=request.endpoint, size=size,
+                      trimmed=trimmed, fields=breakdown)
+
+    @staticmethod
+    def _cookie_size(response, name):
+        """Size of name=value of the session cookie set on a response, if any."""
+        prefix = f'{name}='
+        for header in response.headers.getlist('Set-Cookie'):
+            if header.startswith(prefix):
+                return len(header.split(';', 1)[0])
+        return None
+
+    @staticmethod
+    def _remove_cookie(response, name):
+        prefix = f'{name}='
+        others = [h for h in response.headers.getlist('Set-Cookie') if not h.startswith(prefix)]
+        response.headers.remove('Set-Cookie')
+        for header in others:
+            response.headers.add('Set-Cookie', header)
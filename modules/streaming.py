@@ -0,0 +1,49 @@
+"""
+Streaming template rendering helpers.
+Turns the many tiny chunks Jinja yields while generating a page into a few
+network-sized writes, sending the document head as early as possible.
+"""
+
+HEAD_END = '</head>'
+
+
+def flush_head_first(chunks, buffer_size=8192):
+    """
+    Coalesce rendered template chunks, flushing the <head> immediately.
+
+    Everything up to and including ``</head>`` is sent as soon as it has been
+    rendered so the browser can start fetching the stylesheet and fonts. The
+    rest of the page is sent in buffers of about ``buffer_size`` characters,
+    which puts the above-the-fold markup on the wire before the large inline
+    scripts at the end of the game pages are rendered.
+
+    Args:
+        chunks: Iterable of strings, e.g. from ``flask.stream_template``
+        buffer_size: Characters to collect before each flush after the head
+
+    Yields:
+        str: Page fragments ready to be written to the client
+    """
+    buffer = []
+    buffered = 0
+    head_sent = False
+
+    for chunk in chunks:
+        if not chunk:
+            continue
+        buffer.append(chunk)
+        buffered += len(chunk)
+
+        if not head_sent:
+            if HEAD_END not in chunk:
+                continue
+            head_sent = True
+        elif buffered < buffer_size:
+            continue
+
+        yield ''.join(buffer)
+        buffer = []
+        buffered = 0
+
+    if buffer:
+        yield ''.join(buffer)
@@ -0,0 +1,162 @@
+"""
+Request phase timing module.
+Lightweight timers for the phases of a request (session decode, guards,
+letter lookup, reply generation, template render), reported in a
+Server-Timing header that browser devtools display, and optionally as one
+structured log line per request.
+
+While timing is disabled, ``phase()`` returns a shared no-op context
+manager and ``timed`` wrappers call straight through, so instrumented code
+costs one global lookup.
+"""
+
+import json
+import time
+from functools import wraps
+
+from flask import g, has_request_context, request
+from flask.signals import before_render_template, template_rendered
+
+_enabled = False
+
+
+class _NullPhase:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_PHASE = _NullPhase()
+
+
+class _Phase:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+def is_enabled():
+    return _enabled
+
+
+def enable(enabled=True):
+    """Switch phase recording on or off for the whole process."""
+    global _enabled
+    _enabled = enabled
+
+
+def record(name, duration):
+    """
+    Add a duration to a phase of the current request.
+    Repeated phases (e.g. several guard checks) are summed.
+
+    Args:
+        name: Phase name, used as the Server-Timing metric name
+        duration: Duration in seconds
+    """
+    phases = g.get('timing_phases')
+    if phases is None:
+        phases = g.timing_phases = {}
+    phases[name] = phases.get(name, 0.0) + duration
+
+
+def phase(name):
+    """
+    Time a block as a phase of the current request.
+
+    Example:
+        with phase('render'):
+            ...
+    """
+    if not _enabled or not has_request_context():
+        return NULL_PHASE
+    return _Phase(name)
+
+
+def timed(name):
+    """Decorator that records every call of a function as a request phase."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled or not has_request_context():
+                return func(*args, **kwargs)
+            with _Phase(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def current_phases():
+    """Phases recorded so far for the current request, in seconds."""
+    return g.get('timing_phases') or {}
+
+
+def format_server_timing(phases):
+    """
+    Format phases as a Server-Timing header value.
+
+    Args:
+        phases: Mapping of phase name to seconds
+
+    Returns:
+        str: e.g. 'session;dur=0.081, render;dur=1.402'
+    """
+    return ', '.join(f'{name};dur={duration * 1000:.3f}' for name, duration in phases.items())
+
+
+def init_app(app, header=True, log=False):
+    """
+    Record request phases and report them for every request.
+
+    Args:
+        app: Flask application
+        header: Add a Server-Timing header to responses
+        log: Write one JSON log line with the phases per request
+    """
+    enable()
+
+    def start_render(sender, template, context, **extra):
+        if has_request_context():
+            g.timing_render_start = time.perf_counter()
+
+    def finish_render(sender, template, context, **extra):
+        start = g.pop('timing_render_start', None) if has_request_context() else None
+        if start is not None:
+            record('render', time.perf_counter() - start)
+
+    # Keep strong references: blinker holds receivers weakly
+    app.extensions['timing_receivers'] = (start_render, finish_render)
+    before_render_template.connect(start_render, app)
+    template_rendered.connect(finish_render, app)
+
+    @app.before_request
+    def start_request_timing():
+        g.timing_start = time.perf_counter()
+
+    @app.after_request
+    def report_request_timing(response):
+        phases = dict(current_phases())
+        start = g.get('timing_start')
+        if start is not None:
+            phases['total'] = time.perf_counter() - start
+        if header and phases:
+            response.headers.add('Server-Timing', format_server_timing(phases))
+        if log:
+            app.logger.info(json.dumps({
+                'event': 'server_timing',
+                'endpoint': request.endpoint,
+                'status': response.status_code,
+                'phases_ms': {name: round(d * 1000, 3) for name, d in phases.items()},
+            }))
+        return response
@@ -0,0 +1,203 @@
+"""
+Real-user Web Vitals module.
+base.html carries a small script that observes LCP, CLS, INP and TTFB on
+every page view and sends them, batched per page view, with
+navigator.sendBeacon when the page is hidden. A page hidden again after
+a change sends all its metrics again under the same page-view id, and the
+report counts only the last beacon of each view. POST /telemetry/vitals
+validates the batch and queues it for a background JsonlWriter, so a
+beacon costs one JSON parse and a queue put: no file I/O or fsync on the
+request thread.
+
+``flask vitals-report`` aggregates the beacons into per-route percentiles.
+"""
+
+import json
+import math
+import os
+import re
+import time
+from collections import defaultdict
+
+import click
+from flask import jsonify, request
+
+from modules.event_log import JsonlWriter, iter_records
+
+METRICS = ('LCP', 'CLS', 'INP', 'TTFB')
+PERCENTILES = (50, 75, 95)
+
+# Largest plausible value per metric (milliseconds, or unitless for CLS)
+MAX_VALUES = {'LCP': 600000, 'INP': 600000, 'TTFB': 600000, 'CLS': 100}
+
+MAX_BODY_BYTES = 16 * 1024
+MAX_BATCH = 20
+VIEW_ID = re.compile(r'[0-9a-z]{1,32}')
+
+# Web Vitals "good" / "poor" boundaries, shown next to the p75 in reports
+THRESHOLDS = {'LCP': (2500, 4000), 'CLS': (0.1, 0.25), 'INP': (200, 500), 'TTFB': (800, 1800)}
+
+
+def default_vitals_dir(app):
+    return app.config.get('VITALS_DIR') or os.path.join(app.instance_path, 'vitals')
+
+
+def clean_view(view, routes):
+    """
+    Validate one page view from a beacon.
+
+    Args:
+        view: Decoded {'route': ..., 'view': page-view id, 'metrics': {...}} object
+        routes: Known endpoint names; other routes are rejected
+
+    Returns:
+        dict: The record to store, or None if the view is invalid
+    """
+    if not isinstance(view, dict) or view.get('route') not in routes:
+        return None
+    metrics = view.get('metrics')
+    if not isinstance(metrics, dict):
+        return None
+    record = {}
+    for name in METRICS:
+        value = metrics.get(name)
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+        if not math.isfinite(value) or not 0 <= value <= MAX_VALUES[name]:
+            continue
+        record[name] = round(value, 4 if name == 'CLS' else 1)
+    if not record:
+        return None
+    record['route'] = view['route']
+    view_id = view.get('view')
+    if isinstance(view_id, str) and VIEW_ID.fullmatch(view_id):
+        record['view'] = view_id
+    return record
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    rank = max(math.ceil(pct / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+def aggregate(records, since=None):
+    """
+    Group beacon values by route and metric. Of several beacons from one
+    page view, only the last counts.
+
+    Args:
+        records: Iterable of stored beacon records
+        since: Only count records with a timestamp at or after this
+
+    Returns:
+        dict: {route: {metric: sorted list of values}}
+    """
+    values = defaultdict(lambda: defaultdict(list))
+    latest = {}
+
+    def add(record):
+        for name in METRICS:
+            if name in record:
+                values[record.get('route')][name].append(record[name])
+
+    for record in records:
+        if since is not None and record.get('ts', 0) < since:
+            continue
+        if 'view' not in record:
+            add(record)
+            continue
+        # Workers write separate files, so compare times rather than file order
+        key = record.get('route'), record['view']
+        if key not in latest or record.get('ts', 0) >= latest[key].get('ts', 0):
+            latest[key] = record
+    for record in latest.values():
+        add(record)
+    for metrics in values.values():
+        for samples in metrics.values():
+            samples.sort()
+    return values
+
+
+def _rating(name, value):
+    good, poor = THRESHOLDS[name]
+    return 'good' if value <= good else 'poor' if value > poor else 'needs-improvement'
+
+
+def _format_value(name, value):
+    return f'{value:.3f}' if name == 'CLS' else f'{value:.0f}ms'
+
+
+def init_app(app, sample_rate=1.0):
+    """
+    Inject the beacon settings into templates, accept beacons and register
+    ``flask vitals-report``.
+
+    Args:
+        app: Flask application
+        sample_rate: Fraction of page views that send a beacon
+
+    Returns:
+        JsonlWriter: The writer the beacons go to
+    """
+    writer = JsonlWriter(default_vitals_dir(app), 'vitals', flush_interval=2.0)
+    app.extensions['vitals'] = writer
+
+    @app.context_processor
+    def inject_vitals():
+        return {'vitals': {'route': request.endpoint, 'rate': sample_rate}
+                if request.endpoint else None}
+
+    @app.route('/telemetry/vitals', methods=['POST'])
+    def collect_vitals():
+        """Accept a batch of page-view measurements from sendBeacon."""
+        if (request.content_length or 0) > MAX_BODY_BYTES:
+            return jsonify(error='beacon too large'), 413
+        # A chunked body has no Content-Length, so read no more than the limit
+        body = request.stream.read(MAX_BODY_BYTES + 1)
+        if len(body) > MAX_BODY_BYTES:
+            return jsonify(error='beacon too large'), 413
+        # sendBeacon posts strings as text/plain, so parse regardless of type
+        try:
+            batch = json.loads(body)
+        except ValueError:
+            batch = None
+        if isinstance(batch, dict):
+            batch = [batch]
+        if not isinstance(batch, list):
+            return jsonify(error='expected a JSON object or list'), 400
+        now = time.time()
+        routes = app.view_functions
+        for view in batch[:MAX_BATCH]:
+            record = clean_view(view, routes)
+            if record is not None:
+                record['ts'] = now
+                writer.emit(record)
+        return '', 204
+
+    @app.cli.command('vitals-report')
+    @click.option('--hours', type=float, default=None,
+                  help='Only include beacons from the last N hours.')
+    @click.option('--dir', 'directory', default=None,
+                  help='Beacon folder (default: VITALS_DIR or instance/vitals).')
+    def vitals_report_command(hours, directory):
+        """Print per-route Web Vitals percentiles."""
+        since = time.time() - hours * 3600 if hours else None
+        values = aggregate(iter_records(directory or default_vitals_dir(app), 'vitals'), since)
+        if not values:
+            click.echo('No beacons recorded.')
+            return
+
+        header = ''.join(f'{f"p{pct}":>10}' for pct in PERCENTILES)
+        click.echo(f"{'route':<22}{'metric':<7}{'count':>7}{header}  p75 rating")
+        for route in sorted(values):
+            for name in METRICS:
+                samples = values[route].get(name)
+                if not samples:
+                    continue
+                cells = ''.join(f'{_format_value(name, percentile(samples, pct)):>10}'
+                                for pct in PERCENTILES)
+                click.echo(f'{route:<22}{name:<7}{len(samples):>7}{cells}  '
+                           f'{_rating(name, percentile(samples, 75))}')
+
+    return writer
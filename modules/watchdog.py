@@ -0,0 +1,218 @@
+"""
+Slow-request watchdog module.
+Every request registers itself in a table of in-flight requests. A monitor
+thread scans the table a few times per threshold, and for each request
+running longer than SLOW_REQUEST_MS it grabs the worker thread's stack with
+sys._current_frames(). The request itself never waits on the watchdog.
+
+When a slow request finishes, its endpoint, duration, status, phase timings
+(see modules.timing) and the captured stack (empty if it finished before a
+scan reached it) go to the event log as a
+'request.slow' event and into a ring buffer of the last N slow requests,
+which /admin/slow-requests serves for the worker that answers.
+"""
+
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+
+from flask import g, jsonify, request
+
+from modules.admin import admin_required
+from modules.event_log import log_event
+
+MAX_STACK_DEPTH = 40
+
+
+class _InFlight:
+    __slots__ = ('ident', 'thread_name', 'start', 'started_at', 'method', 'path',
+                 'endpoint', 'phases', 'status', 'record')
+
+    def __init__(self, ident, thread_name, phases):
+        self.ident = ident
+        self.thread_name = thread_name
+        self.start = time.perf_counter()
+        self.started_at = time.time()
+        self.method = request.method
+        self.path = request.path
+        self.endpoint = request.endpoint
+        self.phases = phases
+        self.status = None
+        self.record = None
+
+
+def capture_stack(ident):
+    """
+    Format the current stack of another thread.
+
+    Args:
+        ident: Thread identifier
+
+    Returns:
+        list: 'File "...", line N, in func' entries, innermost last
+    """
+    frame = sys._current_frames().get(ident)
+    if frame is None:
+        return []
+    entries = traceback.extract_stack(frame)[-MAX_STACK_DEPTH:]
+    return [line.rstrip('\n') for line in traceback.format_list(entries)]
+
+
+class SlowRequestWatchdog:
+    """In-flight request table plus the thread that watches it."""
+
+    def __init__(self, threshold, history=50, interval=None):
+        """
+        Args:
+            threshold: Seconds after which a request counts as slow
+            history: Slow requests kept for the admin route
+            interval: Seconds between scans (default: a quarter of threshold)
+        """
+        self.threshold = threshold
+        self.interval = interval or max(threshold / 4, 0.01)
+        self.recent = deque(maxlen=history)
+        self._active = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def begin(self, phases):
+        """Register the current request; returns its table entry."""
+        if self._pid != os.getpid():
+            self._start()
+        thread = threading.current_thread()
+        entry = _InFlight(thread.ident, thread.name, phases)
+        with self._lock:
+            self._active[entry.ident] = entry
+        return entry
+
+    def finish(self, entry):
+        """Remove a request from the table and report it if it was slow."""
+        now = time.perf_counter()
+        with self._lock:
+            if self._active.get(entry.ident) is entry:
+                del self._active[entry.ident]
+            record = entry.record
+            if record is None:
+                if now - entry.start < self.threshold:
+                    return
+                # Slow, but finished before a scan reached it: no stack to show
+                record = entry.record = self._record(entry, None, [])
+                self.recent.append(record)
+            # Under the lock, since the record is already in `recent`
+            record.update(
+                duration_ms=round((now - entry.start) * 1000, 3),
+                status=entry.status,
+                phases_ms=_phases_ms(entry.phases),
+                finished=True,
+            )
+        log_event('request.slow', **record)
+
+    def recent_requests(self):
+        """Copies of the slow requests kept, newest first."""
+        with self._lock:
+            return [dict(record) for record in reversed(self.recent)]
+
+    def _start(self):
+        # Started lazily, and again after a fork, since threads don't survive fork
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._active = {}
+            self._thread = threading.Thread(target=self._run, name='slow-request-watchdog',
+                                            daemon=True)
+            self._pid = os.getpid()
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            now = time.perf_counter()
+            with self._lock:
+                overdue = [entry for entry in self._active.values()
+                           if entry.record is None and now - entry.start >= self.threshold]
+            for entry in overdue:
+                self._capture(entry, now)
+
+    def _capture(self, entry, now):
+        record = self._record(entry, now, capture_stack(entry.ident))
+        with self._lock:
+            # The request may have finished while its stack was captured
+            if self._active.get(entry.ident) is entry:
+                entry.record = record
+                self.recent.append(record)
+
+    def _record(self, entry, captured_at, stack):
+        return {
+            'pid': os.getpid(),
+            'thread': entry.thread_name,
+            'method': entry.method,
+            'path': entry.path,
+            'endpoint': entry.endpoint,
+            'started_at': entry.started_at,
+            'threshold_ms': round(self.threshold * 1000, 3),
+            'captured_after_ms': (round((captured_at - entry.start) * 1000, 3)
+                                  if captured_at is not None else None),
+            'phases_ms': _phases_ms(entry.phases),
+            'stack': stack,
+            'finished': False,
+        }
+
+
+def _phases_ms(phases):
+    # dict() copies atomically under the GIL while the request adds phases
+    return {name: round(duration * 1000, 3) for name, duration in dict(phases).items()}
+
+
+def init_app(app, threshold_ms=2000, history=50):
+    """
+    Watch every request and keep the slow ones.
+
+    Phase timings are only recorded when modules.timing is enabled; the app
+    turns it on (without the Server-Timing header) while the watchdog runs.
+
+    Args:
+        app: Flask application
+        threshold_ms: Duration after which a request is captured
+        history: Slow requests kept per worker for /admin/slow-requests
+
+    Returns:
+        SlowRequestWatchdog: The watchdog, also stored in app.extensions
+    """
+    watchdog = SlowRequestWatchdog(threshold_ms / 1000, history)
+    app.extensions['watchdog'] = watchdog
+
+    @app.before_request
+    def watch_request():
+        # Share the phase dict with modules.timing so captures see live phases
+        phases = g.get('timing_phases')
+        if phases is None:
+            phases = g.timing_phases = {}
+        g.watchdog_entry = watchdog.begin(phases)
+
+    @app.after_request
+    def note_status(response):
+        entry = g.get('watchdog_entry')
+        if entry is not None:
+            entry.status = response.status_code
+        return response
+
+    @app.teardown_request
+    def unwatch_request(exc):
+        entry = g.pop('watchdog_entry', None)
+        if entry is not None:
+            if exc is not None and entry.status is None:
+                entry.status = 500
+            watchdog.finish(entry)
+
+    @app.route('/admin/slow-requests')
+    @admin_required
+    def slow_requests():
+        """The last slow requests seen by this worker, newest first."""
+        return jsonify(pid=os.getpid(), threshold_ms=threshold_ms,
+                       requests=watchdog.recent_requests())
+
+    return watchdog
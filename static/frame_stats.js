@@ -0,0 +1,93 @@
+// Frame-time telemetry for the game pages (see modules/frames.py)
+
+(function() {
+    'use strict';
+
+    const LONG_FRAME_MS = 50;
+    // Gaps this long mean the tab was hidden or the device slept, not jank
+    const MAX_FRAME_MS = 1000;
+
+    const noop = { start() {}, finish() {} };
+
+    /**
+     * Create a recorder that histograms requestAnimationFrame intervals while
+     * a game runs and sends one beacon when the game ends (or the page is
+     * left mid-game).
+     *
+     * config is {url, buckets} from the server, or null when disabled.
+     */
+    function create(game, config) {
+        if (!config || !navigator.sendBeacon || !window.requestAnimationFrame) return noop;
+
+        const bounds = config.buckets;
+        let counts, frames, longFrames, maxFrame, startedAt, lastFrame, rafId = null, pending = false;
+
+        function reset() {
+            counts = new Array(bounds.length + 1).fill(0);
+            frames = 0;
+            longFrames = 0;
+            maxFrame = 0;
+            startedAt = performance.now();
+            lastFrame = null;
+        }
+
+        function onFrame(now) {
+            if (lastFrame !== null && !document.hidden) {
+                const delta = now - lastFrame;
+                if (delta < MAX_FRAME_MS) {
+                    let i = 0;
+                    while (i < bounds.length && delta > bounds[i]) i++;
+                    counts[i]++;
+                    frames++;
+                    if (delta > LONG_FRAME_MS) longFrames++;
+                    if (delta > maxFrame) maxFrame = delta;
+                }
+            }
+            lastFrame = now;
+            rafId = requestAnimationFrame(onFrame);
+        }
+
+        function send(outcome) {
+            if (!pending) return;
+            pending = false;
+            if (rafId !== null) {
+                cancelAnimationFrame(rafId);
+                rafId = null;
+            }
+            if (!frames) return;
+            navigator.sendBeacon(config.url, JSON.stringify({
+                game: game,
+                outcome: outcome,
+                duration_ms: Math.round(performance.now() - startedAt),
+                frames: frames,
+                long_frames: longFrames,
+                max_ms: Math.round(maxFrame * 10) / 10,
+                buckets: counts,
+                device: {
+                    cores: navigator.hardwareConcurrency || null,
+                    memory: navigator.deviceMemory || null,
+                    mobile: navigator.userAgentData ? navigator.userAgentData.mobile
+                        : /Mobi|Android|iPhone|iPad/i.test(navigator.userAgent)
+                }
+            }));
+        }
+
+        addEventListener('pagehide', () => send('abandoned'));
+
+        return {
+            // (Re)start recording for a new round
+            start() {
+                if (rafId !== null) cancelAnimationFrame(rafId);
+                reset();
+                pending = true;
+                rafId = requestAnimationFrame(onFrame);
+            },
+            // Stop recording and send the round's stats
+            finish(outcome) {
+                send(outcome);
+            }
+        };
+    }
+
+    window.FrameStats = { create: create };
+})();